@@ -0,0 +1,81 @@
+﻿import time
+from typing import List, Tuple
+
+
+class AIMDController:
+    """
+    Additive-increase/multiplicative-decrease limit on the number of requests in flight, the
+    congestion control of TCP applied to a chatbot endpoint: every successful response raises
+    the limit by `increase / limit`, so about `increase` per round of `limit` requests, and a
+    congestion signal (throttled response or timeout) multiplies it by `decrease`. The limit
+    then oscillates around the concurrency the backend sustains.
+    Attributes:
+        limit (float): The current limit, whose integer part is the allowed concurrency.
+        min_limit (int): The lowest allowed concurrency.
+        max_limit (int): The highest allowed concurrency.
+        increase (float): The additive increase per round of `limit` successful requests.
+        decrease (float): The multiplicative decrease factor applied on congestion.
+        decreases (int): The number of decreases applied.
+        history (List[Tuple[float, int]]): The (monotonic time, concurrency) of every change of the concurrency.
+    """
+
+    def __init__(
+        self,
+        initial: int = 1,
+        min_limit: int = 1,
+        max_limit: int = 1000,
+        increase: float = 1.0,
+        decrease: float = 0.5,
+    ):
+        if not 0 < decrease < 1:
+            raise ValueError(f"The decrease factor must be between 0 and 1, got {decrease}")
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase = increase
+        self.decrease = decrease
+        self.limit = float(min(max(initial, min_limit), max_limit))
+        self.decreases = 0
+        self._last_decrease = float("-inf")
+        self.history: List[Tuple[float, int]] = [(time.monotonic(), self.concurrency)]
+
+    @property
+    def concurrency(self) -> int:
+        return max(self.min_limit, int(self.limit))
+
+    def _update(self, limit: float):
+        previous = self.concurrency
+        self.limit = min(max(limit, self.min_limit), self.max_limit)
+        if self.concurrency != previous:
+            self.history.append((time.monotonic(), self.concurrency))
+
+    def on_success(self):
+        self._update(self.limit + self.increase / self.limit)
+
+    def on_congestion(self, started: float):
+        """
+        Decreases the limit, unless the request was sent before the last decrease: the
+        throttled responses of one burst are a single congestion event, like the losses
+        of one TCP window.
+
+        Args:
+            started (float): The monotonic time at which the congested request was sent.
+        """
+        if started < self._last_decrease:
+            return
+        self._last_decrease = time.monotonic()
+        self.decreases += 1
+        self._update(self.limit * self.decrease)
+
+    def average_concurrency(self, start: float, end: float) -> float:
+        """
+        Returns the time-weighted average concurrency between two monotonic times.
+        """
+        if end <= start:
+            return float(self.concurrency)
+        total = 0.0
+        for i, (changed_at, concurrency) in enumerate(self.history):
+            until = self.history[i + 1][0] if i + 1 < len(self.history) else end
+            overlap = min(until, end) - max(changed_at, start)
+            if overlap > 0:
+                total += overlap * concurrency
+        return total / (end - start)
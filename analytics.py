@@ -1,87 +1,334 @@
-﻿import matplotlib.pyplot as plt
-from collections import Counter
+﻿import base64
+import html
+import io
+import json
 import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Tuple
+
+import matplotlib
+
+# Charts are only ever written to files, never shown
+matplotlib.use("Agg")
+from matplotlib.figure import Figure  # noqa: E402
+from matplotlib.ticker import FuncFormatter  # noqa: E402
+
+
+def build_failed_responses_summary(data: dict) -> Figure:
+    # Extract relevant information
+    failed_responses = (
+        data.get("metrics", {})
+        .get("classification_accuracy", {})
+        .get("failed_responses", [])
+    )
+
+    # Count the occurrences of each intent
+    intent_counts = Counter(
+        response["prompt"]["Intent"] for response in failed_responses
+    )
+
+    # Prepare data for plotting
+    intents = list(intent_counts.keys())
+    counts = list(intent_counts.values())
+
+    # Calculate the total number of responses
+    total_responses = sum(counts)
+
+    # Calculate the distribution of each intent
+    intent_distribution = {
+        intent: count / total_responses for intent, count in intent_counts.items()
+    }
+
+    # Create the bar plot
+    fig = Figure(figsize=(10, 6))
+    ax = fig.subplots()
+    ax.bar(intents, counts)
+    ax.set_title("Misclassification Trend")
+    ax.set_xlabel("Intent")
+    ax.set_ylabel("Count")
+
+    # Add value labels on top of each bar
+    for i, count in enumerate(counts):
+        ax.text(i, count, str(count), ha="center", va="bottom")
+
+    # Add a text box with summary information
+    summary_text = f"Total failed responses: {len(failed_responses)}\n"
+    summary_text += "Intent Distribution:\n"
+    for intent, distribution in intent_distribution.items():
+        summary_text += f"{intent}: {distribution:.2%} ({intent_counts[intent]}/{total_responses})\n"
+
+    ax.text(
+        0.8,
+        0.8,
+        summary_text,
+        transform=ax.transAxes,
+        fontsize=12,
+        verticalalignment="center",
+        horizontalalignment="center",
+        bbox=dict(facecolor="white", alpha=0.5),
+    )
+    return fig
+
+
+def build_intent_distribution(data: dict) -> Figure:
+    # Extract relevant information
+    per_intent = data["per_intent"]
+
+    # Prepare data for plotting
+    intents = list(per_intent.keys())
+    counts = list(per_intent.values())
+
+    # Create the pie chart
+    fig = Figure(figsize=(10, 6))
+    ax = fig.subplots()
+    if sum(counts):
+        ax.pie(counts, labels=intents, autopct="%1.1f%%")
+    else:
+        ax.text(0.5, 0.5, "No successful request", ha="center", va="center")
+        ax.set_axis_off()
+    ax.set_title("Test dataset intent Distribution")
+    return fig
+
+
+def load_test_x_label(res_dict: Dict[str, Any]) -> str:
+    if res_dict.get("mode") == "rps":
+        return "Target requests per second"
+    if res_dict.get("mode") == "conversations":
+        return "Number of conversational users"
+    if res_dict.get("mode") == "adaptive":
+        return "Settled number of requests in flight"
+    return "Number of connections"
+
+
+def build_load_test_results(res_dict: Dict[str, Any]) -> Figure:
+    results = res_dict["results"]
+    x_label = load_test_x_label(res_dict)
+    steps = list(results.keys())
+    avg_latencies = [results[step]["avg_latency"] for step in steps]
+    max_latencies = [results[step]["max_latency"] for step in steps]
+
+    fig = Figure(figsize=(10, 6))
+    ax1 = fig.subplots()
+
+    # Plot average and max latency
+    ax1.set_xlabel(x_label)
+    ax1.set_ylabel("Average and max latency (s)", rotation=270, labelpad=10)
+    ax1.plot(steps, avg_latencies, color="tab:blue", marker="o")
+    ax1.plot(steps, max_latencies, color="tab:green", marker="o")
+
+    # One more y-axis for each error rate
+    error_axes = [
+        ("general_error_rate", "General error rate", "tab:orange"),
+        ("client_error_rate", "Client error rate", "tab:red"),
+        ("unexpected_error_rate", "Unexpected error rate", "tab:purple"),
+        ("client_failure_rate", "Client failure rate", "tab:brown"),
+    ]
+    for key, label, color in error_axes:
+        ax = ax1.twinx()
+        ax.set_ylabel(label, color=color, rotation=270, labelpad=10)
+        ax.plot(steps, [results[step].get(key, 0) for step in steps], color=color, marker="s")
+        ax.tick_params(axis="y", labelcolor=color)
+        ax.set_ylim(0, 1)
+        ax.yaxis.set_major_formatter(FuncFormatter(lambda y, _: "{:.0%}".format(y)))
+
+    ax1.set_title(f"Average latency and error rates vs {x_label}")
+    fig.tight_layout()
+    return fig
+
+
+def build_latency_percentiles(res_dict: Dict[str, Any]) -> Figure:
+    results = res_dict["results"]
+    steps = list(results.keys())
+
+    fig = Figure(figsize=(10, 6))
+    ax = fig.subplots()
+    for key, label in [
+        ("p50_latency", "p50"),
+        ("p95_latency", "p95"),
+        ("p99_latency", "p99"),
+        ("corrected_p99_latency", "p99 (corrected for coordinated omission)"),
+    ]:
+        values = [results[step].get(key) for step in steps]
+        if all(value is not None for value in values):
+            ax.plot(steps, values, marker="o", label=label)
+    ax.set_xlabel(load_test_x_label(res_dict))
+    ax.set_ylabel("Latency (s)")
+    ax.set_title("Latency percentiles")
+    ax.legend()
+    fig.tight_layout()
+    return fig
+
+
+def build_adaptive_concurrency(res_dict: Dict[str, Any]) -> Figure:
+    adaptive = res_dict["adaptive"]
+    timeline = adaptive["timeline"]
+    times = [point["time"] for point in timeline]
+
+    fig = Figure(figsize=(10, 6))
+    ax1 = fig.subplots()
+    ax1.step(
+        times,
+        [point["concurrency"] for point in timeline],
+        where="post",
+        color="tab:blue",
+        label="Concurrency limit",
+    )
+    ax1.plot(
+        times,
+        [point["in_flight"] for point in timeline],
+        color="tab:cyan",
+        alpha=0.6,
+        label="Requests in flight",
+    )
+    ax1.axhline(
+        adaptive["settled_concurrency"],
+        color="tab:blue",
+        linestyle="--",
+        label=f"Settled concurrency ({adaptive['settled_concurrency']})",
+    )
+    if res_dict.get("warmup"):
+        ax1.axvspan(0, res_dict["warmup"], color="grey", alpha=0.15, label="Warm-up")
+    ax1.set_xlabel("Time (s)")
+    ax1.set_ylabel("Requests in flight")
+
+    ax2 = ax1.twinx()
+    ax2.plot(
+        times,
+        [point["completed_rps"] for point in timeline],
+        color="tab:green",
+        label="Completed requests/s",
+    )
+    ax2.bar(
+        times,
+        [point["throttled"] for point in timeline],
+        color="tab:red",
+        alpha=0.4,
+        label="Throttled responses",
+    )
+    ax2.set_ylabel("Requests per second / throttled responses")
+
+    lines1, labels1 = ax1.get_legend_handles_labels()
+    lines2, labels2 = ax2.get_legend_handles_labels()
+    ax1.legend(lines1 + lines2, labels1 + labels2, loc="upper left")
+    ax1.set_title("Adaptive concurrency (AIMD)")
+    fig.tight_layout()
+    return fig
+
+
+CHARTS: Dict[str, Callable[[dict], Figure]] = {
+    "failed_responses_summary": build_failed_responses_summary,
+    "intent_distribution": build_intent_distribution,
+    "load_test_results": build_load_test_results,
+    "latency_percentiles": build_latency_percentiles,
+    "adaptive_concurrency": build_adaptive_concurrency,
+}
+
+
+def render_chart(chart: str, data: dict, path: str = None, dpi: int = 300):
+    """
+    Builds a chart and writes it to a PNG file, or returns the PNG bytes when no path is given.
+    The figure is not registered with pyplot and is cleared as soon as it is written, so
+    memory does not grow with the number of charts. Runs in the report worker processes.
+    """
+    fig = CHARTS[chart](data)
+    try:
+        if path is None:
+            buffer = io.BytesIO()
+            fig.savefig(buffer, format="png", dpi=dpi)
+            return buffer.getvalue()
+        fig.savefig(path, dpi=dpi)
+        return path
+    finally:
+        fig.clear()
 
 
 class Analytics:
-    def __init__(self, results_folder: str, output_folder: str, suffix: str):
+    """
+    Renders the report charts of a run, either as PNG files or as one self-contained HTML file.
+    Attributes:
+        results_folder (str): The folder containing the results.
+        output_folder (str): The folder the charts and report are written to.
+        suffix (str): The suffix of the run, appended to every file name.
+        workers (int): The number of processes rendering charts in parallel (1 to render in-process).
+    """
+
+    def __init__(
+        self, results_folder: str, output_folder: str, suffix: str, workers: int = 4
+    ):
         self.results_folder = results_folder
         self.output_folder = output_folder
         self.suffix = suffix
+        self.workers = workers
+
+    def chart_path(self, chart: str) -> str:
+        return os.path.join(self.output_folder, f"{chart}-{self.suffix}.png")
+
+    def render(
+        self, charts: List[Tuple[str, dict]], html_report: bool = False, dpi: int = 300
+    ) -> List:
+        """
+        Renders charts on the Agg backend, in a process pool when there are several.
+
+        Args:
+            charts (List[Tuple[str, dict]]): The chart names (keys of CHARTS) and their data.
+            html_report (bool): Whether to return PNG bytes for an HTML report instead of writing files.
+            dpi (int): The resolution of the charts.
+
+        Returns:
+            List: The written paths, or the PNG bytes, in the order of the charts.
+        """
+        jobs = [
+            (chart, data, None if html_report else self.chart_path(chart), dpi)
+            for chart, data in charts
+        ]
+        if self.workers <= 1 or len(jobs) <= 1:
+            return [render_chart(*job) for job in jobs]
+        with ProcessPoolExecutor(max_workers=min(self.workers, len(jobs))) as executor:
+            return list(executor.map(render_chart, *zip(*jobs)))
+
+    def write_html_report(
+        self,
+        title: str,
+        charts: List[Tuple[str, dict]],
+        tables: Dict[str, Any],
+        dpi: int = 100,
+    ) -> str:
+        """
+        Writes one self-contained HTML file with the charts embedded as base64 PNG images
+        and the given summaries as JSON blocks.
+
+        Returns:
+            str: The path of the HTML report.
+        """
+        images = self.render(charts, html_report=True, dpi=dpi)
+        sections = [
+            f'<h2>{html.escape(chart.replace("_", " ").capitalize())}</h2>\n'
+            f'<img src="data:image/png;base64,{base64.b64encode(image).decode()}">'
+            for (chart, _), image in zip(charts, images)
+        ]
+        sections += [
+            f"<h2>{html.escape(name)}</h2>\n"
+            f"<pre>{html.escape(json.dumps(table, indent=2, ensure_ascii=False))}</pre>"
+            for name, table in tables.items()
+        ]
+        path = os.path.join(self.output_folder, f"report-{self.suffix}.html")
+        with open(path, "w", encoding="utf8") as file:
+            file.write(
+                "<!DOCTYPE html>\n<html>\n<head>\n<meta charset=\"utf-8\">\n"
+                f"<title>{html.escape(title)}</title>\n"
+                "<style>body{font-family:sans-serif;margin:2em}img{max-width:100%}"
+                "pre{background:#f4f4f4;padding:1em;overflow:auto}</style>\n"
+                f"</head>\n<body>\n<h1>{html.escape(title)}</h1>\n"
+                + "\n".join(sections)
+                + "\n</body>\n</html>\n"
+            )
+        return path
 
     def plot_failed_responses_summary(self, data: dict):
-        # Extract relevant information
-        failed_responses = (
-            data.get("metrics", {})
-            .get("classification_accuracy", {})
-            .get("failed_responses", [])
-        )
-
-        # Count the occurrences of each intent
-        intent_counts = Counter(
-            response["prompt"]["Intent"] for response in failed_responses
-        )
-
-        # Prepare data for plotting
-        intents = list(intent_counts.keys())
-        counts = list(intent_counts.values())
-
-        # Calculate the total number of responses
-        total_responses = sum(counts)
-
-        # Calculate the distribution of each intent
-        intent_distribution = {
-            intent: count / total_responses for intent, count in intent_counts.items()
-        }
-
-        # Create the bar plot
-        plt.figure(figsize=(10, 6))
-        plt.bar(intents, counts)
-        plt.title("Misclassification Trend")
-        plt.xlabel("Intent")
-        plt.ylabel("Count")
-
-        # Add value labels on top of each bar
-        for i, count in enumerate(counts):
-            plt.text(i, count, str(count), ha="center", va="bottom")
-
-        # Add a text box with summary information
-        summary_text = f"Total failed responses: {len(failed_responses)}\n"
-        summary_text += "Intent Distribution:\n"
-        for intent, distribution in intent_distribution.items():
-            summary_text += f"{intent}: {distribution:.2%} ({intent_counts[intent]}/{total_responses})\n"
-
-        # Show the plot
-        plt.text(
-            0.8,
-            0.8,
-            summary_text,
-            transform=plt.gca().transAxes,
-            fontsize=12,
-            verticalalignment="center",
-            horizontalalignment="center",
-            bbox=dict(facecolor="white", alpha=0.5),
-        )
-        plt.savefig(
-            os.path.join(self.output_folder, f"failed_responses_summary-{self.suffix}.png"),
-            dpi=300,
-        )
+        chart = "failed_responses_summary"
+        return render_chart(chart, data, self.chart_path(chart))
 
     def plot_intent_distribution(self, data: dict):
-        # Extract relevant information
-        per_intent = data["per_intent"]
-
-        # Prepare data for plotting
-        intents = list(per_intent.keys())
-        counts = list(per_intent.values())
-
-        # Create the pie chart
-        plt.figure(figsize=(10, 6))
-        plt.pie(counts, labels=intents, autopct="%1.1f%%")
-        plt.title("Test dataset intent Distribution")
-
-        # Show the plot
-        plt.savefig(
-            os.path.join(self.output_folder, f"intent_distribution-{self.suffix}.png"),
-            dpi=300,
-        )
+        chart = "intent_distribution"
+        return render_chart(chart, data, self.chart_path(chart))
@@ -0,0 +1,76 @@
+﻿import math
+import random
+from typing import List
+
+ARRIVAL_PROFILES = ["constant", "poisson", "ramp"]
+
+
+def arrival_offsets(
+    rate: float,
+    duration: float,
+    profile: str = "constant",
+    start_rate: float = None,
+) -> List[float]:
+    """
+    Computes the send times of an open-loop run, relative to its start.
+
+    Args:
+        rate (float): The target arrival rate in requests per second (the final rate for a ramp).
+        duration (float): The length of the run in seconds.
+        profile (str): One of "constant" (evenly spaced), "poisson" (exponential gaps) or "ramp" (rate grows linearly from start_rate to rate).
+        start_rate (float, optional): The initial rate of a ramp. Defaults to 0.
+
+    Returns:
+        List[float]: The offsets in seconds at which each request must be sent.
+    """
+    if rate <= 0 or duration <= 0:
+        return []
+
+    if profile == "constant":
+        return [i / rate for i in range(int(rate * duration))]
+
+    if profile == "poisson":
+        offsets = []
+        t = random.expovariate(rate)
+        while t < duration:
+            offsets.append(t)
+            t += random.expovariate(rate)
+        return offsets
+
+    if profile == "ramp":
+        # Invert the cumulative count N(t) = r0 * t + (r1 - r0) * t^2 / (2 * duration)
+        r0 = start_rate or 0.0
+        slope = (rate - r0) / duration
+        total = int(r0 * duration + slope * duration**2 / 2)
+        offsets = []
+        for n in range(total):
+            if slope == 0:
+                offsets.append(n / r0)
+            else:
+                offsets.append((-r0 + math.sqrt(r0**2 + 2 * slope * n)) / slope)
+        return offsets
+
+    raise ValueError(
+        f"Unknown arrival profile: {profile}. Expected one of {ARRIVAL_PROFILES}"
+    )
+
+
+def spawn_offsets(
+    count: int, spawn_rate: float = None, start_jitter: float = 0.0
+) -> List[float]:
+    """
+    Computes the start times of closed-loop virtual users, relative to the start of a step,
+    so that their handshakes and first requests do not all hit the server in the same instant.
+
+    Args:
+        count (int): The number of users to start.
+        spawn_rate (float, optional): The number of users started per second. Defaults to all at once.
+        start_jitter (float): The maximum random delay in seconds added to each start time.
+
+    Returns:
+        List[float]: The offsets in seconds at which each user must start.
+    """
+    return [
+        (i / spawn_rate if spawn_rate else 0.0) + random.uniform(0, start_jitter)
+        for i in range(count)
+    ]
@@ -0,0 +1,69 @@
+﻿import json
+import random
+from typing import Callable, Dict, List, Sequence
+
+
+def read_conversations(path: str) -> List[List[Dict]]:
+    """
+    Reads scripted conversations, one JSON object per line with a "turns" list. Each turn is
+    either a question or a prompt with a "Question" and an optional "Intent".
+
+    Args:
+        path (str): The path of the JSONL file.
+
+    Returns:
+        List[List[Dict]]: The conversations, as lists of prompts.
+    """
+    conversations = []
+    with open(path, "r", encoding="utf8") as file:
+        for line in file:
+            if not line.strip():
+                continue
+            try:
+                turns = json.loads(line)["turns"]
+                conversation = [
+                    turn if isinstance(turn, dict) else {"Question": turn}
+                    for turn in turns
+                ]
+                if conversation and all("Question" in turn for turn in conversation):
+                    conversations.append(conversation)
+                    continue
+            except (json.JSONDecodeError, KeyError, TypeError):
+                pass
+            print(f"Warning: Skipping invalid line in {path}")
+    return conversations
+
+
+def conversation_sampler(
+    prompts: Sequence[Dict], turns: Callable[[], float]
+) -> Callable[[], List[Dict]]:
+    """
+    Builds a function sampling conversations from a prompt dataset. The first turn is a random
+    prompt, and follow-ups are drawn from the same intent when the prompts come from a
+    PromptDataset, so a conversation stays on one topic.
+
+    Args:
+        prompts (Sequence[Dict]): The prompts to sample from.
+        turns (Callable[[], float]): The distribution of the number of turns (at least 1).
+
+    Returns:
+        Callable[[], List[Dict]]: A function returning a new conversation on every call.
+    """
+    by_intent = getattr(prompts, "by_intent", None)
+
+    def sample() -> List[Dict]:
+        first = random.choice(prompts)
+        pool = by_intent(first.get("Intent", "")) if by_intent else prompts
+        if not len(pool):
+            pool = prompts
+        count = max(1, round(turns()))
+        return [first] + [random.choice(pool) for _ in range(count - 1)]
+
+    return sample
+
+
+def scripted_sampler(conversations: List[List[Dict]]) -> Callable[[], List[Dict]]:
+    """
+    Builds a function returning random scripted conversations.
+    """
+    return lambda: random.choice(conversations)
@@ -1,11 +1,33 @@
 ﻿import random
-from typing import Callable, List, Tuple, Dict, Any
+from typing import (
+    Callable,
+    List,
+    Tuple,
+    Dict,
+    Any,
+    Iterable,
+    Iterator,
+    Sequence,
+    AsyncIterator,
+)
 import statistics
 import asyncio
 from tqdm import tqdm
 import websockets
+from websockets.exceptions import ConnectionClosed
 import json
+import socket
 import time
+from urllib.parse import urlparse
+from urllib.request import getproxies, proxy_bypass
+from websockets.asyncio.client import ClientConnection
+
+from adaptive import AIMDController
+from arrivals import arrival_offsets, spawn_offsets
+from histogram import LatencyHistogram
+from response_store import ResponseStore
+from results_sink import ResultSink
+from traces import group_sessions
 
 
 class Metric:
@@ -15,6 +37,7 @@ class Metric:
         name (str): The name of the metric.
         function (Callable[[dict, dict], float]): The function used to compute the score.
         failure_condition (Callable[[dict, dict], bool], optional): The condition that determines if a response is considered a failure. Defaults to None.
+        vectorized (Callable[[List[dict], List[dict]], Sequence[float]], optional): A function computing the scores of a whole batch at once, for example with NumPy. Defaults to None.
         scores (List[float]): The list of computed scores.
         failed_responses (List[Dict[str, Any]]): The list of failed responses.
     """
@@ -24,12 +47,14 @@ class Metric:
         name: str,
         function: Callable[[dict, dict], float],
         failure_condition: Callable[[dict, dict], bool] = None,
+        vectorized: Callable[[List[dict], List[dict]], Sequence[float]] = None,
     ):
         self.name: str = name
         self.function: Callable[[dict, dict], float] = function
         self.failure_condition: Callable[[dict, dict, float], bool] = (
             failure_condition or (lambda p, r: True)
         )
+        self.vectorized = vectorized
         self.scores: List[float] = []
         self.failed_responses: List[Dict[str, Any]] = []
 
@@ -70,6 +95,44 @@ class Metric:
             )
             return 0.0
 
+    def compute_batch(self, prompts: List[dict], responses: List[dict]) -> List[float]:
+        """
+        Computes the scores of a batch of prompts and responses, in order.
+        The vectorized function is used when available, falling back to one call per pair if it fails.
+
+        Args:
+            prompts (List[dict]): The prompts data.
+            responses (List[dict]): The responses data.
+
+        Returns:
+            List[float]: The computed scores.
+        """
+        scores = None
+        if self.vectorized is not None:
+            try:
+                scores = [float(score) for score in self.vectorized(prompts, responses)]
+            except Exception as e:
+                print(
+                    f"Error: {self.name} could not compute batch scores due to an error : {str(e)}"
+                )
+        if scores is None:
+            return [
+                self.compute(prompt, response)
+                for prompt, response in zip(prompts, responses)
+            ]
+
+        self.scores.extend(scores)
+        for prompt, response, score in zip(prompts, responses, scores):
+            if self.failure_condition(prompt, response, score):
+                self.failed_responses.append(
+                    {
+                        "prompt": prompt,
+                        "response": str(response),
+                        "reason": f"Failed condition check - {self.name}",
+                    }
+                )
+        return scores
+
     def get_average(self) -> float:
         """
         Computes the average score.
@@ -89,6 +152,146 @@ class Metric:
         return self.name, self.get_average(), self.scores, self.failed_responses
 
 
+THROTTLE_MARKER = "Nous rencontrons un trafic intense"
+SERVER_ERROR_MARKER = "erreur est survenue"
+OUTCOMES = ["ok", "throttled", "server_error", "client_failure", "unexpected"]
+
+
+def classify_response(response) -> str:
+    """
+    Classifies a response as "ok", "throttled" (the gateway's heavy-traffic message),
+    "server_error" (the chatbot's generic error message), "client_failure" (timeout or
+    exception on the client side) or "unexpected" (not a JSON object).
+    """
+    if not isinstance(response, dict):
+        return "unexpected"
+    message = response.get("message", "")
+    if THROTTLE_MARKER in message:
+        return "throttled"
+    if SERVER_ERROR_MARKER in message:
+        return "server_error"
+    if "error" in response:
+        return "client_failure"
+    return "ok"
+
+
+def default_stream_end(frame: dict) -> bool:
+    """
+    Returns True for the frame closing a streamed response: an explicit end marker
+    or the frame carrying the final intent and trace id.
+    """
+    if frame.get("done") or frame.get("type") in ("end", "done"):
+        return True
+    return "traceId" in frame or "intent" in frame
+
+
+def evaluate_metrics(
+    metrics: List[Metric],
+    results: Iterable[Tuple[Dict, dict, float]],
+    batch_size: int = 1000,
+):
+    """
+    Computes the metrics over the results of a run, in batches, once the requests are done.
+    Keeping this stage out of the request path means slow metrics no longer delay other
+    connections or inflate the measured latency. Results can be a list or a stream, such as
+    the output of iter_results, so memory stays bounded by the batch size.
+    Failed requests (timeouts, exceptions, non-JSON responses) are not scored.
+
+    Args:
+        metrics (List[Metric]): The metrics to compute.
+        results (Iterable[Tuple[Dict, dict, float]]): The (prompt, response, latency) results.
+        batch_size (int): The number of results scored at once.
+    """
+    if not metrics:
+        return
+
+    def flush(prompts: List[dict], responses: List[dict]):
+        for metric in metrics:
+            metric.compute_batch(prompts, responses)
+
+    prompts, responses = [], []
+    for prompt, response, _ in results:
+        if classify_response(response) in ("client_failure", "unexpected"):
+            continue
+        prompts.append(prompt)
+        responses.append(response)
+        if len(prompts) >= batch_size:
+            flush(prompts, responses)
+            prompts, responses = [], []
+    if prompts:
+        flush(prompts, responses)
+
+
+# Connection phases are reported by the request that opened the connection
+PHASES = ["dns", "tcp", "tls", "upgrade", "send", "wait", "receive", "parse"]
+
+
+class TimedClientConnection(ClientConnection):
+    """
+    Client connection recording when its transport is ready, i.e. after the TCP connection
+    and, for wss:// URLs, the TLS handshake, just before the HTTP upgrade starts.
+    """
+
+    transport_ready_at: float = None
+    # Durations of the connection phases, consumed by the first exchange
+    connect_phases: Dict[str, float] = None
+
+    def connection_made(self, transport):
+        self.transport_ready_at = time.perf_counter()
+        super().connection_made(transport)
+
+
+class WebSocketSession:
+    """
+    A persistent WebSocket connection used by a single virtual user to send its whole queue.
+    The socket is opened lazily and reopened transparently when the server closes it.
+    Attributes:
+        tester (WebSocketTester): The tester owning the session, used to open sockets and exchange messages.
+        timeout (float): The timeout applied to the handshake, send and receive operations.
+        websocket: The currently open connection, or None until the next message is sent.
+    """
+
+    def __init__(self, tester: "WebSocketTester", timeout: float = 120):
+        self.tester = tester
+        self.timeout = timeout
+        self.websocket = None
+
+    async def exchange(self, prompt: Dict) -> Tuple[Dict, dict, float]:
+        """
+        Sends a prompt over the session, reconnecting once if the connection was closed.
+
+        Args:
+            prompt (Dict): The prompt data.
+
+        Returns:
+            Tuple[Dict, dict, float]: The prompt, the decoded response and the latency.
+        """
+        for attempt in range(2):
+            if self.websocket is None:
+                self.websocket = await self.tester.aconnect(self.timeout)
+            try:
+                return await self.tester.aexchange(self.websocket, prompt, self.timeout)
+            except ConnectionClosed:
+                self.websocket = None
+                if attempt:
+                    raise
+                self.tester.reconnect_count += 1
+
+    async def reset(self):
+        """
+        Drops the current connection so that a late reply is never read as the answer to the next prompt.
+        """
+        if self.websocket is not None:
+            websocket, self.websocket = self.websocket, None
+            try:
+                await websocket.close()
+            except Exception:
+                pass
+
+    async def close(self):
+        await self.reset()
+
+
 class WebSocketTester:
 
     def __init__(
@@ -96,42 +299,416 @@ class WebSocketTester:
         websocket_url: str,
         origin: str,
         metrics: List = [],
+        persistent: bool = False,
+        stream: bool = False,
+        stream_end: Callable[[dict], bool] = None,
+        show_progress: bool = True,
+        sink: ResultSink = None,
+        live=None,
+        store: ResponseStore = None,
+        replay: bool = False,
     ):
         self.websocket_url = websocket_url
         self.origin = origin
         self.metrics = metrics
+        self.persistent = persistent
+        self.stream = stream
+        self.stream_end = stream_end or default_stream_end
+        self.show_progress = show_progress
+        self.sink = sink
+        self.live = live
+        # With replay, responses are served from the store instead of the endpoint;
+        # otherwise, successful responses are recorded in it
+        self.store = store
+        self.replay = replay
+        self.handshake_count = 0
+        self.message_count = 0
+        self.reconnect_count = 0
+        self.warmup_until = 0.0
+        self.warmup_count = 0
+        self.throughput: Dict[str, float] = {}
+        self.adaptive: Dict[str, Any] = {}
+        # Seconds the last closed-loop run took to start all of its users
+        self.ramp_up = 0.0
+        # Intended interval between two requests of a closed-loop virtual user (0 when open-loop)
+        self.expected_interval = 0.0
+        self.reset_histograms()
 
-    async def asend_batch(self, prompts: List[Dict], think_time: float = 0, pbar=None):
+    def get_counters(self) -> Dict[str, int]:
+        return {
+            "handshakes": self.handshake_count,
+            "messages": self.message_count,
+            "reconnects": self.reconnect_count,
+        }
+
+    def reset_histograms(self):
+        self.histogram = LatencyHistogram()
+        self.corrected_histogram = LatencyHistogram()
+        self.intent_histograms = {}
+
+    def record(self, result: Tuple[Dict, dict, float]):
+        """
+        Records the latency of a request in the overall and per-intent histograms, including
+        censored (failed or timed out) requests with their elapsed time. In closed-loop runs,
+        the coordinated-omission-corrected histogram also receives the requests a stalled
+        virtual user could not send (see LatencyHistogram.record_corrected).
+        Unsent requests, reported with a latency of 0, are not recorded.
+        """
+        _, response, latency = result
+        if latency <= 0:
+            return
+        self.histogram.record(latency)
+        self.corrected_histogram.record_corrected(latency, self.expected_interval)
+        intent = response.get("intent", "") if isinstance(response, dict) else ""
+        if intent not in self.intent_histograms:
+            self.intent_histograms[intent] = LatencyHistogram()
+        self.intent_histograms[intent].record(latency)
+
+    async def asend_recorded(
+        self,
+        prompt: Dict,
+        timeout: float = 120,
+        session: "WebSocketSession" = None,
+        pbar=None,
+    ):
+        started = time.monotonic()
+        result = await self.asend_message(prompt, timeout=timeout, session=session)
+        if pbar is not None:
+            pbar.update(1)  # Update progress bar for each message processed
+        return self.collect(result, started)
+
+    def collect(
+        self, result: Tuple[Dict, dict, float], started: float, warmup_until: float = None
+    ):
+        """
+        Records a result in the histograms, the sink and the live metrics, unless its request
+        was started (at the monotonic time `started`) during the warm-up, which ends at
+        `warmup_until` (the current `self.warmup_until` by default).
+        """
+        if warmup_until is None:
+            warmup_until = self.warmup_until
+        if started < warmup_until:
+            # Requests started during the warm-up are excluded from the statistics
+            self.warmup_count += 1
+            return None
+        self.record(result)
+        if self.sink:
+            self.sink.write(result)
+        if self.live:
+            self.live.record(result)
+        return result
+
+    def prompts_until(self, prompts: List[Dict], deadline: float) -> Iterator[Dict]:
+        """
+        Yields randomly chosen prompts until the monotonic clock reaches the deadline.
+        """
+        while time.monotonic() < deadline:
+            yield random.choice(prompts)
+
+    async def asend_batch(
+        self,
+        prompts: Iterable[Dict],
+        think_time: float = 0,
+        pbar=None,
+        start_delay: float = 0,
+    ):
         results = []
-        for prompt in prompts:
-            await asyncio.sleep(think_time)
-            response = await self.asend_message(prompt)
-            results.append(response)
-            if pbar:
-                pbar.update(1)  # Update progress bar for each message processed
+        await asyncio.sleep(start_delay)
+        session = WebSocketSession(self) if self.persistent else None
+        try:
+            for prompt in prompts:
+                await asyncio.sleep(think_time)
+                response = await self.asend_recorded(prompt, session=session, pbar=pbar)
+                # Results written to a sink are not kept in memory
+                if response is not None and not self.sink:
+                    results.append(response)
+        finally:
+            if session:
+                await session.close()
         return results
 
-    async def asend_message(self, prompt: Dict, timeout: float = 120):
+    async def aconverse(
+        self,
+        conversation: List[Dict],
+        think_time: Callable[[], float],
+        timeout: float = 120,
+        deadline: float = None,
+        pbar=None,
+    ):
+        """
+        Walks a conversation over one session, pausing a sampled think time before every follow-up.
+        The 1-based index of each turn is added to its response as "turn".
+        """
+        results = []
+        session = WebSocketSession(self, timeout)
+        try:
+            for turn, prompt in enumerate(conversation, start=1):
+                if turn > 1:
+                    await asyncio.sleep(think_time())
+                if deadline is not None and time.monotonic() >= deadline:
+                    break
+                result = await self.asend_recorded(
+                    prompt, timeout=timeout, session=session, pbar=pbar
+                )
+                if result is None:
+                    continue
+                if isinstance(result[1], dict):
+                    result[1]["turn"] = turn
+                # Results written to a sink are not kept in memory
+                if not self.sink:
+                    results.append(result)
+        finally:
+            await session.close()
+        return results
+
+    async def run_conversations(
+        self,
+        next_conversation: Callable[[], List[Dict]],
+        users: int,
+        think_time: Callable[[], float],
+        conversations_per_user: int = 1,
+        timeout: float = 120,
+        warmup: float = 0,
+        duration: float = None,
+        spawn_rate: float = None,
+        start_jitter: float = 0,
+    ):
+        """
+        Runs conversational virtual users: each user holds one session per conversation and walks
+        `conversations_per_user` conversations drawn from `next_conversation`, or keeps starting
+        new ones until `warmup + duration` seconds have elapsed when `duration` is given.
+        Users are started gradually with `spawn_rate` and `start_jitter`, as in `run`.
+        """
+        print(
+            f"Starting conversations with {users} users and "
+            f"{'a duration of ' + str(duration) + ' seconds' if duration is not None else f'{conversations_per_user} conversations per user'}"
+        )
+        # Think times are random, so there is no fixed interval to correct against
+        self.expected_interval = 0.0
+        start_delays = spawn_offsets(users, spawn_rate, start_jitter)
+        self.ramp_up = max(start_delays, default=0.0)
+        self.warmup_until = time.monotonic() + self.ramp_up + warmup
+        self.warmup_count = 0
+        deadline = self.warmup_until + duration if duration is not None else None
+
+        async def user(pbar, start_delay):
+            results = []
+            count = 0
+            await asyncio.sleep(start_delay)
+            while (
+                time.monotonic() < deadline
+                if deadline is not None
+                else count < conversations_per_user
+            ):
+                results.extend(
+                    await self.aconverse(
+                        next_conversation(), think_time, timeout, deadline, pbar
+                    )
+                )
+                count += 1
+            return results
+
+        with tqdm(total=None, disable=not self.show_progress) as pbar:
+            results = await asyncio.gather(
+                *(user(pbar, delay) for delay in start_delays), return_exceptions=True
+            )
+
+        print(
+            f"Completed conversations with {users} users. "
+            f"Handshakes: {self.handshake_count}, messages: {self.message_count}, "
+            f"reconnects: {self.reconnect_count}"
+        )
+        return [
+            item for sublist in results if isinstance(sublist, list) for item in sublist
+        ]
+
+    async def aopen_socket(self, timeout: float = 120):
+        """
+        Resolves the host and opens a TCP connection to the first address accepting it.
+
+        Returns:
+            Tuple[socket.socket, float, float]: The connected socket, and the DNS and TCP durations.
+        """
+        loop = asyncio.get_running_loop()
+        url = urlparse(self.websocket_url)
+        port = url.port or (443 if url.scheme == "wss" else 80)
+        started = time.perf_counter()
+        addresses = await asyncio.wait_for(
+            loop.getaddrinfo(url.hostname, port, type=socket.SOCK_STREAM),
+            timeout=timeout,
+        )
+        resolved = time.perf_counter()
+        error = OSError(f"Could not resolve {url.hostname}")
+        for family, type_, proto, _, address in addresses:
+            sock = socket.socket(family, type_, proto)
+            sock.setblocking(False)
+            try:
+                await asyncio.wait_for(loop.sock_connect(sock, address), timeout=timeout)
+            except (OSError, asyncio.TimeoutError) as e:
+                sock.close()
+                error = e
+                continue
+            return sock, resolved - started, time.perf_counter() - resolved
+        raise error
+
+    async def aconnect(self, timeout: float = 120):
+        """
+        Opens a WebSocket connection, timing the DNS resolution, the TCP connection, the TLS
+        handshake and the HTTP upgrade. Through a proxy, only the whole connection is timed.
+        """
+        hostname = urlparse(self.websocket_url).hostname
+        options = {}
+        phases = {}
+        started = time.perf_counter()
+        if not getproxies() or proxy_bypass(hostname):
+            options["sock"], phases["dns"], phases["tcp"] = await self.aopen_socket(
+                timeout
+            )
+        tcp_connected = time.perf_counter()
         try:
-            async with websockets.connect(
-                self.websocket_url, origin=self.origin, close_timeout=timeout
-            ) as websocket:
-                payload = json.dumps({"message": prompt["Question"]})
-                start_time = time.time()
-                await asyncio.wait_for(websocket.send(payload), timeout=timeout)
-                response = await asyncio.wait_for(websocket.recv(), timeout=timeout)
-                end_time = time.time()
-                latency = end_time - start_time
-                response = json.loads(response)
-                for metric in self.metrics:
-                    metric.compute(prompt, response)
-                return prompt, response, latency
+            websocket = await websockets.connect(
+                self.websocket_url,
+                origin=self.origin,
+                close_timeout=timeout,
+                create_connection=TimedClientConnection,
+                **options,
+            )
+        except BaseException:
+            if "sock" in options:
+                options["sock"].close()
+            raise
+        connected = time.perf_counter()
+        if "sock" in options:
+            phases["tls"] = (
+                websocket.transport_ready_at - tcp_connected
+                if self.websocket_url.startswith("wss")
+                else 0.0
+            )
+            phases["upgrade"] = connected - websocket.transport_ready_at
+        else:
+            phases["upgrade"] = connected - started
+        websocket.connect_phases = phases
+        self.handshake_count += 1
+        return websocket
+
+    async def aexchange(self, websocket, prompt: Dict, timeout: float = 120):
+        """
+        Sends a prompt and reads its response, recording the duration of every phase under
+        the "phases" key of the response: the connection phases when this exchange is the
+        first one of its connection, then send, wait (until the first frame), receive (until
+        the last frame, streamed responses only) and parse. The latency runs from the start
+        of the send to the last frame, on the monotonic clock.
+        """
+        phases = getattr(websocket, "connect_phases", None) or {}
+        websocket.connect_phases = None
+        payload = json.dumps({"message": prompt["Question"]})
+        start_time = time.perf_counter()
+        await asyncio.wait_for(websocket.send(payload), timeout=timeout)
+        sent = time.perf_counter()
+        phases["send"] = sent - start_time
+        self.message_count += 1
+        if self.stream:
+            response = await self.areceive_stream(websocket, start_time, timeout)
+            stream = response["stream"]
+            latency = stream["total_time"]
+            phases["wait"] = stream["time_to_first_frame"] - phases["send"]
+            phases["receive"] = stream["total_time"] - stream["time_to_first_frame"]
+            phases["parse"] = stream.pop("parse_time")
+        else:
+            response = await asyncio.wait_for(websocket.recv(), timeout=timeout)
+            end_time = time.perf_counter()
+            latency = end_time - start_time
+            response = json.loads(response)
+            phases["wait"] = end_time - sent
+            phases["parse"] = time.perf_counter() - end_time
+        if isinstance(response, dict):
+            response["phases"] = phases
+        # Metrics are evaluated after the run by evaluate_metrics, off the request path
+        return prompt, response, latency
+
+    async def areceive_stream(
+        self, websocket, start_time: float, timeout: float = 120
+    ) -> dict:
+        """
+        Reads frames until the end-of-response condition is met and merges them into one response.
+        The "message" fields are concatenated, other fields keep the value of the latest frame.
+        Frame timings are stored under the "stream" key of the returned response.
+        """
+        response = {}
+        message_parts = []
+        frame_times = []
+        total_bytes = 0
+        parse_time = 0.0
+        while True:
+            frame = await asyncio.wait_for(websocket.recv(), timeout=timeout)
+            frame_times.append(time.perf_counter())
+            total_bytes += len(frame.encode() if isinstance(frame, str) else frame)
+            frame = json.loads(frame)
+            parse_time += time.perf_counter() - frame_times[-1]
+            if not isinstance(frame, dict):
+                frame = {"message": str(frame)}
+            message_parts.append(frame.get("message", ""))
+            response.update(frame)
+            if self.stream_end(frame):
+                break
+
+        response["message"] = "".join(message_parts)
+        response["stream"] = {
+            "time_to_first_frame": frame_times[0] - start_time,
+            "inter_frame": [b - a for a, b in zip(frame_times, frame_times[1:])],
+            "total_time": frame_times[-1] - start_time,
+            "frames": len(frame_times),
+            "bytes": total_bytes,
+            "parse_time": parse_time,
+        }
+        return response
+
+    async def asend_message(
+        self, prompt: Dict, timeout: float = 120, session: WebSocketSession = None
+    ):
+        if self.replay:
+            return self.replay_message(prompt)
+        # Failed requests keep their elapsed time, marked as censored: the true latency is
+        # at least this long, and dropping them would hide the slowest requests from the tail
+        start_time = time.perf_counter()
+        try:
+            if session is not None:
+                result = await session.exchange(prompt)
+            else:
+                async with await self.aconnect(timeout) as websocket:
+                    result = await self.aexchange(websocket, prompt, timeout)
         except asyncio.TimeoutError:
             print(f"Timeout occurred for prompt: {prompt}")
-            return prompt, {"error": "Error: Timeout"}, 0
+            if session is not None:
+                await session.reset()
+            return (
+                prompt,
+                {"error": "Error: Timeout", "censored": True},
+                time.perf_counter() - start_time,
+            )
         except Exception as e:
             print(f"Error occurred for prompt: {prompt}. Error: {str(e)}")
-            return prompt, {"error": f"Error: {str(e)}"}, 0
+            if session is not None:
+                await session.reset()
+            return (
+                prompt,
+                {"error": f"Error: {str(e)}", "censored": True},
+                time.perf_counter() - start_time,
+            )
+        # Throttled and error replies are not recorded, so they never replace a good recording
+        if self.store is not None and classify_response(result[1]) == "ok":
+            self.store.put(*result)
+        return result
+
+    def replay_message(self, prompt: Dict) -> Tuple[Dict, dict, float]:
+        """
+        Serves the recorded response to a prompt, with its recorded latency, without calling the endpoint.
+        """
+        recorded = self.store.get(prompt["Question"])
+        if recorded is None:
+            return prompt, {"error": "Error: No recorded response"}, 0
+        response, latency = recorded
+        return prompt, response, latency
 
     async def run(
         self,
@@ -139,8 +716,26 @@ class WebSocketTester:
         connections: int = 1,
         queue_size: int = 1,
         think_time: float = 0,
+        warmup: float = 0,
+        duration: float = None,
+        expected_interval: float = None,
+        spawn_rate: float = None,
+        start_jitter: float = 0,
     ):
-        if queue_size == -1:
+        """
+        Runs closed-loop virtual users. Requests started during the first `warmup` seconds
+        are excluded from the results and histograms. When `duration` is given, every
+        connection keeps sending random prompts for `warmup + duration` seconds instead of
+        sending `queue_size` prompts. `expected_interval`, the think time by default, is the
+        intended interval between two requests of a user, used to correct coordinated omission.
+        With `spawn_rate` (connections per second) or `start_jitter` (seconds), connections
+        start gradually rather than all at once; the warm-up then begins once the last one
+        has started, so the ramp-up is excluded too.
+        """
+        self.expected_interval = think_time if expected_interval is None else expected_interval
+        if duration is not None:
+            total_messages = None
+        elif queue_size == -1:
             # Spread prompts across connections
             prompts_per_connection = len(prompts) // connections
             remainder = len(prompts) % connections
@@ -155,10 +750,20 @@ class WebSocketTester:
         )
 
         tasks = []
+        start_delays = spawn_offsets(connections, spawn_rate, start_jitter)
+        self.ramp_up = max(start_delays, default=0.0)
+        if self.ramp_up:
+            print(f"Ramping up {connections} connections over {self.ramp_up:.2f} seconds")
+        self.warmup_until = time.monotonic() + self.ramp_up + warmup
+        self.warmup_count = 0
 
-        with tqdm(total=total_messages) as pbar:
+        with tqdm(total=total_messages, disable=not self.show_progress) as pbar:
             for i in range(connections):
-                if queue_size == -1:
+                if duration is not None:
+                    connection_prompts = self.prompts_until(
+                        prompts, self.warmup_until + duration
+                    )
+                elif queue_size == -1:
                     # Distribute prompts evenly, accounting for remainder
                     start = i * prompts_per_connection + min(i, remainder)
                     end = start + prompts_per_connection + (1 if i < remainder else 0)
@@ -168,7 +773,11 @@ class WebSocketTester:
                         random.choice(prompts) for _ in range(queue_size)
                     ]
 
-                tasks.append(self.asend_batch(connection_prompts, think_time, pbar))
+                tasks.append(
+                    self.asend_batch(
+                        connection_prompts, think_time, pbar, start_delays[i]
+                    )
+                )
 
             results = await asyncio.gather(*tasks, return_exceptions=True)
 
@@ -177,8 +786,403 @@ class WebSocketTester:
             f"with a {'spread' if queue_size == -1 else f'queue size of {queue_size}'} "
             f"and a think time of {think_time} seconds"
         )
+        print(
+            f"Handshakes: {self.handshake_count}, messages: {self.message_count}, "
+            f"reconnects: {self.reconnect_count}"
+        )
+        if warmup:
+            print(f"Excluded {self.warmup_count} warm-up requests from the results")
 
         flattened_results = [
             item for sublist in results if isinstance(sublist, list) for item in sublist
         ]
         return flattened_results
+
+    async def run_staggered(
+        self,
+        prompts: List[Dict],
+        steps: Sequence[int],
+        think_time: float = 0,
+        warmup: float = 0,
+        duration: float = 60,
+        expected_interval: float = None,
+        spawn_rate: float = None,
+        start_jitter: float = 0,
+    ) -> AsyncIterator[Tuple[int, List, float]]:
+        """
+        Runs closed-loop virtual users through increasing connection counts without stopping
+        them between steps: each step spawns the users missing to reach its count, at
+        `spawn_rate` and with `start_jitter`, while the existing users keep sending. A step lasts
+        its ramp-up, then `warmup + duration` seconds, and only the requests started during its
+        last `duration` seconds are kept. Each request belongs to the step it was started in, and
+        a step is only yielded once its requests have completed, so its slowest requests stay in
+        its results; requests started while a step's tail completes belong to no step. The
+        histograms are reset at the start of every step.
+
+        Yields:
+            Tuple[int, List, float]: The connection count, the results and the measured duration of each step.
+        """
+        self.expected_interval = think_time if expected_interval is None else expected_interval
+        # The step new requests are started in, None while the tail of a step completes
+        current = None
+        stop = asyncio.Event()
+        users = []
+
+        async def user(start_delay: float):
+            await asyncio.sleep(start_delay)
+            session = WebSocketSession(self) if self.persistent else None
+            try:
+                while not stop.is_set():
+                    await asyncio.sleep(think_time)
+                    step = current
+                    started = time.monotonic()
+                    if step is not None:
+                        step["in_flight"] += 1
+                        step["drained"].clear()
+                    try:
+                        result = await self.asend_message(
+                            random.choice(prompts), session=session
+                        )
+                    finally:
+                        if step is not None:
+                            step["in_flight"] -= 1
+                            if not step["in_flight"]:
+                                step["drained"].set()
+                    # Filtered against the warm-up of the step it was started in
+                    result = self.collect(
+                        result,
+                        started,
+                        step["warmup_until"] if step is not None else float("inf"),
+                    )
+                    # Results written to a sink are not kept in memory
+                    if result is not None and not self.sink:
+                        step["results"].append(result)
+            finally:
+                if session:
+                    await session.close()
+
+        try:
+            for connections in steps:
+                start_delays = spawn_offsets(
+                    max(connections - len(users), 0), spawn_rate, start_jitter
+                )
+                ramp_up = max(start_delays, default=0.0)
+                print(
+                    f"Stepping up to {connections} connections: {len(start_delays)} new "
+                    f"connections over {ramp_up:.2f} seconds, {len(users)} kept running"
+                )
+                self.reset_histograms()
+                if self.live:
+                    self.live.step = connections
+                self.warmup_until = time.monotonic() + ramp_up + warmup
+                self.warmup_count = 0
+                step = {
+                    "warmup_until": self.warmup_until,
+                    "results": [],
+                    "in_flight": 0,
+                    "drained": asyncio.Event(),
+                }
+                current = step
+                users.extend(
+                    asyncio.create_task(user(delay)) for delay in start_delays
+                )
+                await asyncio.sleep(ramp_up + warmup + duration)
+                # The users keep the load on while the requests of the step complete
+                current = None
+                if step["in_flight"]:
+                    await step["drained"].wait()
+                yield connections, step["results"], duration
+        finally:
+            # Requests still in flight after the last step are abandoned
+            stop.set()
+            for task in users:
+                task.cancel()
+            await asyncio.gather(*users, return_exceptions=True)
+            print(
+                f"Handshakes: {self.handshake_count}, messages: {self.message_count}, "
+                f"reconnects: {self.reconnect_count}"
+            )
+
+    async def run_adaptive(
+        self,
+        prompts: List[Dict],
+        controller: AIMDController,
+        duration: float,
+        warmup: float = 0,
+        timeout: float = 120,
+        sample_interval: float = 1.0,
+    ):
+        """
+        Keeps as many requests in flight as `controller` allows, each on its own connection,
+        for `warmup + duration` seconds. Throttled responses and timeouts decrease the limit
+        and successful responses increase it, so the concurrency settles where the backend
+        stops throttling. Requests started during the warm-up adjust the limit but are
+        excluded from the results. The settled concurrency, the throughput of the steady-state
+        window and a timeline sampled every `sample_interval` seconds are stored in
+        `self.adaptive` once the run completes.
+        """
+        # Requests are sent as soon as the limit allows, there is no schedule to fall behind
+        self.expected_interval = 0.0
+        start_time = time.monotonic()
+        self.warmup_until = start_time + warmup
+        self.warmup_count = 0
+        deadline = self.warmup_until + duration
+        initial_concurrency = controller.concurrency
+
+        print(
+            f"Starting adaptive test from {initial_concurrency} requests in flight "
+            f"(AIMD +{controller.increase}/x{controller.decrease}) over {duration} seconds"
+        )
+
+        async def send(prompt: Dict):
+            started = time.monotonic()
+            return started, await self.asend_message(prompt, timeout=timeout)
+
+        results = []
+        in_flight = set()
+        counts = {"completed": 0, "ok": 0, "throttled": 0, "timeouts": 0}
+        sample = {"completed": 0, "throttled": 0}
+        timeline = []
+        next_sample = start_time + sample_interval
+
+        def handle(task: asyncio.Task, in_window: bool):
+            started, result = task.result()
+            response = result[1]
+            outcome = classify_response(response)
+            timed_out = isinstance(response, dict) and response.get("error") == "Error: Timeout"
+            if outcome == "throttled" or timed_out:
+                controller.on_congestion(started)
+            elif outcome == "ok":
+                controller.on_success()
+            sample["completed"] += 1
+            sample["throttled"] += outcome == "throttled"
+            if in_window:
+                counts["completed"] += 1
+                counts["ok"] += outcome == "ok"
+                counts["throttled"] += outcome == "throttled"
+                counts["timeouts"] += timed_out
+            kept = self.collect(result, started)
+            # Results written to a sink are not kept in memory
+            if kept is not None and not self.sink:
+                results.append(kept)
+
+        with tqdm(total=None, disable=not self.show_progress) as pbar:
+            while (now := time.monotonic()) < deadline:
+                while len(in_flight) < controller.concurrency:
+                    in_flight.add(asyncio.create_task(send(random.choice(prompts))))
+                done, in_flight = await asyncio.wait(
+                    in_flight,
+                    timeout=min(next_sample, deadline) - now,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                for task in done:
+                    handle(task, time.monotonic() >= self.warmup_until)
+                    pbar.update(1)
+                if time.monotonic() >= next_sample:
+                    timeline.append(
+                        {
+                            "time": round(next_sample - start_time, 2),
+                            "concurrency": controller.concurrency,
+                            "in_flight": len(in_flight),
+                            "completed_rps": round(sample["completed"] / sample_interval, 2),
+                            "throttled": sample["throttled"],
+                        }
+                    )
+                    sample = {"completed": 0, "throttled": 0}
+                    next_sample += sample_interval
+
+            # Requests still in flight were sent within the window: wait for their latency,
+            # but they do not count in the throughput of the window
+            if in_flight:
+                await asyncio.wait(in_flight)
+                for task in in_flight:
+                    handle(task, False)
+                    pbar.update(1)
+
+        window = [point for point in timeline if point["time"] > warmup]
+        self.adaptive = {
+            "initial_concurrency": initial_concurrency,
+            "final_concurrency": controller.concurrency,
+            "settled_concurrency": round(
+                controller.average_concurrency(self.warmup_until, deadline), 2
+            ),
+            "min_concurrency": min((p["concurrency"] for p in window), default=None),
+            "max_concurrency": max((p["concurrency"] for p in window), default=None),
+            "decreases": controller.decreases,
+            "throttled": counts["throttled"],
+            "timeouts": counts["timeouts"],
+            "achieved_rps": round(counts["completed"] / duration, 2),
+            "goodput_rps": round(counts["ok"] / duration, 2),
+            "timeline": timeline,
+        }
+
+        print(
+            f"Completed adaptive test: settled at {self.adaptive['settled_concurrency']} "
+            f"requests in flight, {self.adaptive['goodput_rps']} successful requests/s "
+            f"({self.adaptive['achieved_rps']} requests/s in total, "
+            f"{controller.decreases} decreases)"
+        )
+        return results
+
+    async def run_open_loop(
+        self,
+        prompts: List[Dict],
+        rate: float,
+        duration: float,
+        profile: str = "constant",
+        start_rate: float = None,
+        timeout: float = 120,
+        warmup: float = 0,
+    ):
+        """
+        Sends prompts at a target arrival rate regardless of outstanding replies.
+        Each request uses its own connection, so a slow server does not reduce the offered load.
+        Requests are scheduled over `warmup + duration` seconds, and those sent during the first
+        `warmup` seconds are excluded from the results, so the measured window lasts `duration`
+        seconds as in closed-loop runs. The achieved throughput of that window is stored in
+        `self.throughput` once the run completes.
+        """
+        offsets = arrival_offsets(rate, warmup + duration, profile, start_rate)
+        # Open-loop requests are sent on schedule, there is no coordinated omission to correct
+        self.expected_interval = 0.0
+
+        print(
+            f"Starting open-loop test with {len(offsets)} requests at {rate} requests/s "
+            f"({profile} arrivals) over {warmup + duration} seconds"
+        )
+
+        tasks = []
+        max_lag = 0.0
+
+        with tqdm(total=len(offsets), disable=not self.show_progress) as pbar:
+            start_time = time.perf_counter()
+            self.warmup_until = time.monotonic() + warmup
+            self.warmup_count = 0
+            for offset in offsets:
+                delay = start_time + offset - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                else:
+                    max_lag = max(max_lag, -delay)
+                task = asyncio.create_task(
+                    self.asend_recorded(
+                        random.choice(prompts), timeout=timeout, pbar=pbar
+                    )
+                )
+                tasks.append(task)
+            send_time = time.perf_counter() - start_time
+
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+            total_time = time.perf_counter() - start_time
+
+        # Warm-up requests are not in the completed results, nor is the warm-up in their window
+        completed = [result for result in results if isinstance(result, tuple)]
+        measured_time = total_time - warmup
+        self.throughput = {
+            "target_rps": rate,
+            "scheduled_rps": round(len(offsets) / (warmup + duration), 2),
+            "offered_rps": round(len(tasks) / max(send_time, warmup + duration), 2),
+            "achieved_rps": (
+                round(len(completed) / measured_time, 2) if measured_time > 0 else 0
+            ),
+            "max_schedule_lag": round(max_lag, 3),
+            "total_time": round(total_time, 2),
+        }
+
+        print(
+            f"Completed open-loop test: target {self.throughput['target_rps']} requests/s, "
+            f"offered {self.throughput['offered_rps']} requests/s, "
+            f"achieved {self.throughput['achieved_rps']} requests/s"
+        )
+
+        # Results written to a sink are not kept in memory
+        return [] if self.sink else completed
+
+    async def run_trace(
+        self,
+        trace: List[Dict],
+        speedup: float = 1.0,
+        max_concurrency: int = 0,
+        timeout: float = 120,
+        warmup: float = 0,
+    ):
+        """
+        Replays a request trace (see traces.read_trace), preserving its inter-arrival times divided
+        by `speedup`. Requests of a session are sent in order, each one no earlier than its scheduled
+        time and no earlier than the reply to the previous one; with `persistent`, every session
+        keeps its own connection. At most `max_concurrency` requests are in flight (0 for no limit).
+        The achieved throughput and schedule lag are stored in `self.throughput`.
+        """
+        sessions = group_sessions(trace)
+        self.expected_interval = 0.0
+        trace_duration = trace[-1]["offset"] / speedup if trace else 0
+        semaphore = asyncio.Semaphore(max_concurrency) if max_concurrency > 0 else None
+        results = []
+        max_lag = 0.0
+        sent = 0
+        completed = 0
+
+        print(
+            f"Starting trace replay of {len(trace)} requests in {len(sessions)} sessions "
+            f"at {speedup}x over {trace_duration:.1f} seconds"
+        )
+
+        async def replay_session(requests: List[Dict], pbar):
+            nonlocal max_lag, sent, completed
+            session = WebSocketSession(self, timeout) if self.persistent else None
+            try:
+                for request in requests:
+                    scheduled = start_time + request["offset"] / speedup
+                    delay = scheduled - time.perf_counter()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    if semaphore is not None:
+                        await semaphore.acquire()
+                    try:
+                        max_lag = max(max_lag, time.perf_counter() - scheduled)
+                        sent += 1
+                        result = await self.asend_recorded(
+                            request["prompt"], timeout=timeout, session=session, pbar=pbar
+                        )
+                    finally:
+                        if semaphore is not None:
+                            semaphore.release()
+                    if result is None:
+                        continue
+                    completed += 1
+                    # Results written to a sink are not kept in memory
+                    if not self.sink:
+                        results.append(result)
+            finally:
+                if session is not None:
+                    await session.close()
+
+        with tqdm(total=len(trace), disable=not self.show_progress) as pbar:
+            start_time = time.perf_counter()
+            self.warmup_until = time.monotonic() + warmup
+            self.warmup_count = 0
+            await asyncio.gather(
+                *(replay_session(requests, pbar) for requests in sessions.values())
+            )
+            total_time = time.perf_counter() - start_time
+
+        # Only requests started after the warm-up are completed, so only that window counts
+        measured_time = total_time - warmup
+        self.throughput = {
+            "speedup": speedup,
+            "trace_rps": round(len(trace) / trace_duration, 2) if trace_duration else 0,
+            "offered_rps": round(sent / max(total_time, trace_duration), 2) if sent else 0,
+            "achieved_rps": (
+                round(completed / measured_time, 2) if measured_time > 0 else 0
+            ),
+            "max_schedule_lag": round(max_lag, 3),
+            "total_time": round(total_time, 2),
+        }
+
+        print(
+            f"Completed trace replay: trace {self.throughput['trace_rps']} requests/s, "
+            f"achieved {self.throughput['achieved_rps']} requests/s, "
+            f"max schedule lag {self.throughput['max_schedule_lag']} seconds"
+        )
+
+        return results
@@ -1,48 +1,76 @@
-﻿import datetime
-import json
-from langfuse import Langfuse
-from dotenv import load_dotenv
+﻿import argparse
+import datetime
 import os
-from typing import Generator
-from tqdm import tqdm
+import sys
 
-load_dotenv()
-langfuse = Langfuse(
-    secret_key=os.environ.get("LANGFUSE_SECRET_KEY", ""),
-    public_key=os.environ.get("LANGFUSE_PUBLIC_KEY"),
-    host=os.environ.get("LANGFUSE_HOST"),
-)
+from dotenv import load_dotenv
+from tqdm import tqdm
 
+from dataset_loader import load_prompts
+from langfuse_api import DatasetUploader, LangfuseAPI, LangfuseAPIError
 
-def is_langfuse_enabled():
-    try:
-        return langfuse.auth_check()
-    except Exception as e:
-        print(f"Langfuse is not enabled or not properly authenticated: {str(e)}")
-        return False
+load_dotenv()
 
 
-def read_prompts(folder_path: str) -> Generator[dict, None, None]:
-    for filename in os.listdir(folder_path):
-        if filename.endswith(".jsonl"):
-            file_path = os.path.join(folder_path, filename)
-            with open(file_path, "r", encoding="utf8") as file:
-                for line in file:
-                    try:
-                        prompt = json.loads(line)
-                        yield prompt
-                    except (json.JSONDecodeError, KeyError):
-                        print(f"Warning: Skipping invalid line in {filename}")
+def parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Upload the prompts of the datasets folder to a Langfuse dataset"
+    )
+    parser.add_argument(
+        "--dataset-name",
+        default=os.environ.get("LANGFUSE_DATASET_NAME"),
+        help="Name of the Langfuse dataset (default: LANGFUSE_DATASET_NAME, or a timestamped name). "
+        "Use a fixed name to resume an interrupted upload",
+    )
+    parser.add_argument(
+        "--host",
+        default=os.environ.get("LANGFUSE_HOST", "https://cloud.langfuse.com"),
+        help="Langfuse host (default: LANGFUSE_HOST), e.g. http://127.0.0.1:3000 for mock_langfuse.py",
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=8, help="Number of parallel uploads"
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=100,
+        help="Number of items uploaded between two checkpoint writes",
+    )
+    parser.add_argument(
+        "--retries", type=int, default=5, help="Retries of a failed upload"
+    )
+    parser.add_argument(
+        "--checkpoint",
+        help="File listing the uploaded items (default: datasets/.cache/upload-<dataset name>.txt)",
+    )
+    parser.add_argument(
+        "--include-hidden",
+        action="store_true",
+        help="Also upload the prompts of dataset sub-folders such as datasets/hidden",
+    )
+    return parser.parse_args()
 
 
 def main():
-    if is_langfuse_enabled():
-        current_time = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-        dataset_name = os.environ.get(
-            "LANGFUSE_DATASET_NAME", "load_test_dataset_" + current_time
-        )
-        langfuse.create_dataset(
-            name=dataset_name,
+    args = parse_arguments()
+    api = LangfuseAPI(
+        args.host,
+        os.environ.get("LANGFUSE_PUBLIC_KEY", ""),
+        os.environ.get("LANGFUSE_SECRET_KEY", ""),
+        retries=args.retries,
+    )
+    if not api.auth_check():
+        return
+
+    current_time = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    dataset_name = args.dataset_name or "load_test_dataset_" + current_time
+    checkpoint = args.checkpoint or os.path.join(
+        "datasets", ".cache", f"upload-{dataset_name}.txt"
+    )
+    # Creating a dataset that already exists is a no-op, so this is safe when resuming
+    try:
+        api.create_dataset(
+            dataset_name,
             description="dataset created for load testing",
             metadata={
                 "author": "Florian Rumiel",
@@ -50,20 +78,26 @@ def main():
                 "type": "automated",
             },
         )
+    except LangfuseAPIError as e:
+        print(f"Could not create dataset {dataset_name}: {str(e)}")
+        sys.exit(1)
 
-        for prompt in tqdm(
-            read_prompts("datasets"), desc="Uploading prompts to dataset"
-        ):
-            langfuse.create_dataset_item(
-                dataset_name=dataset_name,
-                input=prompt["Question"],
-                metadata={
-                    "intent": prompt.get("Intent", ""),
-                    "refCount": prompt.get("RefCount", 0),
-                },
-            )
+    uploader = DatasetUploader(
+        api, dataset_name, checkpoint, args.concurrency, args.batch_size
+    )
+    prompts = load_prompts("datasets", include_hidden=args.include_hidden)
+    with tqdm(desc="Uploading prompts to dataset") as progress:
+        result = uploader.upload(prompts, progress)
 
-        print(f"Successfully uploaded prompts to dataset {dataset_name}")
+    print(
+        f"Uploaded {result['uploaded']} prompts to dataset {dataset_name} "
+        f"({result['skipped']} already uploaded or duplicated, {result['failed']} failed)"
+    )
+    if result["failed"]:
+        for error in result["errors"][:10]:
+            print(f"  {error['id']}: {error['error']}")
+        print(f"Run again with --dataset-name {dataset_name} to retry the failed items")
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,222 @@
+﻿import hashlib
+import json
+import mmap
+import os
+import random
+import struct
+from typing import Dict, Iterator, List
+
+import numpy as np
+
+CACHE_FOLDER = ".cache"
+CACHE_MAGIC = b"PRMPTv1\0"
+HIDDEN_FOLDER = "hidden"
+
+
+def list_source_files(folder_path: str, include_hidden: bool = False) -> List[str]:
+    """
+    Lists the JSONL files of a prompts folder, relative to it, in a stable order.
+    Sub-folders (such as datasets/hidden) are only included when include_hidden is set.
+    """
+    files = []
+    for root, dirs, filenames in os.walk(folder_path):
+        dirs[:] = sorted(d for d in dirs if d != CACHE_FOLDER)
+        if not include_hidden:
+            dirs[:] = []
+        for filename in sorted(filenames):
+            if filename.endswith(".jsonl"):
+                files.append(os.path.relpath(os.path.join(root, filename), folder_path))
+    return files
+
+
+def fingerprint(folder_path: str, files: List[str]) -> str:
+    digest = hashlib.md5()
+    for relative_path in files:
+        stat = os.stat(os.path.join(folder_path, relative_path))
+        digest.update(f"{relative_path}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+    return digest.hexdigest()
+
+
+def compile_cache(folder_path: str, files: List[str], cache_path: str, key: str):
+    """
+    Compiles the JSONL files into a single binary file that can be memory-mapped:
+    a JSON header, then the line offsets, file ids, intent codes and intent index as
+    fixed-size arrays, then the raw UTF-8 lines. Lines are validated once, here.
+    """
+    lines, file_ids, intent_codes = [], [], []
+    intents: Dict[str, int] = {}
+    for file_id, relative_path in enumerate(files):
+        with open(os.path.join(folder_path, relative_path), "rb") as file:
+            for line in file:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    prompt = json.loads(line)
+                    intent = prompt.get("Intent", "")
+                    prompt["Question"]
+                except (json.JSONDecodeError, KeyError, AttributeError):
+                    print(f"Warning: Skipping invalid line in {relative_path}")
+                    continue
+                lines.append(line)
+                file_ids.append(file_id)
+                intent_codes.append(intents.setdefault(intent, len(intents)))
+
+    count = len(lines)
+    offsets = np.zeros(count + 1, dtype=np.uint64)
+    offsets[1:] = np.cumsum([len(line) for line in lines], dtype=np.uint64)
+    intent_codes = np.array(intent_codes, dtype=np.uint32)
+    intent_order = np.argsort(intent_codes, kind="stable").astype(np.uint32)
+    boundaries = np.searchsorted(intent_codes[intent_order], np.arange(len(intents) + 1))
+    header = json.dumps(
+        {
+            "key": key,
+            "count": count,
+            "files": files,
+            "intents": {
+                intent: [int(boundaries[code]), int(boundaries[code + 1])]
+                for intent, code in intents.items()
+            },
+        }
+    ).encode()
+
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    temporary_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(temporary_path, "wb") as file:
+        file.write(CACHE_MAGIC)
+        file.write(struct.pack("<Q", len(header)))
+        file.write(header)
+        # Align the arrays on 8 bytes so they can be viewed without copy
+        file.write(b"\0" * (-file.tell() % 8))
+        file.write(offsets.tobytes())
+        file.write(np.array(file_ids, dtype=np.uint32).tobytes())
+        file.write(intent_codes.tobytes())
+        file.write(intent_order.tobytes())
+        file.write(b"".join(lines))
+    # Atomic replacement, so concurrent readers never see a partial cache
+    os.replace(temporary_path, cache_path)
+
+
+class PromptDataset:
+    """
+    Read-only view of the prompts of a compiled cache, memory-mapped rather than parsed.
+    Prompts are decoded on access, so processes sharing a cache share its pages instead of
+    each holding its own copy. A dataset can be restricted to a selection of rows, and
+    pickling it only transfers the cache path and the selection.
+    Attributes:
+        cache_path (str): The path of the compiled cache.
+        files (List[str]): The source files, indexed by the file ids of the cache.
+        intents (Dict[str, List[int]]): The [start, end) range of each intent in the intent index.
+        rows (np.ndarray): The selected rows of the cache, or None for every row.
+    """
+
+    def __init__(self, cache_path: str, rows: np.ndarray = None):
+        self.cache_path = cache_path
+        with open(cache_path, "rb") as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[: len(CACHE_MAGIC)] != CACHE_MAGIC:
+            raise ValueError(f"Invalid prompt cache: {cache_path}")
+        (header_size,) = struct.unpack_from("<Q", self._mmap, len(CACHE_MAGIC))
+        start = len(CACHE_MAGIC) + 8
+        self.header = json.loads(self._mmap[start : start + header_size])
+        self.files = self.header["files"]
+        self.intents = self.header["intents"]
+
+        count = self.header["count"]
+        position = start + header_size
+        position += -position % 8
+        self._offsets = np.frombuffer(self._mmap, np.uint64, count + 1, position)
+        position += self._offsets.nbytes
+        self._file_ids = np.frombuffer(self._mmap, np.uint32, count, position)
+        position += self._file_ids.nbytes
+        self._intent_codes = np.frombuffer(self._mmap, np.uint32, count, position)
+        position += self._intent_codes.nbytes
+        self._intent_order = np.frombuffer(self._mmap, np.uint32, count, position)
+        position += self._intent_order.nbytes
+        self._data_start = position
+        self.rows = rows
+
+    def __reduce__(self):
+        return (PromptDataset, (self.cache_path, self.rows))
+
+    def __len__(self) -> int:
+        return self.header["count"] if self.rows is None else len(self.rows)
+
+    def _decode(self, row: int) -> dict:
+        start = self._data_start + int(self._offsets[row])
+        end = self._data_start + int(self._offsets[row + 1])
+        return json.loads(self._mmap[start:end])
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("prompt index out of range")
+        return self._decode(index if self.rows is None else int(self.rows[index]))
+
+    def __iter__(self) -> Iterator[dict]:
+        for index in range(len(self)):
+            yield self[index]
+
+    def select(self, rows: np.ndarray) -> "PromptDataset":
+        return PromptDataset(self.cache_path, np.asarray(rows, dtype=np.uint32))
+
+    def rows_for_intent(self, intent: str) -> np.ndarray:
+        start, end = self.intents.get(intent, [0, 0])
+        return self._intent_order[start:end]
+
+    def by_intent(self, intent: str) -> "PromptDataset":
+        return self.select(self.rows_for_intent(intent))
+
+    def sample_per_file(self, max_samples: int) -> "PromptDataset":
+        """
+        Samples up to max_samples prompts from every source file, like the previous loaders did.
+        """
+        selected = []
+        for file_id in range(len(self.files)):
+            rows = np.flatnonzero(self._file_ids == file_id)
+            if len(rows) > max_samples:
+                rows = np.array(random.sample(rows.tolist(), max_samples))
+            selected.append(rows)
+        rows = np.sort(np.concatenate(selected)) if selected else np.array([])
+        return self.select(rows)
+
+
+def load_prompts(
+    folder_path: str, max_samples: int = -1, include_hidden: bool = False
+) -> PromptDataset:
+    """
+    Loads the prompts of a folder through its compiled cache, rebuilding the cache only when
+    a source file was added, removed or modified.
+
+    Args:
+        folder_path (str): The folder containing the prompt JSONL files.
+        max_samples (int): The maximum number of prompts sampled from each file (-1 for all).
+        include_hidden (bool): Whether to include the JSONL files of sub-folders such as datasets/hidden.
+
+    Returns:
+        PromptDataset: The prompts, memory-mapped from the cache.
+    """
+    files = list_source_files(folder_path, include_hidden)
+    key = fingerprint(folder_path, files)
+    cache_path = os.path.join(
+        folder_path,
+        CACHE_FOLDER,
+        f"prompts{'-hidden' if include_hidden else ''}.bin",
+    )
+
+    dataset = None
+    if os.path.exists(cache_path):
+        try:
+            dataset = PromptDataset(cache_path)
+        except (ValueError, json.JSONDecodeError, struct.error):
+            dataset = None
+    if dataset is None or dataset.header["key"] != key:
+        compile_cache(folder_path, files, cache_path, key)
+        dataset = PromptDataset(cache_path)
+
+    if max_samples != -1:
+        dataset = dataset.sample_per_file(max_samples)
+    return dataset
@@ -0,0 +1,51 @@
+﻿import math
+import random
+from typing import Callable
+
+DISTRIBUTIONS = ["constant", "uniform", "exponential", "lognormal"]
+
+
+def parse_distribution(spec: str) -> Callable[[], float]:
+    """
+    Parses a distribution specification into a function drawing non-negative samples.
+
+    Supported specifications:
+        constant:<value>
+        uniform:<low>,<high>
+        exponential:<mean>
+        lognormal:<median>,<sigma>
+
+    A bare number is read as a constant.
+
+    Args:
+        spec (str): The distribution specification, for example "lognormal:2.0,0.5".
+
+    Returns:
+        Callable[[], float]: A function returning a new sample on every call.
+    """
+    kind, _, params = spec.partition(":")
+    if not params:
+        try:
+            value = float(kind)
+        except ValueError:
+            raise ValueError(f"Invalid distribution: {spec}")
+        return lambda: value
+
+    values = [float(param) for param in params.split(",")]
+    try:
+        if kind == "constant":
+            (value,) = values
+            return lambda: value
+        if kind == "uniform":
+            low, high = values
+            return lambda: random.uniform(low, high)
+        if kind == "exponential":
+            (mean,) = values
+            return lambda: random.expovariate(1 / mean) if mean > 0 else 0.0
+        if kind == "lognormal":
+            median, sigma = values
+            mu = math.log(median) if median > 0 else 0.0
+            return lambda: random.lognormvariate(mu, sigma) if median > 0 else 0.0
+    except ValueError:
+        raise ValueError(f"Invalid parameters for {kind} distribution: {spec}")
+    raise ValueError(f"Unknown distribution: {kind}. Expected one of {DISTRIBUTIONS}")
@@ -0,0 +1,197 @@
+﻿import math
+
+import numpy as np
+from typing import Dict, Any, Iterable
+
+
+class LatencyHistogram:
+    """
+    Log-bucketed histogram recording values in constant memory, in the spirit of HdrHistogram.
+    Every bucket is `precision` wider than the previous one, so any reported percentile is
+    within `precision` (relative) of the exact value. Histograms with the same configuration
+    can be merged, which makes them suitable to combine connections, steps and worker processes.
+    Attributes:
+        lowest (float): The smallest distinguishable value; smaller values share the first bucket.
+        highest (float): The largest tracked value; larger values share the last bucket.
+        precision (float): The relative width of each bucket.
+        counts (Dict[int, int]): The number of values recorded in each non-empty bucket.
+        count (int): The total number of recorded values.
+        total (float): The sum of recorded values.
+        min (float): The smallest recorded value.
+        max (float): The largest recorded value.
+    """
+
+    def __init__(
+        self, lowest: float = 1e-4, highest: float = 3600.0, precision: float = 0.01
+    ):
+        self.lowest = lowest
+        self.highest = highest
+        self.precision = precision
+        self._log_base = math.log1p(precision)
+        self.bucket_count = int(math.ceil(math.log(highest / lowest) / self._log_base)) + 2
+        self.counts: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def _index(self, value: float) -> int:
+        if value <= self.lowest:
+            return 0
+        index = int(math.log(value / self.lowest) / self._log_base) + 1
+        return min(index, self.bucket_count - 1)
+
+    def _bucket_value(self, index: int) -> float:
+        if index == 0:
+            return self.lowest
+        return self.lowest * (1 + self.precision) ** (index - 0.5)
+
+    def record(self, value: float, count: int = 1):
+        """
+        Records a value, optionally several times.
+
+        Args:
+            value (float): The value to record.
+            count (int): The number of occurrences of the value.
+        """
+        index = self._index(value)
+        self.counts[index] = self.counts.get(index, 0) + count
+        self.count += count
+        self.total += value * count
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def record_corrected(self, value: float, expected_interval: float):
+        """
+        Records a value and corrects it for coordinated omission, like HdrHistogram's
+        recordValueWithExpectedInterval: a request that took longer than the expected interval
+        between two requests delayed the requests that should have been sent meanwhile, so the
+        values value - interval, value - 2 * interval, ... down to the interval are also recorded.
+
+        Args:
+            value (float): The value to record.
+            expected_interval (float): The intended interval between two requests (0 for no correction).
+        """
+        self.record(value)
+        if expected_interval <= 0:
+            return
+        missing = int(value / expected_interval) - 1
+        if missing > 0:
+            self.record_array(value - expected_interval * np.arange(1, missing + 1))
+
+    def record_many(self, values: Iterable[float]):
+        for value in values:
+            self.record(value)
+
+    def record_array(self, values: np.ndarray):
+        """
+        Records an array of values at once, computing the bucket indices with NumPy.
+        """
+        values = np.asarray(values, dtype=float)
+        if values.size == 0:
+            return
+        indices = np.zeros(values.shape, dtype=np.int64)
+        above = values > self.lowest
+        indices[above] = (
+            np.log(values[above] / self.lowest) / self._log_base
+        ).astype(np.int64) + 1
+        indices = np.minimum(indices, self.bucket_count - 1)
+        buckets, counts = np.unique(indices, return_counts=True)
+        for index, count in zip(buckets.tolist(), counts.tolist()):
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += int(values.size)
+        self.total += float(values.sum())
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+
+    def merge(self, other: "LatencyHistogram") -> "LatencyHistogram":
+        """
+        Adds the values of another histogram to this one.
+
+        Args:
+            other (LatencyHistogram): A histogram with the same configuration.
+
+        Returns:
+            LatencyHistogram: This histogram, to allow chaining.
+        """
+        if (other.lowest, other.highest, other.precision) != (
+            self.lowest,
+            self.highest,
+            self.precision,
+        ):
+            raise ValueError("Cannot merge histograms with different configurations")
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def percentile(self, percentile: float) -> float:
+        """
+        Returns the value below which the given percentage of recorded values fall.
+
+        Args:
+            percentile (float): The percentile, between 0 and 100.
+
+        Returns:
+            float: The percentile value, or 0 if nothing was recorded.
+        """
+        if self.count == 0:
+            return 0
+        rank = max(1, math.ceil(percentile / 100 * self.count))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(max(self._bucket_value(index), self.min), self.max)
+        return self.max
+
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0
+
+    def summary(self) -> Dict[str, float]:
+        """
+        Returns the usual summary of the distribution: count, average, min, max and percentiles.
+        """
+        if self.count == 0:
+            return {
+                key: 0
+                for key in ["count", "average", "median", "min", "max"]
+                + ["p90", "p95", "p99", "p999"]
+            }
+        return {
+            "count": self.count,
+            "average": self.mean(),
+            "median": self.percentile(50),
+            "min": self.min,
+            "max": self.max,
+            "p90": self.percentile(90),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "p999": self.percentile(99.9),
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "lowest": self.lowest,
+            "highest": self.highest,
+            "precision": self.precision,
+            "counts": {str(index): count for index, count in self.counts.items()},
+            "count": self.count,
+            "total": self.total,
+            "min": self.min if self.count else None,
+            "max": self.max if self.count else None,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "LatencyHistogram":
+        histogram = cls(data["lowest"], data["highest"], data["precision"])
+        histogram.counts = {int(index): count for index, count in data["counts"].items()}
+        histogram.count = data["count"]
+        histogram.total = data["total"]
+        if histogram.count:
+            histogram.min = data["min"]
+            histogram.max = data["max"]
+        return histogram
@@ -0,0 +1,222 @@
+﻿import base64
+import json
+import os
+import random
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Set
+
+from response_store import question_key
+
+# Statuses worth retrying: rate limiting and transient server errors
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+
+
+class LangfuseAPIError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(f"Langfuse API error {status}: {message}")
+        self.status = status
+
+
+class LangfuseAPI:
+    """
+    Minimal client of the Langfuse public REST API, with retries and exponential backoff.
+    It has no state besides its credentials, so it can be shared by several threads, and it
+    can be pointed at the local stand-in (mock_langfuse.py).
+    Attributes:
+        host (str): The base URL of the Langfuse server.
+        retries (int): The number of retries of a failed request.
+        timeout (float): The timeout of each request in seconds.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        public_key: str,
+        secret_key: str,
+        retries: int = 5,
+        timeout: float = 30,
+    ):
+        self.host = host.rstrip("/")
+        self.retries = retries
+        self.timeout = timeout
+        credentials = base64.b64encode(f"{public_key}:{secret_key}".encode()).decode()
+        self._headers = {
+            "Authorization": f"Basic {credentials}",
+            "Content-Type": "application/json",
+        }
+
+    @classmethod
+    def from_environment(cls, **options) -> "LangfuseAPI":
+        return cls(
+            os.environ.get("LANGFUSE_HOST", "https://cloud.langfuse.com"),
+            os.environ.get("LANGFUSE_PUBLIC_KEY", ""),
+            os.environ.get("LANGFUSE_SECRET_KEY", ""),
+            **options,
+        )
+
+    def request(self, method: str, path: str, body: Any = None) -> Any:
+        """
+        Sends a request, retrying on connection errors, rate limiting and 5xx responses with
+        jittered exponential backoff (honouring Retry-After).
+        """
+        data = json.dumps(body).encode() if body is not None else None
+        for attempt in range(self.retries + 1):
+            request = urllib.request.Request(
+                self.host + path, data=data, headers=self._headers, method=method
+            )
+            delay = min(2**attempt, 30) * random.uniform(0.5, 1.0)
+            try:
+                with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                    payload = response.read()
+                    return json.loads(payload) if payload else None
+            except urllib.error.HTTPError as e:
+                if e.code not in RETRY_STATUSES or attempt == self.retries:
+                    raise LangfuseAPIError(e.code, e.read().decode(errors="replace"))
+                retry_after = e.headers.get("Retry-After")
+                if retry_after and retry_after.isdigit():
+                    delay = float(retry_after)
+            except (urllib.error.URLError, TimeoutError, ConnectionError) as e:
+                if attempt == self.retries:
+                    raise LangfuseAPIError(0, str(e))
+            time.sleep(delay)
+
+    def auth_check(self) -> bool:
+        try:
+            self.request("GET", "/api/public/projects")
+            return True
+        except LangfuseAPIError as e:
+            print(f"Langfuse is not enabled or not properly authenticated: {str(e)}")
+            return False
+
+    def create_dataset(self, name: str, description: str = "", metadata: Dict = None):
+        return self.request(
+            "POST",
+            "/api/public/datasets",
+            {"name": name, "description": description, "metadata": metadata or {}},
+        )
+
+    def upsert_dataset_item(
+        self, dataset_name: str, item_id: str, input: Any, metadata: Dict = None
+    ):
+        # Langfuse upserts dataset items by id, so sending an item twice does not duplicate it
+        return self.request(
+            "POST",
+            "/api/public/dataset-items",
+            {
+                "id": item_id,
+                "datasetName": dataset_name,
+                "input": input,
+                "metadata": metadata or {},
+            },
+        )
+
+
+def dataset_item_id(dataset_name: str, question: str) -> str:
+    """
+    The id of the dataset item of a question, derived from the hash of the question, so
+    uploading the same prompts again updates the existing items.
+    """
+    return f"{dataset_name}-{question_key(question)}"
+
+
+class DatasetUploader:
+    """
+    Uploads prompts to a Langfuse dataset with bounded concurrency, in batches. After every
+    batch, the ids of the uploaded items are appended to a checkpoint file, so an interrupted
+    upload resumes where it stopped; item ids are idempotent, so an item uploaded but not yet
+    checkpointed is updated rather than duplicated.
+    Attributes:
+        api (LangfuseAPI): The Langfuse client.
+        dataset_name (str): The name of the dataset.
+        checkpoint_path (str): The file listing the ids of the uploaded items.
+        concurrency (int): The number of items uploaded in parallel.
+        batch_size (int): The number of items uploaded between two checkpoints.
+    """
+
+    def __init__(
+        self,
+        api: LangfuseAPI,
+        dataset_name: str,
+        checkpoint_path: str,
+        concurrency: int = 8,
+        batch_size: int = 100,
+    ):
+        self.api = api
+        self.dataset_name = dataset_name
+        self.checkpoint_path = checkpoint_path
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+
+    def uploaded_ids(self) -> Set[str]:
+        if not os.path.exists(self.checkpoint_path):
+            return set()
+        with open(self.checkpoint_path, "r", encoding="utf8") as file:
+            return {line.strip() for line in file if line.strip()}
+
+    def _upload(self, item: Dict) -> str:
+        self.api.upsert_dataset_item(
+            self.dataset_name, item["id"], item["input"], item["metadata"]
+        )
+        return item["id"]
+
+    def upload(self, prompts: Iterable[Dict], progress=None) -> Dict[str, Any]:
+        """
+        Uploads the prompts that are not in the checkpoint yet.
+
+        Args:
+            prompts (Iterable[Dict]): The prompts, with a "Question" and optional "Intent" and "RefCount".
+            progress (optional): A tqdm progress bar updated for every uploaded or skipped item.
+
+        Returns:
+            Dict[str, Any]: The number of uploaded, skipped and failed items, and the errors.
+        """
+        done = self.uploaded_ids()
+        items = {}
+        skipped = 0
+        for prompt in prompts:
+            item_id = dataset_item_id(self.dataset_name, prompt["Question"])
+            if item_id in done or item_id in items:
+                skipped += 1
+                continue
+            items[item_id] = {
+                "id": item_id,
+                "input": prompt["Question"],
+                "metadata": {
+                    "intent": prompt.get("Intent", ""),
+                    "refCount": prompt.get("RefCount", 0),
+                },
+            }
+        if progress is not None:
+            progress.total = skipped + len(items)
+            progress.update(skipped)
+
+        pending: List[Dict] = list(items.values())
+        uploaded = 0
+        errors = []
+        directory = os.path.dirname(self.checkpoint_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor, open(
+            self.checkpoint_path, "a", encoding="utf8"
+        ) as checkpoint:
+            for start in range(0, len(pending), self.batch_size):
+                batch = pending[start : start + self.batch_size]
+                futures = [executor.submit(self._upload, item) for item in batch]
+                for item, future in zip(batch, futures):
+                    try:
+                        checkpoint.write(future.result() + "\n")
+                        uploaded += 1
+                    except LangfuseAPIError as e:
+                        errors.append({"id": item["id"], "error": str(e)})
+                    if progress is not None:
+                        progress.update(1)
+                checkpoint.flush()
+        return {
+            "uploaded": uploaded,
+            "skipped": skipped,
+            "failed": len(errors),
+            "errors": errors,
+        }
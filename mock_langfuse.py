@@ -0,0 +1,147 @@
+﻿import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+
+
+class MockLangfuseState:
+    """
+    In-memory content of the mock Langfuse server.
+    Attributes:
+        datasets (Dict[str, dict]): The datasets, by name.
+        items (Dict[str, dict]): The dataset items, by id (upserted like in Langfuse).
+        scores (List[dict]): The received scores.
+        runs (List[dict]): The received dataset run items (trace links).
+        requests (int): The number of requests received.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.datasets: Dict[str, dict] = {}
+        self.items: Dict[str, dict] = {}
+        self.scores: List[dict] = []
+        self.runs: List[dict] = []
+        self.requests = 0
+
+
+def make_handler(state: MockLangfuseState, latency: float, failure_rate: float):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def _reply(self, status: int, body=None):
+            payload = json.dumps(body if body is not None else {}).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def _handle(self, method: str):
+            with state.lock:
+                state.requests += 1
+            if latency:
+                time.sleep(latency)
+            if not self.headers.get("Authorization", "").startswith("Basic "):
+                return self._reply(401, {"message": "Unauthorized"})
+            if random.random() < failure_rate:
+                return self._reply(503, {"message": "Service unavailable"})
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length)) if length else None
+            path = self.path.split("?")[0]
+
+            with state.lock:
+                if method == "GET" and path == "/api/public/projects":
+                    return self._reply(200, {"data": [{"id": "mock-project"}]})
+                if method == "POST" and path == "/api/public/datasets":
+                    dataset = state.datasets.setdefault(body["name"], body)
+                    return self._reply(200, dataset)
+                if method == "POST" and path == "/api/public/dataset-items":
+                    if body.get("datasetName") not in state.datasets:
+                        return self._reply(404, {"message": "Dataset not found"})
+                    item = {**body, "id": body.get("id") or str(uuid.uuid4())}
+                    state.items[item["id"]] = item
+                    return self._reply(200, item)
+                if method == "GET" and path.startswith("/api/public/datasets/"):
+                    name = path.rsplit("/", 1)[-1]
+                    if name not in state.datasets:
+                        return self._reply(404, {"message": "Dataset not found"})
+                    items = [
+                        item
+                        for item in state.items.values()
+                        if item["datasetName"] == name
+                    ]
+                    return self._reply(200, {**state.datasets[name], "items": items})
+                if method == "POST" and path == "/api/public/scores":
+                    state.scores.append(body)
+                    return self._reply(200, {"id": str(uuid.uuid4())})
+                if method == "POST" and path == "/api/public/dataset-run-items":
+                    state.runs.append(body)
+                    return self._reply(200, {"id": str(uuid.uuid4())})
+            return self._reply(404, {"message": f"Not found: {method} {path}"})
+
+        def do_GET(self):
+            self._handle("GET")
+
+        def do_POST(self):
+            self._handle("POST")
+
+    return Handler
+
+
+def serve(
+    host: str = "127.0.0.1",
+    port: int = 3000,
+    latency: float = 0.0,
+    failure_rate: float = 0.0,
+    state: MockLangfuseState = None,
+) -> ThreadingHTTPServer:
+    """
+    Creates the mock server; call serve_forever() on it, or run it in a thread for tests.
+    """
+    state = state or MockLangfuseState()
+    server = ThreadingHTTPServer((host, port), make_handler(state, latency, failure_rate))
+    server.state = state
+    return server
+
+
+def parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Local stand-in for the Langfuse public API (datasets, dataset items, scores)"
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to listen on")
+    parser.add_argument("--port", type=int, default=3000, help="Port to listen on")
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Seconds added to every request"
+    )
+    parser.add_argument(
+        "--failure-rate",
+        type=float,
+        default=0.0,
+        help="Probability of answering a request with a 503 error",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    server = serve(args.host, args.port, args.latency, args.failure_rate)
+    print(f"Mock Langfuse API listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        state = server.state
+        print(
+            f"{state.requests} requests, {len(state.datasets)} datasets, "
+            f"{len(state.items)} items, {len(state.scores)} scores"
+        )
+
+
+if __name__ == "__main__":
+    main()
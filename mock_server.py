@@ -0,0 +1,216 @@
+﻿import argparse
+import asyncio
+import json
+import os
+import random
+import uuid
+from typing import Callable, Dict
+
+import websockets
+
+from dataset_loader import load_prompts
+from distributions import parse_distribution
+
+THROTTLE_MESSAGE = (
+    "Nous rencontrons un trafic intense en ce moment. Veuillez réessayer plus tard."
+)
+ERROR_MESSAGE = "Une erreur est survenue. Veuillez réessayer plus tard."
+
+
+def parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Local mock of the chatbot WebSocket endpoint"
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to listen on")
+    parser.add_argument("--port", type=int, default=8765, help="Port to listen on")
+    parser.add_argument(
+        "--prompts-folder",
+        default="./datasets",
+        help="Folder containing prompt JSONL files, used to answer with the expected intent",
+    )
+    parser.add_argument(
+        "--default-intent",
+        default="irrelevant",
+        help="Intent returned for questions not found in the prompts folder",
+    )
+    parser.add_argument(
+        "--latency",
+        action="append",
+        default=[],
+        metavar="[INTENT=]DISTRIBUTION",
+        help="Response latency distribution, optionally per intent "
+        "(e.g. lognormal:2.0,0.5 or dq_faq=exponential:3). Defaults to no latency",
+    )
+    parser.add_argument(
+        "--max-concurrency",
+        type=int,
+        default=0,
+        help="In-flight requests above which the throttling message is returned (0 for no limit)",
+    )
+    parser.add_argument(
+        "--error-concurrency",
+        type=int,
+        default=0,
+        help="In-flight requests above which the generic error message is returned (0 for no limit)",
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.0,
+        help="Probability of answering with the generic error message",
+    )
+    parser.add_argument(
+        "--stream-frames",
+        type=int,
+        default=1,
+        help="Number of frames each answer is split into (1 to send a single frame)",
+    )
+    return parser.parse_args()
+
+
+def read_intents(folder_path: str) -> Dict[str, dict]:
+    known = {}
+    if not os.path.isdir(folder_path):
+        return known
+    for prompt in load_prompts(folder_path, include_hidden=True):
+        known[prompt["Question"]] = prompt
+    return known
+
+
+class MockChatbot:
+    """
+    Answers chatbot requests with the same message format as the real endpoint.
+    Attributes:
+        known_prompts (Dict[str, dict]): The dataset prompts, indexed by question.
+        default_intent (str): The intent returned for unknown questions.
+        latencies (Dict[str, Callable[[], float]]): The latency distributions, by intent ("" for the default).
+        max_concurrency (int): In-flight requests above which requests are throttled (0 for no limit).
+        error_concurrency (int): In-flight requests above which requests fail (0 for no limit).
+        error_rate (float): The probability of failing a request.
+        stream_frames (int): The number of frames each answer is split into.
+        in_flight (int): The number of requests being answered.
+    """
+
+    def __init__(
+        self,
+        known_prompts: Dict[str, dict] = None,
+        default_intent: str = "irrelevant",
+        latencies: Dict[str, Callable[[], float]] = None,
+        max_concurrency: int = 0,
+        error_concurrency: int = 0,
+        error_rate: float = 0.0,
+        stream_frames: int = 1,
+    ):
+        self.known_prompts = known_prompts or {}
+        self.default_intent = default_intent
+        self.latencies = latencies or {}
+        self.max_concurrency = max_concurrency
+        self.error_concurrency = error_concurrency
+        self.error_rate = error_rate
+        self.stream_frames = max(stream_frames, 1)
+        self.in_flight = 0
+
+    def build_response(self, question: str) -> dict:
+        prompt = self.known_prompts.get(question, {})
+        intent = prompt.get("Intent", self.default_intent)
+        if self.error_concurrency and self.in_flight > self.error_concurrency:
+            message = ERROR_MESSAGE
+        elif self.max_concurrency and self.in_flight > self.max_concurrency:
+            message = THROTTLE_MESSAGE
+        elif random.random() < self.error_rate:
+            message = ERROR_MESSAGE
+        else:
+            message = f"Réponse simulée pour l'intention {intent}. {question}"
+        return {
+            "intent": intent,
+            "message": message,
+            "references": [
+                f"https://example.org/reference/{i}"
+                for i in range(int(prompt.get("RefCount", 0) or 0))
+            ],
+            "traceId": uuid.uuid4().hex,
+        }
+
+    def sample_latency(self, intent: str) -> float:
+        distribution = self.latencies.get(intent, self.latencies.get(""))
+        return max(distribution(), 0.0) if distribution else 0.0
+
+    async def answer(self, websocket, raw_message: str):
+        self.in_flight += 1
+        try:
+            try:
+                question = json.loads(raw_message)["message"]
+            except (json.JSONDecodeError, KeyError, TypeError):
+                await websocket.send(json.dumps({"message": ERROR_MESSAGE}))
+                return
+
+            response = self.build_response(question)
+            if response["message"] == THROTTLE_MESSAGE:
+                # Throttled requests are rejected without reaching the model
+                await websocket.send(json.dumps(response, ensure_ascii=False))
+                return
+
+            latency = self.sample_latency(response["intent"])
+            if self.stream_frames == 1:
+                await asyncio.sleep(latency)
+                await websocket.send(json.dumps(response, ensure_ascii=False))
+                return
+
+            # Split the answer in chunks sent evenly over the latency, then the final frame
+            words = response.pop("message").split(" ")
+            chunk_size = -(-len(words) // self.stream_frames)
+            for i in range(0, len(words), chunk_size):
+                await asyncio.sleep(latency / self.stream_frames)
+                chunk = " ".join(words[i : i + chunk_size])
+                await websocket.send(
+                    json.dumps({"message": chunk if i == 0 else " " + chunk})
+                )
+            await websocket.send(json.dumps({**response, "message": ""}))
+        finally:
+            self.in_flight -= 1
+
+    async def handler(self, websocket):
+        # Requests sent over the same connection are answered concurrently, like the real endpoint
+        tasks = set()
+        try:
+            async for raw_message in websocket:
+                task = asyncio.create_task(self.answer(websocket, raw_message))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+def parse_latencies(specs) -> Dict[str, Callable[[], float]]:
+    latencies = {}
+    for spec in specs:
+        intent, _, distribution = spec.rpartition("=")
+        latencies[intent] = parse_distribution(distribution)
+    return latencies
+
+
+async def serve(chatbot: MockChatbot, host: str, port: int):
+    async with websockets.serve(chatbot.handler, host, port):
+        print(f"Mock chatbot listening on ws://{host}:{port}")
+        await asyncio.Future()
+
+
+def main():
+    args = parse_arguments()
+    chatbot = MockChatbot(
+        known_prompts=read_intents(args.prompts_folder),
+        default_intent=args.default_intent,
+        latencies=parse_latencies(args.latency),
+        max_concurrency=args.max_concurrency,
+        error_concurrency=args.error_concurrency,
+        error_rate=args.error_rate,
+        stream_frames=args.stream_frames,
+    )
+    asyncio.run(serve(chatbot, args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
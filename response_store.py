@@ -0,0 +1,101 @@
+﻿import hashlib
+import json
+import sqlite3
+import time
+from typing import Dict, List, Optional, Tuple
+
+
+def question_key(question: str) -> str:
+    """
+    The key of a question, the same MD5 hash used to index the results files.
+    """
+    return hashlib.md5(json.dumps(question).encode()).hexdigest()
+
+
+class ResponseStore:
+    """
+    On-disk SQLite store of raw chatbot responses, indexed by the hash of the question.
+    Recording a run fills it, and replaying serves the recorded responses without calling
+    the endpoint, so metrics can be re-evaluated offline. Recordings are buffered and
+    written in one transaction per `batch_size` responses, so that a run does not wait for
+    a disk commit after every request; the remainder is written by flush() or close().
+    Attributes:
+        path (str): The path of the SQLite database.
+        batch_size (int): The number of buffered recordings written per transaction.
+    """
+
+    def __init__(self, path: str, batch_size: int = 100):
+        self.path = path
+        self.batch_size = batch_size
+        self._pending: List[Tuple] = []
+        self._connection = sqlite3.connect(path)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                question TEXT NOT NULL,
+                prompt TEXT NOT NULL,
+                response TEXT NOT NULL,
+                latency REAL NOT NULL,
+                recorded_at REAL NOT NULL
+            )
+            """
+        )
+        self._connection.commit()
+
+    def put(self, prompt: Dict, response: dict, latency: float):
+        """
+        Records the response to a prompt, replacing any previous recording of the same question.
+        """
+        self._pending.append(
+            (
+                question_key(prompt["Question"]),
+                prompt["Question"],
+                json.dumps(prompt, ensure_ascii=False),
+                json.dumps(response, ensure_ascii=False),
+                latency,
+                time.time(),
+            )
+        )
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the buffered recordings in a single transaction.
+        """
+        if not self._pending:
+            return
+        self._connection.executemany(
+            "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)", self._pending
+        )
+        self._connection.commit()
+        self._pending = []
+
+    def get(self, question: str) -> Optional[Tuple[dict, float]]:
+        """
+        Returns the recorded (response, latency) of a question, or None if it was never recorded.
+        """
+        self.flush()
+        row = self._connection.execute(
+            "SELECT response, latency FROM responses WHERE key = ?",
+            (question_key(question),),
+        ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def __len__(self) -> int:
+        self.flush()
+        return self._connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def close(self):
+        self.flush()
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
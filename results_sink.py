@@ -0,0 +1,65 @@
+﻿import gzip
+import json
+from typing import Dict, Iterator, Tuple
+
+
+def _open(path: str, mode: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf8")
+    return open(path, mode, encoding="utf8")
+
+
+class ResultSink:
+    """
+    Append-only JSONL file receiving results as soon as they complete.
+    Each line holds the prompt, the raw response and the latency of one request, so a crashed
+    run keeps everything written so far. Files ending in ".gz" are gzip-compressed.
+    Attributes:
+        path (str): The path of the JSONL file.
+        count (int): The number of results written.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.count = 0
+        self._file = _open(path, "a")
+
+    def write(self, result: Tuple[Dict, dict, float]):
+        prompt, response, latency = result
+        self._file.write(
+            json.dumps(
+                {"input": prompt, "response": response, "latency": latency},
+                ensure_ascii=False,
+            )
+            + "\n"
+        )
+        self._file.flush()
+        self.count += 1
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def iter_results(path: str) -> Iterator[Tuple[Dict, dict, float]]:
+    """
+    Streams the results of a JSONL sink back as (prompt, response, latency) tuples.
+    A truncated last line, left by an interrupted run, is skipped; so is the end of a
+    gzip-compressed file whose stream was cut off by a crash.
+    """
+    with _open(path, "r") as file:
+        try:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    print(f"Warning: Skipping invalid line in {path}")
+                    continue
+                yield record["input"], record["response"], record["latency"]
+        except (EOFError, gzip.BadGzipFile) as e:
+            print(f"Warning: {path} is truncated, stopping at the last complete result ({str(e)})")
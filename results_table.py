@@ -0,0 +1,314 @@
+﻿from typing import Dict, Any, Iterable, List, Tuple
+
+import numpy as np
+
+from core import OUTCOMES, PHASES, classify_response
+from histogram import LatencyHistogram
+
+
+class _Column:
+    """
+    Growable NumPy array with amortized O(1) appends.
+    """
+
+    def __init__(self, dtype, fill=0):
+        self.dtype = dtype
+        self.fill = fill
+        self.data = np.full(1024, fill, dtype=dtype)
+        self.size = 0
+
+    def append(self, value):
+        if self.size == len(self.data):
+            grown = np.full(len(self.data) * 2, self.fill, dtype=self.dtype)
+            grown[: self.size] = self.data
+            self.data = grown
+        self.data[self.size] = value
+        self.size += 1
+
+    def values(self) -> np.ndarray:
+        return self.data[: self.size]
+
+
+class ResultTable:
+    """
+    Columnar store of request results, with group-by indices on intent, step and conversation turn.
+    Each result is stored as one row of fixed-size columns (intent and outcome codes, latency,
+    response length, step, turn, streaming timings), so summaries are computed with vectorized
+    grouped aggregations instead of rescanning the results list for every intent.
+    Attributes:
+        intents (List[str]): The intent labels, indexed by the codes of the intent column.
+        streamed (bool): Whether at least one result carries streaming timings.
+    """
+
+    def __init__(self):
+        self.intents: List[str] = []
+        self._intent_codes: Dict[str, int] = {}
+        self._columns = {
+            "intent": _Column(np.int32),
+            "outcome": _Column(np.int8),
+            "latency": _Column(np.float64),
+            "response_length": _Column(np.int32),
+            "step": _Column(np.float64, np.nan),
+            "turn": _Column(np.float64, np.nan),
+            "time_to_first_frame": _Column(np.float64, np.nan),
+            "stream_total_time": _Column(np.float64, np.nan),
+            "bytes": _Column(np.float64, np.nan),
+            "censored": _Column(np.int8),
+            **{f"phase_{phase}": _Column(np.float64, np.nan) for phase in PHASES},
+        }
+        # Inter-frame gaps vary in number per result, they are stored flat with their row
+        self._gaps = _Column(np.float64)
+        self._gap_rows = _Column(np.int64)
+        self._indices: Dict[str, Dict[Any, np.ndarray]] = {}
+        self.streamed = False
+
+    def __len__(self) -> int:
+        return self._columns["latency"].size
+
+    def column(self, name: str) -> np.ndarray:
+        return self._columns[name].values()
+
+    def append(self, result: Tuple[Dict, dict, float], step: float = None):
+        _, response, latency = result
+        intent = response.get("intent", "") if isinstance(response, dict) else ""
+        if intent not in self._intent_codes:
+            self._intent_codes[intent] = len(self.intents)
+            self.intents.append(intent)
+        message = response.get("message", "") if isinstance(response, dict) else ""
+
+        row = len(self)
+        columns = self._columns
+        columns["intent"].append(self._intent_codes[intent])
+        columns["outcome"].append(OUTCOMES.index(classify_response(response)))
+        columns["latency"].append(latency)
+        columns["censored"].append(
+            bool(response.get("censored")) if isinstance(response, dict) else False
+        )
+        columns["response_length"].append(len(message) if isinstance(message, str) else 0)
+        columns["step"].append(np.nan if step is None else step)
+        turn = response.get("turn") if isinstance(response, dict) else None
+        columns["turn"].append(np.nan if turn is None else turn)
+
+        stream = response.get("stream") if isinstance(response, dict) else None
+        columns["time_to_first_frame"].append(
+            stream["time_to_first_frame"] if stream else np.nan
+        )
+        columns["stream_total_time"].append(stream["total_time"] if stream else np.nan)
+        columns["bytes"].append(stream["bytes"] if stream else np.nan)
+        phases = (response.get("phases") if isinstance(response, dict) else None) or {}
+        for phase in PHASES:
+            columns[f"phase_{phase}"].append(phases.get(phase, np.nan))
+        if stream:
+            self.streamed = True
+            for gap in stream["inter_frame"]:
+                self._gaps.append(gap)
+                self._gap_rows.append(row)
+
+        self._indices = {}
+
+    def extend(self, results: Iterable[Tuple[Dict, dict, float]], step: float = None):
+        for result in results:
+            self.append(result, step)
+
+    @classmethod
+    def from_results(
+        cls, results: Iterable[Tuple[Dict, dict, float]], step: float = None
+    ) -> "ResultTable":
+        table = cls()
+        table.extend(results, step)
+        return table
+
+    def index(self, by: str) -> Dict[Any, np.ndarray]:
+        """
+        Returns the row indices of every group of the "intent", "step" or "turn" column.
+        The index is built once with a stable sort and reused until the next append.
+        """
+        if by not in self._indices:
+            keys = self.column(by)
+            order = np.argsort(keys, kind="stable")
+            unique_keys, starts = np.unique(keys[order], return_index=True)
+            groups = np.split(order, starts[1:])
+            if by == "intent":
+                labels = [self.intents[int(code)] for code in unique_keys]
+            else:
+                labels = [None if np.isnan(key) else key.item() for key in unique_keys]
+            self._indices[by] = dict(zip(labels, groups))
+        return self._indices[by]
+
+    def groups(self, by: str = None) -> Dict[Any, np.ndarray]:
+        if by is None:
+            return {None: np.arange(len(self))}
+        return self.index(by)
+
+    def counts(self, by: str) -> Dict[Any, int]:
+        return {key: len(rows) for key, rows in self.index(by).items()}
+
+    def outcome_counts(self, by: str = None) -> Dict[Any, Dict[str, int]]:
+        """
+        Returns the number of results of every outcome, for every group.
+        """
+        outcomes = self.column("outcome")
+        result = {}
+        for key, rows in self.groups(by).items():
+            counts = np.bincount(outcomes[rows], minlength=len(OUTCOMES))
+            result[key] = dict(zip(OUTCOMES, counts.tolist()))
+        return result
+
+    def censored_counts(self, by: str = None) -> Dict[Any, int]:
+        """
+        Returns the number of censored results (failed or timed out, with a lower-bound latency), for every group.
+        """
+        censored = self.column("censored")
+        return {key: int(censored[rows].sum()) for key, rows in self.groups(by).items()}
+
+    def latency_histograms(
+        self, by: str = None, column: str = "latency"
+    ) -> Dict[Any, LatencyHistogram]:
+        """
+        Returns a histogram of the positive values of a column, for every group.
+        """
+        values = self.column(column)
+        histograms = {}
+        for key, rows in self.groups(by).items():
+            group_values = values[rows]
+            histogram = (
+                LatencyHistogram(lowest=1, highest=1e9)
+                if column == "bytes"
+                else LatencyHistogram()
+            )
+            histogram.record_array(group_values[group_values > 0])
+            histograms[key] = histogram
+        return histograms
+
+    def phase_histograms(self, by: str = None) -> Dict[Any, Dict[str, LatencyHistogram]]:
+        """
+        Returns a histogram of the duration of every request and connection phase, for every group.
+        Phases that were not measured in a group (e.g. no connection was opened) are left out.
+        """
+        columns = {phase: self.column(f"phase_{phase}") for phase in PHASES}
+        histograms = {}
+        for key, rows in self.groups(by).items():
+            histograms[key] = {}
+            for phase, values in columns.items():
+                group_values = values[rows]
+                group_values = group_values[~np.isnan(group_values)]
+                if len(group_values):
+                    # Phases such as parsing take microseconds
+                    histogram = LatencyHistogram(lowest=1e-6)
+                    histogram.record_array(np.maximum(group_values, 0))
+                    histograms[key][phase] = histogram
+        return histograms
+
+    def phase_summaries(self, by: str = None) -> Dict[Any, Dict[str, Dict[str, float]]]:
+        """
+        Returns the count, average and p50/p95/p99 in milliseconds of every phase, for every group.
+        """
+        return {
+            key: {
+                phase: {
+                    "count": histogram.count,
+                    "avg_ms": round(histogram.mean() * 1000, 3),
+                    "p50_ms": round(histogram.percentile(50) * 1000, 3),
+                    "p95_ms": round(histogram.percentile(95) * 1000, 3),
+                    "p99_ms": round(histogram.percentile(99) * 1000, 3),
+                }
+                for phase, histogram in phases.items()
+            }
+            for key, phases in self.phase_histograms(by).items()
+        }
+
+    def inter_frame_histograms(self, by: str = None) -> Dict[Any, LatencyHistogram]:
+        gaps, gap_rows = self._gaps.values(), self._gap_rows.values()
+        histograms = {}
+        if by is None:
+            histogram = LatencyHistogram()
+            histogram.record_array(gaps)
+            return {None: histogram}
+        keys = self.column(by)[gap_rows]
+        for key, rows in self.index(by).items():
+            code = self._intent_codes[key] if by == "intent" else key
+            histogram = LatencyHistogram()
+            histogram.record_array(gaps[keys == code] if code is not None else [])
+            histograms[key] = histogram
+        return histograms
+
+    def to_columns(self) -> Dict[str, Any]:
+        columns = {name: self.column(name) for name in self._columns}
+        columns["intent"] = np.array(self.intents, dtype=object)[columns["intent"]]
+        columns["outcome"] = np.array(OUTCOMES, dtype=object)[columns["outcome"]]
+        return columns
+
+    def to_parquet(self, path: str):
+        """
+        Writes the table to a Parquet file, for analysis in a notebook. Requires pyarrow.
+        """
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError(
+                "pyarrow is required to export results to Parquet: pip install pyarrow"
+            )
+        columns = self.to_columns()
+        table = pa.table(
+            {
+                name: pa.array(values.tolist() if values.dtype == object else values)
+                for name, values in columns.items()
+            }
+        )
+        pq.write_table(table, path)
+
+
+def tabulate_step(
+    all_results: List, step: float, run_table: ResultTable = None
+) -> ResultTable:
+    # The run table keeps every step for the Parquet export, indexed by step
+    if run_table is not None:
+        run_table.extend(all_results, step)
+    return ResultTable.from_results(all_results, step)
+
+
+def summarize_step(step_table: ResultTable, expected_requests: int) -> Dict[str, Any]:
+    latency = step_table.latency_histograms()[None].summary()
+    outcomes = step_table.outcome_counts()[None]
+    general_errors = outcomes["server_error"]
+    client_errors = outcomes["throttled"]
+    unexpected_errors = outcomes["unexpected"]
+    # Timeouts, refused connections and client exceptions never reached an answer
+    client_failures = outcomes["client_failure"]
+    total_errors = general_errors + client_errors + unexpected_errors + client_failures
+    expected_requests = max(expected_requests, 1)
+
+    streaming = {}
+    if step_table.streamed:
+        first_frame = step_table.latency_histograms(None, "time_to_first_frame")[None]
+        streaming = {
+            "avg_time_to_first_frame": round(first_frame.mean(), 2),
+            "max_time_to_first_frame": round(first_frame.max, 2),
+        }
+
+    return {
+        "avg_latency": round(latency["average"], 2),
+        "max_latency": round(latency["max"], 2),
+        "min_latency": round(latency["min"], 2),
+        "p50_latency": round(latency["median"], 2),
+        "p90_latency": round(latency["p90"], 2),
+        "p95_latency": round(latency["p95"], 2),
+        "p99_latency": round(latency["p99"], 2),
+        "p999_latency": round(latency["p999"], 2),
+        "general_error_count": general_errors,
+        "general_error_rate": round(general_errors / expected_requests, 2),
+        "client_error_count": client_errors,
+        "client_error_rate": round(client_errors / expected_requests, 2),
+        "unexpected_error_count": unexpected_errors,
+        "unexpected_error_rate": round(unexpected_errors / expected_requests, 2),
+        "client_failure_count": client_failures,
+        "client_failure_rate": round(client_failures / expected_requests, 2),
+        "total_error_count": total_errors,
+        "total_error_rate": round(total_errors / expected_requests, 2),
+        # Failed and timed-out requests are in the latency figures with their elapsed time
+        "censored_count": step_table.censored_counts()[None],
+        **streaming,
+        "phases": step_table.phase_summaries()[None],
+        "phases_by_intent": step_table.phase_summaries("intent"),
+    }
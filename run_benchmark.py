@@ -0,0 +1,255 @@
+﻿import argparse
+import asyncio
+import datetime
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from typing import List, Dict, Any
+
+from core import WebSocketTester
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+
+def parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Benchmark of the WebSocketTester harness against a zero-latency server"
+    )
+    parser.add_argument(
+        "--ws",
+        default=None,
+        help="WebSocket URL of an existing echo server (a local mock server is started otherwise)",
+    )
+    parser.add_argument(
+        "--connections",
+        type=int,
+        nargs="+",
+        default=[1, 10, 50, 100],
+        help="Connection counts to benchmark",
+    )
+    parser.add_argument(
+        "--queue-sizes",
+        type=int,
+        nargs="+",
+        default=[10, 50],
+        help="Queue sizes to benchmark",
+    )
+    parser.add_argument(
+        "--persistent",
+        action="store_true",
+        help="Reuse one WebSocket connection per virtual user",
+    )
+    parser.add_argument(
+        "--progress",
+        action="store_true",
+        help="Keep the tqdm progress bars, as in real runs",
+    )
+    parser.add_argument(
+        "--output-folder",
+        default="./output",
+        help="Folder to save the benchmark results",
+    )
+    parser.add_argument(
+        "--save-baseline", default=None, help="Save the results as a baseline file"
+    )
+    parser.add_argument(
+        "--baseline", default=None, help="Baseline file to check for regressions"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="Relative degradation allowed before a regression is reported",
+    )
+    return parser.parse_args()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_mock_server(port: int) -> subprocess.Popen:
+    # The server runs in its own process so that its CPU time is not charged to the client
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            os.path.join(os.path.dirname(os.path.abspath(__file__)), "mock_server.py"),
+            "--port",
+            str(port),
+            "--prompts-folder",
+            "",
+        ],
+        stdout=subprocess.DEVNULL,
+    )
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                return server
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError(f"The mock server did not start on port {port}")
+
+
+def max_rss_kb() -> float:
+    if resource is None:
+        return 0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return rss / 1024 if sys.platform == "darwin" else rss
+
+
+async def benchmark_case(
+    tester: WebSocketTester,
+    prompts: List[Dict],
+    scenario: str,
+    connections: int,
+    queue_size: int,
+) -> Dict[str, Any]:
+    tester.reset_histograms()
+    rss_before = max_rss_kb()
+    cpu_before = time.process_time()
+    start_time = time.perf_counter()
+
+    if scenario == "run":
+        results = await tester.run(prompts, connections=connections, queue_size=queue_size)
+    else:
+        results = await tester.asend_batch(
+            [prompts[i % len(prompts)] for i in range(connections * queue_size)]
+        )
+
+    wall_time = time.perf_counter() - start_time
+    cpu_time = time.process_time() - cpu_before
+    latency = tester.histogram.summary()
+    messages = len(results)
+
+    return {
+        "scenario": scenario,
+        "connections": connections,
+        "queue_size": queue_size,
+        "messages": messages,
+        "errors": sum(1 for _, response, _ in results if "error" in response),
+        "wall_time": round(wall_time, 3),
+        "messages_per_second": round(messages / wall_time, 2) if wall_time else 0,
+        "cpu_ms_per_message": round(cpu_time * 1000 / messages, 3) if messages else 0,
+        "memory_growth_kb": round(max_rss_kb() - rss_before, 1),
+        "added_latency_ms": round(latency["average"] * 1000, 3),
+        "added_latency_p99_ms": round(latency["p99"] * 1000, 3),
+    }
+
+
+async def run_benchmark(args: argparse.Namespace, websocket_url: str) -> List[Dict]:
+    tester = WebSocketTester(
+        websocket_url,
+        websocket_url.replace("ws", "http", 1),
+        persistent=args.persistent,
+        show_progress=args.progress,
+    )
+    prompts = [{"Question": f"Question {i}", "Intent": "benchmark"} for i in range(100)]
+
+    cases = []
+    for queue_size in args.queue_sizes:
+        cases.append(await benchmark_case(tester, prompts, "asend_batch", 1, queue_size))
+        for connections in args.connections:
+            cases.append(
+                await benchmark_case(tester, prompts, "run", connections, queue_size)
+            )
+    return cases
+
+
+def case_key(case: Dict[str, Any]) -> str:
+    return f"{case['scenario']}-{case['connections']}x{case['queue_size']}"
+
+
+def find_regressions(
+    cases: List[Dict], baseline: List[Dict], tolerance: float
+) -> List[str]:
+    baseline_cases = {case_key(case): case for case in baseline}
+    regressions = []
+    for case in cases:
+        reference = baseline_cases.get(case_key(case))
+        if reference is None:
+            continue
+        if case["messages_per_second"] < reference["messages_per_second"] * (
+            1 - tolerance
+        ):
+            regressions.append(
+                f"{case_key(case)}: {case['messages_per_second']} messages/s "
+                f"(baseline {reference['messages_per_second']})"
+            )
+        for field in ["cpu_ms_per_message", "added_latency_ms"]:
+            if case[field] > reference[field] * (1 + tolerance):
+                regressions.append(
+                    f"{case_key(case)}: {field} {case[field]} (baseline {reference[field]})"
+                )
+    return regressions
+
+
+def print_table(cases: List[Dict]):
+    print(
+        f"{'case':<24}{'msg/s':>10}{'cpu ms/msg':>12}{'mem KB':>10}"
+        f"{'lat ms':>10}{'p99 ms':>10}{'errors':>8}"
+    )
+    for case in cases:
+        print(
+            f"{case_key(case):<24}{case['messages_per_second']:>10}"
+            f"{case['cpu_ms_per_message']:>12}{case['memory_growth_kb']:>10}"
+            f"{case['added_latency_ms']:>10}{case['added_latency_p99_ms']:>10}"
+            f"{case['errors']:>8}"
+        )
+
+
+def main():
+    args = parse_arguments()
+
+    server = None
+    websocket_url = args.ws
+    if websocket_url is None:
+        port = free_port()
+        server = start_mock_server(port)
+        websocket_url = f"ws://127.0.0.1:{port}"
+
+    try:
+        cases = asyncio.run(run_benchmark(args, websocket_url))
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    print_table(cases)
+
+    os.makedirs(args.output_folder, exist_ok=True)
+    date_str = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    result_file = os.path.join(args.output_folder, f"benchmark_results_{date_str}.json")
+    with open(result_file, "w") as f:
+        json.dump(cases, f, indent=2)
+    print(f"Results saved to {result_file}")
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(cases, f, indent=2)
+        print(f"Baseline saved to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        regressions = find_regressions(cases, baseline, args.tolerance)
+        if regressions:
+            print("Regressions detected:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("No regression against the baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,4 @@
-﻿import json
-import asyncio
+﻿import asyncio
 import random
 import string
 from langfuse import Langfuse
@@ -9,6 +8,7 @@ from langfuse.client import DatasetItemClient
 from tqdm.asyncio import tqdm_asyncio
 
 from core import WebSocketTester
+from telemetry import TelemetryExporter
 
 load_dotenv()
 langfuse = Langfuse(
@@ -33,17 +33,29 @@ def classification_accuracy(input: dict, output: dict) -> float:
         return 0.0
 
 
+def send_telemetry(event: dict):
+    """
+    Sends one telemetry event; called from the exporter thread, outside the event loop.
+    """
+    if event["type"] == "link":
+        event["item"].link(
+            trace_or_observation=None,
+            run_name=event["run_name"],
+            trace_id=event["trace_id"],
+        )
+    else:
+        langfuse.score(**event["score"])
+
+
 async def process_item(
-    ws_tester, item: DatasetItemClient, run_name: str = "load_test_run"
+    ws_tester,
+    item: DatasetItemClient,
+    exporter: TelemetryExporter,
+    run_name: str = "load_test_run",
 ):
+    # asend_message returns the already decoded response
     _, output, latency = await ws_tester.asend_message({"Question": item.input})
-    output = json.loads(output)
-    trace_id = output.get("traceId", None)
-    if len(trace_id) > 0:
-        try:
-            item.link(trace_or_observation=None, run_name=run_name, trace_id=trace_id)
-        except Exception as e:
-            print(f"Error: {str(e)}")
+    trace_id = output.get("traceId") if isinstance(output, dict) else None
 
     # Check if output is a dictionary and has the 'intent' key
     if isinstance(output, dict) and "intent" in output.keys():
@@ -52,12 +64,22 @@ async def process_item(
         accuracy = 0.0
         print(f"Warning: Unexpected output format: {output}")
 
-    langfuse.score(
-        trace_id=trace_id,
-        name="classification accuracy",
-        value=accuracy,
-        comment=f"Latency: {latency:.2f}s",
-    )
+    # Failed requests have no trace to link or score
+    if trace_id:
+        await exporter.submit(
+            {"type": "link", "item": item, "run_name": run_name, "trace_id": trace_id}
+        )
+        await exporter.submit(
+            {
+                "type": "score",
+                "score": {
+                    "trace_id": trace_id,
+                    "name": "classification accuracy",
+                    "value": accuracy,
+                    "comment": f"Latency: {latency:.2f}s",
+                },
+            }
+        )
     return output
 
 
@@ -66,7 +88,11 @@ def generate_small_hash(length=8):
     return "".join(random.choice(characters) for _ in range(length))
 
 
-async def main(max_parallel_tasks: int = 5):
+async def main(
+    max_parallel_tasks: int = 5,
+    telemetry_batch_size: int = 50,
+    telemetry_queue_size: int = 1000,
+):
     ws_tester = WebSocketTester(
         websocket_url=os.environ.get("WEBSOCKET_URL"), origin=os.environ.get("ORIGIN")
     )
@@ -81,15 +107,25 @@ async def main(max_parallel_tasks: int = 5):
 
         semaphore = asyncio.Semaphore(max_parallel_tasks)
 
-        async def process_item_with_semaphore(item):
-            async with semaphore:
-                return await process_item(ws_tester, item, run_name=run_name)
+        # Scores and trace links are sent in batches from a background task, so the
+        # telemetry backend does not slow down the requests being measured
+        async with TelemetryExporter(
+            send_telemetry, telemetry_batch_size, telemetry_queue_size
+        ) as exporter:
+
+            async def process_item_with_semaphore(item):
+                async with semaphore:
+                    return await process_item(
+                        ws_tester, item, exporter, run_name=run_name
+                    )
 
-        tasks = [process_item_with_semaphore(item) for item in dataset.items]
-        results = await tqdm_asyncio.gather(*tasks, desc="Running load test")
+            tasks = [process_item_with_semaphore(item) for item in dataset.items]
+            results = await tqdm_asyncio.gather(*tasks, desc="Running load test")
 
-        print("\nLoad test completed.")
-        print(f"Total items processed: {len(results)}")
+            print("\nLoad test completed.")
+            print(f"Total items processed: {len(results)}")
+            print("Flushing telemetry...")
+        print(exporter.summary())
 
     # Flush the langfuse client to ensure all data is sent to the server at the end of the experiment run
     langfuse.flush()
@@ -107,6 +143,25 @@ if __name__ == "__main__":
         default=5,
         help="Maximum number of parallel task executions",
     )
+    parser.add_argument(
+        "--telemetry_batch_size",
+        type=int,
+        default=50,
+        help="Maximum number of scores and trace links handed to the exporter thread at once "
+        "(they are still sent one by one)",
+    )
+    parser.add_argument(
+        "--telemetry_queue_size",
+        type=int,
+        default=1000,
+        help="Maximum number of pending scores and trace links before requests wait for the exporter",
+    )
     args = parser.parse_args()
 
-    asyncio.run(main(max_parallel_tasks=args.max_parallel))
+    asyncio.run(
+        main(
+            max_parallel_tasks=args.max_parallel,
+            telemetry_batch_size=args.telemetry_batch_size,
+            telemetry_queue_size=args.telemetry_queue_size,
+        )
+    )
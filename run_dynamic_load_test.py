@@ -4,12 +4,22 @@ import json
 import logging
 import os
 import random
-from time import sleep
-from typing import List, Dict, Any
-from matplotlib import pyplot as plt
+import time
+from typing import List, Dict, Any, Tuple
 from websockets.exceptions import WebSocketException
 
-from core import WebSocketTester, Metric
+from adaptive import AIMDController
+from analytics import Analytics
+from arrivals import ARRIVAL_PROFILES
+from conversations import conversation_sampler, read_conversations, scripted_sampler
+from core import WebSocketTester, Metric, classify_response
+from dataset_loader import load_prompts
+from distributions import parse_distribution
+from results_table import ResultTable, summarize_step, tabulate_step
+from histogram import LatencyHistogram
+from run_history import DEFAULT_HISTORY, RunHistory
+from telemetry import LiveMetrics
+from workers import WorkerPool
 import datetime
 
 
@@ -47,39 +57,246 @@ def parse_arguments() -> argparse.Namespace:
         default=-1,
         help="Maximum number of prompts to sample",
     )
+    parser.add_argument(
+        "--include-hidden",
+        action="store_true",
+        help="Also load the prompts of sub-folders of the prompts folder (e.g. datasets/hidden)",
+    )
     parser.add_argument(
         "--queue-size",
         type=int,
         default=10,
         help="Maximum number of messages in the queue per connection",
     )
+    parser.add_argument(
+        "--persistent",
+        action="store_true",
+        help="Reuse one WebSocket connection per virtual user instead of one per message",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Read streamed multi-frame responses and report time-to-first-frame",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of processes the connections are sharded across",
+    )
+    parser.add_argument(
+        "--expected-interval",
+        type=float,
+        default=None,
+        help="Intended seconds between two requests of a connection, used to correct the "
+        "closed-loop percentiles for coordinated omission (defaults to --think-time)",
+    )
+    parser.add_argument(
+        "--warmup",
+        type=float,
+        default=0.0,
+        help="Seconds at the start of each step whose requests are excluded from the statistics",
+    )
+    parser.add_argument(
+        "--steady-duration",
+        type=float,
+        default=None,
+        help="Seconds of steady state after the warm-up; connections then send until it ends "
+        "instead of sending --queue-size messages",
+    )
+    parser.add_argument(
+        "--spawn-rate",
+        type=float,
+        default=None,
+        help="Connections started per second at the start of a step, instead of all at once; "
+        "requests sent during the ramp-up are excluded like warm-up requests",
+    )
+    parser.add_argument(
+        "--start-jitter",
+        type=float,
+        default=0.0,
+        help="Maximum random delay in seconds added to the start of each connection",
+    )
+    parser.add_argument(
+        "--staggered",
+        action="store_true",
+        help="Keep the connections of a step running while the next step's connections join, "
+        "with no cooldown in between (connections mode, requires --steady-duration)",
+    )
+    parser.add_argument(
+        "--cooldown",
+        type=float,
+        default=60.0,
+        help="Seconds to wait between steps (maximum wait with --adaptive-cooldown)",
+    )
+    parser.add_argument(
+        "--adaptive-cooldown",
+        action="store_true",
+        help="End the cooldown as soon as a probe request is no longer throttled",
+    )
+    parser.add_argument(
+        "--probe-interval",
+        type=float,
+        default=5.0,
+        help="Seconds between two probe requests during an adaptive cooldown",
+    )
+    parser.add_argument(
+        "--parquet",
+        action="store_true",
+        help="Export every result of the run, indexed by step, to Parquet (requires pyarrow)",
+    )
+    parser.add_argument(
+        "--html-report",
+        action="store_true",
+        help="Write one self-contained HTML report instead of separate PNG charts",
+    )
+    parser.add_argument(
+        "--history",
+        default=DEFAULT_HISTORY,
+        help="SQLite run-history database the results are recorded in (empty to disable)",
+    )
+    parser.add_argument(
+        "--live-metrics",
+        action="store_true",
+        help="Log rolling-window throughput, latency percentiles and error counts every second",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=None,
+        help="Serve the live metrics as Prometheus text on this local port (implies --live-metrics)",
+    )
+    parser.add_argument(
+        "--live-window",
+        type=float,
+        default=10.0,
+        help="Length in seconds of the rolling window used by the live metrics",
+    )
+    parser.add_argument(
+        "--mode",
+        choices=["connections", "rps", "search", "conversations", "adaptive"],
+        default="connections",
+        help="Sweep closed-loop connection counts or open-loop request rates, "
+        "search the maximum connection count meeting the SLOs, "
+        "sweep multi-turn conversational users, "
+        "or let an AIMD controller find the sustainable concurrency in one run",
+    )
+    parser.add_argument(
+        "--slo-p95",
+        type=float,
+        default=10.0,
+        help="Maximum p95 latency in seconds of a sustainable step (search mode)",
+    )
+    parser.add_argument(
+        "--slo-throttle-rate",
+        type=float,
+        default=0.01,
+        help="Maximum rate of throttled responses of a sustainable step (search mode)",
+    )
+    parser.add_argument(
+        "--slo-error-rate",
+        type=float,
+        default=1.0,
+        help="Maximum total error rate of a sustainable step (search mode)",
+    )
+    parser.add_argument(
+        "--search-precision",
+        type=int,
+        default=5,
+        help="Width in connections below which the search stops (search mode)",
+    )
+    parser.add_argument(
+        "--max-rps",
+        type=float,
+        default=10.0,
+        help="Maximum target requests per second (rps mode)",
+    )
+    parser.add_argument(
+        "--rps-step",
+        type=float,
+        default=1.0,
+        help="Requests per second added at each step (rps mode)",
+    )
+    parser.add_argument(
+        "--step-duration",
+        type=float,
+        default=60.0,
+        help="Duration of each open-loop step in seconds (rps mode), "
+        "or of the steady-state window (adaptive mode)",
+    )
+    parser.add_argument(
+        "--arrival",
+        choices=ARRIVAL_PROFILES,
+        default="constant",
+        help="Arrival process of the open-loop requests (rps mode)",
+    )
+    parser.add_argument(
+        "--aimd-increase",
+        type=float,
+        default=1.0,
+        help="Requests in flight added per round of successful requests (adaptive mode)",
+    )
+    parser.add_argument(
+        "--aimd-decrease",
+        type=float,
+        default=0.5,
+        help="Factor applied to the requests in flight on a throttled response or a timeout "
+        "(adaptive mode)",
+    )
+    parser.add_argument(
+        "--turns",
+        default="5",
+        help="Distribution of the number of turns of a sampled conversation, "
+        "e.g. 5 or uniform:3,8 (conversations mode)",
+    )
+    parser.add_argument(
+        "--think-dist",
+        default="exponential:5",
+        help="Distribution of the think time in seconds before each follow-up question, "
+        "e.g. exponential:5 or lognormal:4,0.6 (conversations mode)",
+    )
+    parser.add_argument(
+        "--conversations",
+        default=None,
+        help="JSONL file of scripted conversations to walk instead of sampled ones (conversations mode)",
+    )
+    parser.add_argument(
+        "--conversations-per-user",
+        type=int,
+        default=1,
+        help="Conversations walked by each user, unless --steady-duration is given (conversations mode)",
+    )
+    args = parser.parse_args()
+    if args.search_precision < 1:
+        parser.error("argument --search-precision: must be at least 1")
+    if args.spawn_rate is not None and args.spawn_rate <= 0:
+        parser.error("argument --spawn-rate: must be positive")
+    if args.staggered:
+        if args.mode != "connections":
+            parser.error("argument --staggered: only supported in connections mode")
+        if args.steady_duration is None:
+            parser.error("argument --staggered: requires --steady-duration")
+        if args.workers > 1:
+            parser.error("argument --staggered: not supported with --workers")
+    if args.mode == "adaptive":
+        if args.workers > 1:
+            parser.error("argument --workers: not supported in adaptive mode")
+        if not 0 < args.aimd_decrease < 1:
+            parser.error("argument --aimd-decrease: must be between 0 and 1")
+    if args.mode == "conversations":
+        if args.workers > 1:
+            parser.error("argument --workers: not supported in conversations mode")
+        try:
+            parse_distribution(args.turns)
+            parse_distribution(args.think_dist)
+        except ValueError as e:
+            parser.error(str(e))
     if parser.parse_args().step_size > parser.parse_args().max_connections:
         parser.error(
             f"argument --step-size: {parser.parse_args().step_size} "
             f"must be less than or equal to --max-connections: {parser.parse_args().max_connections}"
         )
-    return parser.parse_args()
-
-
-def read_prompts(folder_path: str, max_samples: int = -1) -> List[Dict]:
-    prompts = []
-    for filename in os.listdir(folder_path):
-        if filename.endswith(".jsonl"):
-            file_path = os.path.join(folder_path, filename)
-            with open(file_path, "r", encoding="utf8") as file:
-                lines = file.readlines()
-                if max_samples == -1:
-                    sampled_lines = lines
-                else:
-                    num_samples = min(max_samples, len(lines))
-                    sampled_lines = random.sample(lines, num_samples)
-                for line in sampled_lines:
-                    try:
-                        prompt = json.loads(line)
-                        prompts.append(prompt)
-                    except (json.JSONDecodeError, KeyError):
-                        print(f"Warning: Skipping invalid line in {filename}")
-    return prompts
+    return args
 
 
 def get_metrics() -> List[Metric]:
@@ -87,145 +304,503 @@ def get_metrics() -> List[Metric]:
     return []
 
 
-def plot_results(res_dict: Dict[str, Any], output_file: str):
-    results = res_dict["results"]
-    connections = list(results.keys())
-    avg_latencies = [results[conn]["avg_latency"] for conn in connections]
-    max_latencies = [results[conn]["max_latency"] for conn in connections]
-    general_error_rates = [results[conn]["general_error_rate"] for conn in connections]
-    client_error_rates = [results[conn]["client_error_rate"] for conn in connections]
-    unexpected_error_rates = [
-        results[conn]["unexpected_error_rate"] for conn in connections
-    ]
-
-    fig, ax1 = plt.subplots(figsize=(10, 6))
-
-    # Plot average latency
-    color = "tab:blue"
-    ax1.set_xlabel("Number of connections")
-    ax1.set_ylabel("Average latency (s)", color=color, rotation=270, labelpad=10)
-    ax1.plot(connections, avg_latencies, color=color, marker="o")
-    ax1.tick_params(axis="y", labelcolor=color)
-
-    # Plot max latency
-    color = "tab:green"
-    ax1.set_ylabel("Max latency (s)", color=color, rotation=270, labelpad=10)
-    ax1.plot(connections, max_latencies, color=color, marker="o")
-    ax1.tick_params(axis="y", labelcolor=color)
-
-    # Create a second y-axis for error rate
-    ax2 = ax1.twinx()
-    color = "tab:orange"
-    ax2.set_ylabel("General error rate", color=color, rotation=270, labelpad=10)
-    ax2.plot(connections, general_error_rates, color=color, marker="s")
-    ax2.tick_params(axis="y", labelcolor=color)
-
-    # Create a third y-axis for error rate
-    ax3 = ax1.twinx()
-    color = "tab:red"
-    ax3.set_ylabel("Client error rate", color=color, rotation=270, labelpad=10)
-    ax3.plot(connections, client_error_rates, color=color, marker="s")
-    ax3.tick_params(axis="y", labelcolor=color)
-
-    # Create a fourth y-axis for error rate
-    ax4 = ax1.twinx()
-    color = "tab:purple"
-    ax4.set_ylabel("Unexpected error rate", color=color, rotation=270, labelpad=10)
-    ax4.plot(connections, unexpected_error_rates, color=color, marker="s")
-    ax4.tick_params(axis="y", labelcolor=color)
-
-    # Set y-axis for error rates to percentage
-    ax2.set_ylim(0, 1)
-    ax3.set_ylim(0, 1)
-    ax4.set_ylim(0, 1)
-    ax2.yaxis.set_major_formatter(plt.FuncFormatter(lambda y, _: "{:.0%}".format(y)))
-    ax3.yaxis.set_major_formatter(plt.FuncFormatter(lambda y, _: "{:.0%}".format(y)))
-    ax4.yaxis.set_major_formatter(plt.FuncFormatter(lambda y, _: "{:.0%}".format(y)))
-
-    plt.title("Average latency and error rates vs Number of connections")
-    fig.tight_layout()
-    plt.savefig(output_file)
-    plt.close()
-
-    print(f"Results plot saved to {output_file}")
+def plot_results(
+    res_dict: Dict[str, Any], output_folder: str, suffix: str, html_report: bool = False
+):
+    analytics = Analytics(output_folder, output_folder, suffix=suffix)
+    charts = [("load_test_results", res_dict), ("latency_percentiles", res_dict)]
+    if "adaptive" in res_dict:
+        # A single step: the timeline of the controller is more telling than the step curves
+        charts = [("adaptive_concurrency", res_dict)]
+    if html_report:
+        tables = {
+            "Parameters": {
+                k: v for k, v in res_dict.items() if k not in ("results", "adaptive")
+            }
+        }
+        tables["Results"] = res_dict["results"]
+        if "adaptive" in res_dict:
+            tables["Adaptive concurrency"] = {
+                k: v for k, v in res_dict["adaptive"].items() if k != "timeline"
+            }
+        report = analytics.write_html_report("Dynamic load test", charts, tables)
+        print(f"HTML report written to {report}")
+        return
+    for path in analytics.render(charts, dpi=100):
+        print(f"Results plot saved to {path}")
+
+
+def summarize_turns(step_table: ResultTable) -> Dict[int, Dict[str, Any]]:
+    """
+    Summarizes the latency and response length of every conversation turn, to show how the
+    backend behaves as conversations grow longer.
+    """
+    histograms = step_table.latency_histograms("turn")
+    lengths = step_table.column("response_length")
+    turns = {}
+    for turn, rows in sorted(step_table.index("turn").items(), key=lambda item: item[0] or 0):
+        if turn is None:
+            continue
+        latency = histograms[turn].summary()
+        turns[int(turn)] = {
+            "count": len(rows),
+            "avg_latency": round(latency["average"], 2),
+            "p50_latency": round(latency["median"], 2),
+            "p95_latency": round(latency["p95"], 2),
+            "avg_response_length": round(float(lengths[rows].mean()), 1),
+        }
+    return turns
+
+
+def create_conversation_sampler(args: argparse.Namespace, cached_prompts: List[Dict]):
+    if args.conversations:
+        conversations = read_conversations(args.conversations)
+        if not conversations:
+            raise ValueError(f"No valid conversations found in {args.conversations}")
+        return scripted_sampler(conversations)
+    return conversation_sampler(cached_prompts, parse_distribution(args.turns))
+
+
+def create_tester(args: argparse.Namespace, cached_prompts: List[Dict]):
+    if args.workers > 1:
+        if args.live_metrics or args.metrics_port:
+            print("Warning: live metrics are not available with --workers, ignoring")
+        return WorkerPool(
+            args.workers,
+            args.ws,
+            args.origin,
+            cached_prompts,
+            persistent=args.persistent,
+            stream=args.stream,
+        )
+    live = None
+    if args.live_metrics or args.metrics_port:
+        live = LiveMetrics(window=args.live_window)
+    return WebSocketTester(
+        args.ws,
+        args.origin,
+        get_metrics(),
+        persistent=args.persistent,
+        stream=args.stream,
+        live=live,
+    )
 
 
 async def run_dynamic_load_test(
-    args: argparse.Namespace, cached_prompts: List[Dict]
-) -> Dict[str, Any]:
-    load_tester = WebSocketTester(args.ws, args.origin, get_metrics())
-    results = {}
-    connection_count = args.step_size
+    args: argparse.Namespace,
+    cached_prompts: List[Dict],
+    run_table: ResultTable = None,
+) -> Tuple[Dict[str, Any], LatencyHistogram, Dict[str, Any]]:
+    load_tester = create_tester(args, cached_prompts)
+    if load_tester.live:
+        await load_tester.live.start(args.metrics_port)
+    try:
+        if args.mode == "rps":
+            return await run_rps_sweep(
+                args, cached_prompts, load_tester, run_table
+            )
+        if args.mode == "search":
+            return await run_capacity_search(
+                args, cached_prompts, load_tester, run_table
+            )
+        if args.mode == "adaptive":
+            return await run_adaptive_test(
+                args, cached_prompts, load_tester, run_table
+            )
+        if args.staggered:
+            return await run_staggered_sweep(
+                args, cached_prompts, load_tester, run_table
+            )
+        return await run_connection_sweep(
+            args, cached_prompts, load_tester, run_table
+        )
+    finally:
+        if load_tester.live:
+            await load_tester.live.stop()
+        if isinstance(load_tester, WorkerPool):
+            load_tester.close()
+
+
+async def cooldown(args: argparse.Namespace, cached_prompts: List[Dict]) -> float:
+    """
+    Waits between two steps so that the Bedrock quotas recover, without blocking the event loop.
+    With --adaptive-cooldown, a single probe request is sent every --probe-interval seconds and
+    the cooldown ends as soon as a probe is answered without throttling, or after --cooldown seconds.
+
+    Returns:
+        float: The time spent cooling down, in seconds.
+    """
+    start_time = time.monotonic()
+    if not args.adaptive_cooldown:
+        await asyncio.sleep(args.cooldown)
+        return args.cooldown
+
+    # Probes use their own tester so they stay out of the step statistics
+    probe_tester = WebSocketTester(args.ws, args.origin, show_progress=False)
+    while (remaining := args.cooldown - (time.monotonic() - start_time)) > 0:
+        await asyncio.sleep(min(args.probe_interval, remaining))
+        _, response, _ = await probe_tester.asend_message(
+            random.choice(cached_prompts),
+            timeout=max(args.cooldown - (time.monotonic() - start_time), 1),
+        )
+        if classify_response(response) == "ok":
+            break
+
+    elapsed = round(time.monotonic() - start_time, 2)
+    print(f"Cooldown ended after {elapsed} seconds")
+    return elapsed
 
-    while connection_count <= args.max_connections:
 
+async def run_connection_step(
+    args: argparse.Namespace,
+    cached_prompts: List[Dict],
+    load_tester,
+    connection_count: int,
+    run_table: ResultTable = None,
+) -> Dict[str, Any]:
+    counters_before = load_tester.get_counters()
+    load_tester.reset_histograms()
+    if load_tester.live:
+        load_tester.live.step = connection_count
+
+    started = time.monotonic()
+    if args.mode == "conversations":
+        all_results = await load_tester.run_conversations(
+            create_conversation_sampler(args, cached_prompts),
+            users=connection_count,
+            think_time=parse_distribution(args.think_dist),
+            conversations_per_user=args.conversations_per_user,
+            warmup=args.warmup,
+            duration=args.steady_duration,
+            spawn_rate=args.spawn_rate,
+            start_jitter=args.start_jitter,
+        )
+    else:
         all_results = await load_tester.run(
             prompts=cached_prompts,
             connections=connection_count,
             queue_size=args.queue_size,
             think_time=args.think_time,
+            warmup=args.warmup,
+            duration=args.steady_duration,
+            expected_interval=args.expected_interval,
+            spawn_rate=args.spawn_rate,
+            start_jitter=args.start_jitter,
         )
 
-        # Process and store results
-        latencies = [latency for _, _, latency in all_results if latency > 0]
-        general_errors = [
-            resp
-            for _, resp, _ in all_results
-            if isinstance(resp, dict)
-            and "erreur est survenue" in resp.get("message", "")
-        ]
-        client_errors = [
-            resp
-            for _, resp, _ in all_results
-            if isinstance(resp, dict)
-            and "Nous rencontrons un trafic intense" in resp.get("message", "")
-        ]
-        unexpected_errors = [
-            resp for _, resp, _ in all_results if not isinstance(resp, dict)
-        ]
-
-        results[connection_count] = {
-            "connections_count": connection_count,
-            "avg_latency": (
-                round(sum(latencies) / len(latencies), 2) if latencies else 0
-            ),
-            "max_latency": round(max(latencies), 2) if latencies else 0,
-            "min_latency": round(min(latencies), 2) if latencies else 0,
-            "general_error_count": len(general_errors),
-            "general_error_rate": round(
-                len(general_errors) / (connection_count * args.queue_size), 2
-            ),
-            "client_error_count": len(client_errors),
-            "client_error_rate": round(
-                len(client_errors) / (connection_count * args.queue_size), 2
-            ),
-            "unexpected_error_count": len(unexpected_errors),
-            "unexpected_error_rate": round(
-                len(unexpected_errors) / (connection_count * args.queue_size), 2
-            ),
-            "total_error_count": len(general_errors)
-            + len(client_errors)
-            + len(unexpected_errors),
-            "total_error_rate": round(
-                (len(general_errors) + len(client_errors) + len(unexpected_errors))
-                / (connection_count * args.queue_size),
-                2,
-            ),
-        }
+    # Requests sent during the ramp-up are excluded, so is its duration
+    elapsed = time.monotonic() - started - load_tester.ramp_up - args.warmup
+    return summarize_connection_step(
+        args,
+        load_tester,
+        connection_count,
+        all_results,
+        elapsed,
+        counters_before,
+        run_table,
+    )
+
+
+def summarize_connection_step(
+    args: argparse.Namespace,
+    load_tester,
+    connection_count: int,
+    all_results: List,
+    elapsed: float,
+    counters_before: Dict[str, int],
+    run_table: ResultTable = None,
+) -> Dict[str, Any]:
+    # Warm-up and ramp-up requests are excluded, so only the steady-state requests are expected
+    expected_requests = (
+        len(all_results)
+        if args.warmup
+        or args.steady_duration
+        or args.spawn_rate
+        or args.start_jitter
+        or args.mode == "conversations"
+        else connection_count * args.queue_size
+    )
 
-        print(f"Results for {connection_count} connections:")
+    # Process and store results
+    step_table = tabulate_step(all_results, connection_count, run_table)
+    step_result = {
+        "connections_count": connection_count,
+        **summarize_step(step_table, expected_requests),
+        "handshake_count": load_tester.handshake_count - counters_before["handshakes"],
+        "message_count": load_tester.message_count - counters_before["messages"],
+        "achieved_rps": round(len(all_results) / elapsed, 2) if elapsed > 0 else 0,
+    }
+    if args.mode != "conversations":
+        # Closed-loop percentiles corrected for coordinated omission
+        corrected = load_tester.corrected_histogram.summary()
+        for key in ["median", "p90", "p95", "p99", "p999"]:
+            name = "p50" if key == "median" else key
+            step_result[f"corrected_{name}_latency"] = round(corrected[key], 2)
+    if args.mode == "conversations":
+        step_result["latency_by_turn"] = summarize_turns(step_table)
+
+    print(f"Results for {connection_count} connections:")
+    print(f"  Average Latency: {step_result['avg_latency']:.2f} seconds")
+    print(f"  Error Rate: {step_result['total_error_rate']:.2%}")
+    if "corrected_p99_latency" in step_result:
         print(
-            f"  Average Latency: {results[connection_count]['avg_latency']:.2f} seconds"
+            f"  P99 Latency: {step_result['p99_latency']:.2f} seconds "
+            f"({step_result['corrected_p99_latency']:.2f} corrected for coordinated omission)"
         )
-        print(f"  Error Rate: {results[connection_count]['total_error_rate']:.2%}")
+    for turn, summary in step_result.get("latency_by_turn", {}).items():
+        print(f"  Turn {turn}: average latency {summary['avg_latency']:.2f} seconds")
+    return step_result
+
+
+async def run_connection_sweep(
+    args: argparse.Namespace,
+    cached_prompts: List[Dict],
+    load_tester,
+    run_table: ResultTable = None,
+) -> Tuple[Dict[str, Any], LatencyHistogram, Dict[str, Any]]:
+    results = {}
+    overall_histogram = LatencyHistogram()
+    connection_count = args.step_size
+
+    while connection_count <= args.max_connections:
+        results[connection_count] = await run_connection_step(
+            args, cached_prompts, load_tester, connection_count, run_table
+        )
+        previous = connection_count
+        overall_histogram.merge(load_tester.histogram)
 
         connection_count = min(
             connection_count + args.step_size, args.max_connections + 1
         )
-        # wait a minute between each iteration to make sure the bedrock quotas are reset
-        sleep(60)
+        if connection_count <= args.max_connections:
+            results[previous]["cooldown_seconds"] = await cooldown(args, cached_prompts)
+
+    return results, overall_histogram, {}
+
+
+async def run_staggered_sweep(
+    args: argparse.Namespace,
+    cached_prompts: List[Dict],
+    load_tester,
+    run_table: ResultTable = None,
+) -> Tuple[Dict[str, Any], LatencyHistogram, Dict[str, Any]]:
+    """
+    Sweeps the connection counts like run_connection_sweep, but the connections of a step
+    keep running while the next step's connections join, so each step is measured in the
+    steady state reached from the previous one instead of after a cold start.
+    """
+    results = {}
+    overall_histogram = LatencyHistogram()
+    steps = list(range(args.step_size, args.max_connections + 1, args.step_size))
+    if steps[-1] != args.max_connections:
+        steps.append(args.max_connections)
+
+    counters_before = load_tester.get_counters()
+    steps_iterator = load_tester.run_staggered(
+        cached_prompts,
+        steps,
+        think_time=args.think_time,
+        warmup=args.warmup,
+        duration=args.steady_duration,
+        expected_interval=args.expected_interval,
+        spawn_rate=args.spawn_rate,
+        start_jitter=args.start_jitter,
+    )
+    # The users keep sending while a step is summarized, which must not yield to the event loop
+    async for connection_count, all_results, elapsed in steps_iterator:
+        results[connection_count] = summarize_connection_step(
+            args,
+            load_tester,
+            connection_count,
+            all_results,
+            elapsed,
+            counters_before,
+            run_table,
+        )
+        overall_histogram.merge(load_tester.histogram)
+        counters_before = load_tester.get_counters()
+
+    return results, overall_histogram, {}
+
+
+def meets_slo(step_result: Dict[str, Any], args: argparse.Namespace) -> bool:
+    return (
+        step_result["p95_latency"] <= args.slo_p95
+        and step_result["client_error_rate"] <= args.slo_throttle_rate
+        and step_result["total_error_rate"] <= args.slo_error_rate
+    )
+
+
+async def run_capacity_search(
+    args: argparse.Namespace,
+    cached_prompts: List[Dict],
+    load_tester,
+    run_table: ResultTable = None,
+) -> Tuple[Dict[str, Any], LatencyHistogram, Dict[str, Any]]:
+    """
+    Searches the largest connection count meeting the SLOs: the count doubles from
+    --step-size until a step breaks an SLO (or --max-connections is reached), then the
+    interval between the last passing and the first failing count is bisected until it
+    is narrower than --search-precision.
+    """
+    results = {}
+    overall_histogram = LatencyHistogram()
+    runs = []
+    passing, failing = 0, None
+
+    async def probe(connection_count: int) -> bool:
+        if runs:
+            results[runs[-1]["connections"]]["cooldown_seconds"] = await cooldown(
+                args, cached_prompts
+            )
+        step_result = await run_connection_step(
+            args, cached_prompts, load_tester, connection_count, run_table
+        )
+        overall_histogram.merge(load_tester.histogram)
+        passed = meets_slo(step_result, args)
+        step_result["meets_slo"] = passed
+        results[connection_count] = step_result
+        runs.append(
+            {
+                "connections": connection_count,
+                "p95_latency": step_result["p95_latency"],
+                "throttle_rate": step_result["client_error_rate"],
+                "error_rate": step_result["total_error_rate"],
+                "client_failure_rate": step_result["client_failure_rate"],
+                "meets_slo": passed,
+            }
+        )
+        print(f"  {'Meets' if passed else 'Breaks'} the SLOs")
+        return passed
+
+    # Exponential phase: find a failing upper bound
+    connection_count = min(args.step_size, args.max_connections)
+    while True:
+        if await probe(connection_count):
+            passing = connection_count
+            if connection_count >= args.max_connections:
+                break
+            connection_count = min(connection_count * 2, args.max_connections)
+        else:
+            failing = connection_count
+            break
+
+    # Binary phase: narrow the interval between the last passing and first failing counts
+    while failing is not None and failing - passing > args.search_precision:
+        connection_count = (passing + failing) // 2
+        # Adjacent counts cannot be split further
+        if connection_count in (passing, failing):
+            break
+        if await probe(connection_count):
+            passing = connection_count
+        else:
+            failing = connection_count
+
+    results = dict(sorted(results.items()))
+    capacity = {
+        "slo": {
+            "p95_latency": args.slo_p95,
+            "throttle_rate": args.slo_throttle_rate,
+            "error_rate": args.slo_error_rate,
+        },
+        "max_sustainable_connections": passing,
+        "first_failing_connections": failing,
+        "knee": results.get(passing),
+        "runs": runs,
+    }
+
+    print(
+        f"Maximum sustainable concurrency: {passing} connections "
+        f"({'no failing step up to --max-connections' if failing is None else f'SLOs broken at {failing}'}), "
+        f"found in {len(runs)} runs"
+    )
+    return results, overall_histogram, {"capacity": capacity}
+
+
+async def run_adaptive_test(
+    args: argparse.Namespace,
+    cached_prompts: List[Dict],
+    load_tester,
+    run_table: ResultTable = None,
+) -> Tuple[Dict[str, Any], LatencyHistogram, Dict[str, Any]]:
+    """
+    Runs a single step whose concurrency is adjusted live by an AIMD controller, starting
+    at --step-size and capped at --max-connections. The step is keyed by the concurrency
+    it settled at, and the controller's report is returned under "adaptive".
+    """
+    controller = AIMDController(
+        initial=args.step_size,
+        max_limit=args.max_connections,
+        increase=args.aimd_increase,
+        decrease=args.aimd_decrease,
+    )
+    load_tester.reset_histograms()
+    if load_tester.live:
+        load_tester.live.step = "adaptive"
+    all_results = await load_tester.run_adaptive(
+        cached_prompts, controller, duration=args.step_duration, warmup=args.warmup
+    )
+
+    adaptive = load_tester.adaptive
+    step = round(adaptive["settled_concurrency"])
+    step_result = {
+        **summarize_step(tabulate_step(all_results, step, run_table), len(all_results)),
+        "achieved_rps": adaptive["achieved_rps"],
+        "goodput_rps": adaptive["goodput_rps"],
+    }
+
+    print(f"Results for {adaptive['settled_concurrency']} requests in flight (settled):")
+    print(
+        f"  Sustainable Throughput: {adaptive['goodput_rps']:.2f} successful requests/s "
+        f"(concurrency between {adaptive['min_concurrency']} and {adaptive['max_concurrency']})"
+    )
+    print(f"  Average Latency: {step_result['avg_latency']:.2f} seconds")
+    print(f"  Error Rate: {step_result['total_error_rate']:.2%}")
+    return {step: step_result}, load_tester.histogram, {"adaptive": adaptive}
+
+
+async def run_rps_sweep(
+    args: argparse.Namespace,
+    cached_prompts: List[Dict],
+    load_tester,
+    run_table: ResultTable = None,
+) -> Tuple[Dict[str, Any], LatencyHistogram, Dict[str, Any]]:
+    results = {}
+    overall_histogram = LatencyHistogram()
+    rate = args.rps_step
+
+    while rate <= args.max_rps:
+        load_tester.reset_histograms()
+        if load_tester.live:
+            load_tester.live.step = rate
+        all_results = await load_tester.run_open_loop(
+            prompts=cached_prompts,
+            rate=rate,
+            duration=args.step_duration,
+            profile=args.arrival,
+            start_rate=rate - args.rps_step,
+            warmup=args.warmup,
+        )
+
+        results[rate] = {
+            **load_tester.throughput,
+            **summarize_step(
+                tabulate_step(all_results, rate, run_table), len(all_results)
+            ),
+        }
+
+        overall_histogram.merge(load_tester.histogram)
+
+        print(f"Results for {rate} requests/s:")
+        print(f"  Achieved Throughput: {results[rate]['achieved_rps']:.2f} requests/s")
+        print(f"  Average Latency: {results[rate]['avg_latency']:.2f} seconds")
+        print(f"  Error Rate: {results[rate]['total_error_rate']:.2%}")
 
-    return results
+        previous, rate = rate, round(rate + args.rps_step, 6)
+        if rate <= args.max_rps:
+            results[previous]["cooldown_seconds"] = await cooldown(args, cached_prompts)
+
+    return results, overall_histogram, {}
 
 
 async def main():
@@ -234,7 +809,9 @@ async def main():
     try:
         # Read and cache prompts
         print("Reading and caching prompts...")
-        cached_prompts = read_prompts(args.prompts_folder, args.max_samples)
+        cached_prompts = load_prompts(
+            args.prompts_folder, args.max_samples, args.include_hidden
+        )
         print(f"Cached {len(cached_prompts)} prompts")
 
         if not cached_prompts:
@@ -249,9 +826,41 @@ async def main():
         res_dict["step_size"] = args.step_size
         res_dict["queue_size"] = args.queue_size
         res_dict["think_time"] = args.think_time
-
-        results = await run_dynamic_load_test(args, cached_prompts)
+        res_dict["persistent"] = args.persistent
+        res_dict["mode"] = args.mode
+        res_dict["workers"] = args.workers
+        res_dict["stream"] = args.stream
+        res_dict["expected_interval"] = (
+            args.think_time if args.expected_interval is None else args.expected_interval
+        )
+        res_dict["warmup"] = args.warmup
+        res_dict["steady_duration"] = args.steady_duration
+        res_dict["cooldown"] = args.cooldown
+        res_dict["adaptive_cooldown"] = args.adaptive_cooldown
+        if args.mode == "conversations":
+            res_dict["turns"] = args.turns
+            res_dict["think_dist"] = args.think_dist
+            res_dict["conversations"] = args.conversations
+            res_dict["conversations_per_user"] = args.conversations_per_user
+        if args.mode == "rps":
+            res_dict["max_rps"] = args.max_rps
+            res_dict["rps_step"] = args.rps_step
+            res_dict["step_duration"] = args.step_duration
+            res_dict["arrival"] = args.arrival
+        if args.mode == "adaptive":
+            res_dict["step_duration"] = args.step_duration
+            res_dict["aimd_increase"] = args.aimd_increase
+            res_dict["aimd_decrease"] = args.aimd_decrease
+
+        run_table = ResultTable() if args.parquet else None
+        results, overall_histogram, extras = await run_dynamic_load_test(
+            args, cached_prompts, run_table
+        )
         res_dict["results"] = results
+        res_dict.update(extras)
+        res_dict["overall_latency"] = {
+            key: round(value, 2) for key, value in overall_histogram.summary().items()
+        }
         # Generate result file name with date
         now = datetime.datetime.now()
         date_str = now.strftime("%Y-%m-%d_%H-%M-%S")
@@ -264,11 +873,39 @@ async def main():
         with open(result_file, "w") as f:
             json.dump(res_dict, f, indent=2)
 
+        if run_table is not None:
+            parquet_file = os.path.join(
+                args.output_folder, f"dynamic_load_test_results_{date_str}.parquet"
+            )
+            run_table.to_parquet(parquet_file)
+            print(f"Results table exported to {parquet_file}")
+
+        if args.history:
+            # Peak throughput over the steps, compared between runs by run_history.py
+            throughputs = [
+                step["achieved_rps"]
+                for step in results.values()
+                if step.get("achieved_rps") is not None
+            ]
+            params = {
+                key: value
+                for key, value in res_dict.items()
+                if key not in ("results", "overall_latency", "capacity", "adaptive")
+            }
+            history = RunHistory(args.history)
+            run_id = history.ingest(
+                "dynamic_load_test",
+                args.ws,
+                params,
+                res_dict,
+                overall_histogram,
+                throughput=max(throughputs) if throughputs else None,
+            )
+            history.close()
+            print(f"Run recorded as #{run_id} in {args.history}")
+
         # Plot and save results
-        plot_output = os.path.join(
-            args.output_folder, f"dynamic_load_test_plot_{date_str}.png"
-        )
-        plot_results(res_dict, plot_output)
+        plot_results(res_dict, args.output_folder, date_str, args.html_report)
 
         print(f"Results saved to {result_file}")
 
@@ -0,0 +1,425 @@
+﻿import argparse
+import datetime
+import json
+import math
+import os
+import sqlite3
+import subprocess
+import sys
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from histogram import LatencyHistogram
+
+# Kept out of the output folder, whose files are deleted by the shell scripts after a run
+DEFAULT_HISTORY = "run_history.db"
+# Below this many requests beyond the p95 in a run, its bootstrap interval is not trustworthy
+MIN_TAIL_SAMPLES = 10
+
+
+def git_sha() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class RunHistory:
+    """
+    Local SQLite store of run summaries, tagged with the endpoint, the git SHA and the parameters.
+    The latency histogram of every run is kept, so two runs can be compared statistically and
+    not only on their summary figures.
+    Attributes:
+        path (str): The path of the SQLite database.
+    """
+
+    def __init__(self, path: str = DEFAULT_HISTORY):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(path)
+        self._connection.row_factory = sqlite3.Row
+        self._connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS runs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                recorded_at TEXT NOT NULL,
+                git_sha TEXT,
+                endpoint TEXT,
+                params TEXT NOT NULL,
+                summary TEXT NOT NULL,
+                histogram TEXT NOT NULL,
+                p95_latency REAL,
+                throughput REAL,
+                accuracy_successes INTEGER,
+                accuracy_total INTEGER
+            );
+            CREATE TABLE IF NOT EXISTS baselines (
+                name TEXT PRIMARY KEY,
+                run_id INTEGER NOT NULL REFERENCES runs(id)
+            );
+            """
+        )
+
+    def ingest(
+        self,
+        kind: str,
+        endpoint: str,
+        params: Dict[str, Any],
+        summary: Dict[str, Any],
+        histogram: LatencyHistogram,
+        throughput: float = None,
+        accuracy_scores: List[float] = None,
+    ) -> int:
+        """
+        Stores the summary of a run.
+
+        Args:
+            kind (str): The script that produced the run, e.g. "quality_test".
+            endpoint (str): The WebSocket URL that was tested.
+            params (Dict[str, Any]): The parameters of the run.
+            summary (Dict[str, Any]): The summary written by the script.
+            histogram (LatencyHistogram): The latency histogram of the whole run.
+            throughput (float, optional): The throughput of the run, in requests per second.
+            accuracy_scores (List[float], optional): The classification accuracy score of every request.
+
+        Returns:
+            int: The id of the stored run.
+        """
+        successes = total = None
+        if accuracy_scores:
+            successes, total = int(sum(score >= 1 for score in accuracy_scores)), len(
+                accuracy_scores
+            )
+        cursor = self._connection.execute(
+            "INSERT INTO runs (kind, recorded_at, git_sha, endpoint, params, summary, histogram,"
+            " p95_latency, throughput, accuracy_successes, accuracy_total)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                kind,
+                datetime.datetime.now().isoformat(timespec="seconds"),
+                git_sha(),
+                endpoint,
+                json.dumps(params, default=str),
+                json.dumps(summary, default=str),
+                json.dumps(histogram.to_dict()),
+                histogram.percentile(95) if histogram.count else None,
+                throughput,
+                successes,
+                total,
+            ),
+        )
+        self._connection.commit()
+        return cursor.lastrowid
+
+    def tag(self, run_id: int, name: str):
+        self.get(str(run_id))
+        self._connection.execute(
+            "INSERT OR REPLACE INTO baselines VALUES (?, ?)", (name, run_id)
+        )
+        self._connection.commit()
+
+    def get(self, reference: str, kind: str = None) -> sqlite3.Row:
+        """
+        Returns a run from its id, a baseline name, "latest" or "previous" (the run before the latest).
+        With `kind`, "latest" and "previous" are resolved among the runs of that kind only.
+        """
+        if reference in ("latest", "previous"):
+            row = self._connection.execute(
+                "SELECT * FROM runs WHERE ? IS NULL OR kind = ? ORDER BY id DESC LIMIT 1 OFFSET ?",
+                (kind, kind, 0 if reference == "latest" else 1),
+            ).fetchone()
+        elif reference.isdigit():
+            row = self._connection.execute(
+                "SELECT * FROM runs WHERE id = ?", (int(reference),)
+            ).fetchone()
+        else:
+            row = self._connection.execute(
+                "SELECT runs.* FROM runs JOIN baselines ON runs.id = baselines.run_id"
+                " WHERE baselines.name = ?",
+                (reference,),
+            ).fetchone()
+        if row is None:
+            raise KeyError(f"Unknown run: {reference}" + (f" ({kind})" if kind else ""))
+        return row
+
+    def runs(self, limit: int = 20, kind: str = None) -> List[sqlite3.Row]:
+        return self._connection.execute(
+            "SELECT * FROM runs WHERE ? IS NULL OR kind = ? ORDER BY id DESC LIMIT ?",
+            (kind, kind, limit),
+        ).fetchall()
+
+    def close(self):
+        self._connection.close()
+
+
+def _buckets(histogram: LatencyHistogram) -> Tuple[np.ndarray, np.ndarray]:
+    indices = sorted(histogram.counts)
+    values = np.array([histogram._bucket_value(index) for index in indices])
+    counts = np.array([histogram.counts[index] for index in indices], dtype=float)
+    return values, counts
+
+
+def mann_whitney(baseline: LatencyHistogram, candidate: LatencyHistogram) -> Tuple[float, float]:
+    """
+    Two-sided Mann-Whitney U test computed on the histogram buckets, values of a bucket being ties.
+
+    Returns:
+        Tuple[float, float]: The probability that a candidate latency exceeds a baseline latency
+        (0.5 when the distributions are the same), and the p-value of the normal approximation.
+    """
+    base_values, base_counts = _buckets(baseline)
+    cand_values, cand_counts = _buckets(candidate)
+    values = np.union1d(base_values, cand_values)
+    a = np.zeros(len(values))
+    b = np.zeros(len(values))
+    a[np.searchsorted(values, base_values)] = base_counts
+    b[np.searchsorted(values, cand_values)] = cand_counts
+    n_a, n_b = a.sum(), b.sum()
+    n = n_a + n_b
+    if n_a == 0 or n_b == 0:
+        return 0.5, 1.0
+    ties = a + b
+    ranks = np.cumsum(ties) - ties + (ties + 1) / 2
+    u_b = (b * ranks).sum() - n_b * (n_b + 1) / 2
+    mean = n_a * n_b / 2
+    variance = n_a * n_b / 12 * ((n + 1) - (ties**3 - ties).sum() / (n * (n - 1)))
+    if variance <= 0:
+        return u_b / (n_a * n_b), 1.0
+    z = (u_b - mean) / math.sqrt(variance)
+    return u_b / (n_a * n_b), math.erfc(abs(z) / math.sqrt(2))
+
+
+def bootstrap_percentile_difference(
+    baseline: LatencyHistogram,
+    candidate: LatencyHistogram,
+    percentile: float = 95,
+    iterations: int = 2000,
+    confidence: float = 0.95,
+    seed: int = 0,
+) -> Tuple[float, float]:
+    """
+    Bootstrap confidence interval of the difference (candidate - baseline) of a latency percentile,
+    resampling each run from its histogram.
+    """
+    rng = np.random.default_rng(seed)
+
+    def resampled(histogram: LatencyHistogram) -> np.ndarray:
+        values, counts = _buckets(histogram)
+        samples = rng.multinomial(int(counts.sum()), counts / counts.sum(), size=iterations)
+        cumulative = np.cumsum(samples, axis=1)
+        ranks = np.ceil(counts.sum() * percentile / 100)
+        return values[np.argmax(cumulative >= ranks, axis=1)]
+
+    differences = resampled(candidate) - resampled(baseline)
+    tail = (1 - confidence) / 2 * 100
+    low, high = np.percentile(differences, [tail, 100 - tail])
+    return float(low), float(high)
+
+
+def two_proportion_p_value(
+    successes_a: int, total_a: int, successes_b: int, total_b: int
+) -> float:
+    """
+    One-sided p-value that the second proportion is lower than the first (two-proportion z-test).
+    """
+    pooled = (successes_a + successes_b) / (total_a + total_b)
+    variance = pooled * (1 - pooled) * (1 / total_a + 1 / total_b)
+    if variance <= 0:
+        return 1.0
+    z = (successes_b / total_b - successes_a / total_a) / math.sqrt(variance)
+    return 0.5 * math.erfc(-z / math.sqrt(2))
+
+
+def compare_runs(
+    baseline: sqlite3.Row, candidate: sqlite3.Row, alpha: float = 0.05, tolerance: float = 0.05
+) -> List[Dict[str, Any]]:
+    """
+    Compares a candidate run with a baseline run. A change is a regression when it is both
+    statistically significant at `alpha` and larger than `tolerance` (relative for latency and
+    throughput, absolute for accuracy). Throughput is a single figure per run and is only
+    compared against the tolerance. The p95 is only tested when each run has at least
+    MIN_TAIL_SAMPLES requests beyond it.
+
+    Returns:
+        List[Dict[str, Any]]: One check per compared figure, with its verdict.
+
+    Raises:
+        ValueError: If the runs are of different kinds or target different endpoints.
+    """
+    # Runs of different scripts or endpoints measure different things
+    for column in ("kind", "endpoint"):
+        if baseline[column] != candidate[column]:
+            raise ValueError(
+                f"Cannot compare runs #{baseline['id']} and #{candidate['id']}: "
+                f"different {column} ({baseline[column]} and {candidate[column]})"
+            )
+    checks = []
+    base_histogram = LatencyHistogram.from_dict(json.loads(baseline["histogram"]))
+    cand_histogram = LatencyHistogram.from_dict(json.loads(candidate["histogram"]))
+
+    if base_histogram.count and cand_histogram.count:
+        base_p95 = base_histogram.percentile(95)
+        cand_p95 = cand_histogram.percentile(95)
+        low, high = bootstrap_percentile_difference(base_histogram, cand_histogram)
+        change = (cand_p95 - base_p95) / base_p95 if base_p95 else 0.0
+        enough = min(base_histogram.count, cand_histogram.count) * 0.05 >= MIN_TAIL_SAMPLES
+        check = {
+            "check": "p95_latency",
+            "test": "bootstrap",
+            "baseline": round(base_p95, 3),
+            "candidate": round(cand_p95, 3),
+            "change": round(change, 3),
+            "ci_95": [round(low, 3), round(high, 3)],
+            "regression": enough and low > 0 and change > tolerance,
+        }
+        if not enough:
+            check["note"] = "too few requests for a p95 test"
+        checks.append(check)
+
+        probability, p_value = mann_whitney(base_histogram, cand_histogram)
+        base_median = base_histogram.percentile(50)
+        median_change = (
+            (cand_histogram.percentile(50) - base_median) / base_median if base_median else 0.0
+        )
+        checks.append(
+            {
+                "check": "latency_distribution",
+                "test": "mann-whitney",
+                "p_slower": round(probability, 3),
+                "p_value": round(p_value, 4),
+                "median_change": round(median_change, 3),
+                "regression": p_value < alpha and probability > 0.5 and median_change > tolerance,
+            }
+        )
+
+    if baseline["throughput"] and candidate["throughput"] is not None:
+        change = (candidate["throughput"] - baseline["throughput"]) / baseline["throughput"]
+        checks.append(
+            {
+                "check": "throughput",
+                "test": "tolerance",
+                "baseline": round(baseline["throughput"], 2),
+                "candidate": round(candidate["throughput"], 2),
+                "change": round(change, 3),
+                "regression": change < -tolerance,
+            }
+        )
+
+    if baseline["accuracy_total"] and candidate["accuracy_total"]:
+        base_accuracy = baseline["accuracy_successes"] / baseline["accuracy_total"]
+        cand_accuracy = candidate["accuracy_successes"] / candidate["accuracy_total"]
+        p_value = two_proportion_p_value(
+            baseline["accuracy_successes"],
+            baseline["accuracy_total"],
+            candidate["accuracy_successes"],
+            candidate["accuracy_total"],
+        )
+        checks.append(
+            {
+                "check": "classification_accuracy",
+                "test": "two-proportion z",
+                "baseline": round(base_accuracy, 3),
+                "candidate": round(cand_accuracy, 3),
+                "p_value": round(p_value, 4),
+                "regression": p_value < alpha and base_accuracy - cand_accuracy > tolerance,
+            }
+        )
+    return checks
+
+
+def describe(row: sqlite3.Row) -> str:
+    sha = (row["git_sha"] or "unknown")[:10]
+    p95 = f"{row['p95_latency']:.2f}s" if row["p95_latency"] is not None else "-"
+    throughput = f"{row['throughput']:.2f}/s" if row["throughput"] is not None else "-"
+    return (
+        f"#{row['id']} {row['recorded_at']} {row['kind']} {sha} {row['endpoint']} "
+        f"p95={p95} throughput={throughput}"
+    )
+
+
+def parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run history and regression detection")
+    parser.add_argument("--db", default=DEFAULT_HISTORY, help="Path of the run-history database")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    list_parser = commands.add_parser("list", help="List the latest runs")
+    list_parser.add_argument("--limit", type=int, default=20)
+    list_parser.add_argument(
+        "--kind", help="Only list runs of this kind (quality_test or dynamic_load_test)"
+    )
+
+    tag_parser = commands.add_parser("tag", help="Name a run as a baseline")
+    tag_parser.add_argument("run", help="Run id, or latest")
+    tag_parser.add_argument("name", help="Baseline name")
+    tag_parser.add_argument("--kind", help="Resolve latest among the runs of this kind")
+
+    compare_parser = commands.add_parser(
+        "compare", help="Compare two runs and exit with status 1 on regression"
+    )
+    compare_parser.add_argument("baseline", help="Run id, baseline name, latest or previous")
+    compare_parser.add_argument(
+        "candidate", nargs="?", default="latest", help="Run id, baseline name or latest"
+    )
+    compare_parser.add_argument(
+        "--kind",
+        help="Resolve latest and previous among the runs of this kind "
+        "(defaults to the kind of the candidate)",
+    )
+    compare_parser.add_argument(
+        "--alpha", type=float, default=0.05, help="Significance level of the tests"
+    )
+    compare_parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.05,
+        help="Smallest change counted as a regression (relative, absolute for accuracy)",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    history = RunHistory(args.db)
+    try:
+        if args.command == "list":
+            for row in history.runs(args.limit, args.kind):
+                print(describe(row))
+        elif args.command == "tag":
+            run_id = history.get(args.run, args.kind)["id"]
+            history.tag(run_id, args.name)
+            print(f"Run #{run_id} tagged as {args.name}")
+        elif args.command == "compare":
+            candidate = history.get(args.candidate, args.kind)
+            baseline = history.get(args.baseline, args.kind or candidate["kind"])
+            print(f"Baseline:  {describe(baseline)}")
+            print(f"Candidate: {describe(candidate)}")
+            checks = compare_runs(baseline, candidate, args.alpha, args.tolerance)
+            for check in checks:
+                verdict = "REGRESSION" if check["regression"] else "ok"
+                details = ", ".join(
+                    f"{key}={value}"
+                    for key, value in check.items()
+                    if key not in ("check", "regression")
+                )
+                print(f"  {check['check']}: {verdict} ({details})")
+            if any(check["regression"] for check in checks):
+                sys.exit(1)
+    except (KeyError, ValueError) as e:
+        print(f"Error: {e.args[0]}")
+        sys.exit(2)
+    finally:
+        history.close()
+
+
+if __name__ == "__main__":
+    main()
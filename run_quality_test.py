@@ -1,18 +1,21 @@
 ﻿import asyncio
-from collections import Counter
 import hashlib
 import json
-import random
+import numpy as np
 import time
 import argparse
 from urllib.parse import urlparse
-import statistics
 import os
 import datetime
-from typing import List, Tuple, Dict, Any
+from typing import List, Tuple, Dict, Any, Iterable
 import zipfile
 from analytics import Analytics
-from core import Metric, WebSocketTester
+from core import Metric, WebSocketTester, evaluate_metrics
+from dataset_loader import load_prompts
+from response_store import ResponseStore
+from run_history import DEFAULT_HISTORY, RunHistory
+from results_sink import ResultSink, iter_results
+from results_table import ResultTable
 import traceback
 import logging
 import glob
@@ -30,6 +33,11 @@ def parse_arguments() -> argparse.Namespace:
         help="Maximum number of samples to use",
         dest="max_samples",
     )
+    parser.add_argument(
+        "--include-hidden",
+        action="store_true",
+        help="Also load the prompts of dataset sub-folders such as datasets/hidden",
+    )
     parser.add_argument(
         "--ws", help="WebSocket URL of the AWS API Gateway", dest="websocket_url"
     )
@@ -49,80 +57,104 @@ def parse_arguments() -> argparse.Namespace:
         help="Number of concurrent connections",
         dest="connections",
     )
+    parser.add_argument(
+        "--persistent",
+        action="store_true",
+        help="Reuse one WebSocket connection per virtual user instead of one per prompt",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Read streamed multi-frame responses and report time-to-first-frame and inter-frame latency",
+    )
+    parser.add_argument(
+        "--sink",
+        choices=["memory", "jsonl", "jsonl.gz"],
+        default="memory",
+        help="Keep results in memory, or stream them to an append-only (optionally compressed) JSONL file",
+    )
+    parser.add_argument(
+        "--parquet",
+        action="store_true",
+        help="Export the columnar results table to Parquet (requires pyarrow)",
+    )
+    parser.add_argument(
+        "--html-report",
+        action="store_true",
+        help="Write one self-contained HTML report instead of separate PNG charts",
+    )
+    parser.add_argument(
+        "--history",
+        default=DEFAULT_HISTORY,
+        help="SQLite run-history database the summary is recorded in (empty to disable)",
+    )
+    store_group = parser.add_mutually_exclusive_group()
+    store_group.add_argument(
+        "--record",
+        metavar="DB",
+        help="Record the raw responses in this SQLite store, for later replay",
+    )
+    store_group.add_argument(
+        "--replay",
+        metavar="DB",
+        help="Serve the responses recorded in this SQLite store instead of calling the endpoint",
+    )
     args = parser.parse_args()
 
-    if args.origin is None:
+    if args.replay is None and args.websocket_url is None:
+        parser.error("--ws is required unless --replay is given")
+    if args.origin is None and args.websocket_url is not None:
         parsed_url = urlparse(args.websocket_url)
         args.origin = f"{parsed_url.scheme}://{parsed_url.netloc}"
 
     return args
 
 
-def read_prompts(folder_path: str, max_samples: int = -1) -> list[dict]:
-    prompts = []
-    for filename in os.listdir(folder_path):
-        if filename.endswith(".jsonl"):
-            file_path = os.path.join(folder_path, filename)
-            with open(file_path, "r", encoding="utf8") as file:
-                lines = file.readlines()
-                if max_samples == -1:
-                    sampled_lines = lines
-                else:
-                    num_samples = min(max_samples, len(lines))
-                    sampled_lines = random.sample(lines, num_samples)
-                for line in sampled_lines:
-                    try:
-                        prompt = json.loads(line)
-                        prompts.append(prompt)
-                    except (json.JSONDecodeError, KeyError):
-                        print(f"Warning: Skipping invalid line in {filename}")
-    return prompts
-
-
-def calculate_statistics(results: List[Tuple[str, dict, float]]) -> Dict[str, Any]:
-    intent_latencies = {}
-    intent_count = Counter(
-        [
-            response.get("intent", "")
-            for _, response, _ in results
-            if isinstance(response, dict)
-        ]
+def calculate_statistics(results: Iterable[Tuple[str, dict, float]]) -> Dict[str, Any]:
+    table = (
+        results if isinstance(results, ResultTable) else ResultTable.from_results(results)
     )
+    outcomes = table.outcome_counts("intent")
 
-    for intent in intent_count.keys():
-        intent_results = [
-            (prompt, response, latency)
-            for prompt, response, latency in results
-            if isinstance(response, dict) and response.get("intent") == intent
-        ]
-        latencies = [latency for _, _, latency in intent_results if latency > 0]
-        intent_latencies[intent] = {
-            "average": statistics.mean(latencies) if latencies else 0,
-            "median": statistics.median(latencies) if latencies else 0,
-            "min": min(latencies) if latencies else 0,
-            "max": max(latencies) if latencies else 0,
-            "p95": (
-                statistics.quantiles(latencies, n=20)[18]
-                if len(latencies) >= 20
-                else max(latencies) if latencies else 0
-            ),
-            "p99": (
-                statistics.quantiles(latencies, n=100)[98]
-                if len(latencies) >= 100
-                else max(latencies) if latencies else 0
+    streaming = {}
+    if table.streamed:
+        histograms = {
+            "time_to_first_frame": table.latency_histograms(
+                "intent", "time_to_first_frame"
             ),
+            "inter_frame": table.inter_frame_histograms("intent"),
+            "total_time": table.latency_histograms("intent", "stream_total_time"),
+            "bytes": table.latency_histograms("intent", "bytes"),
+        }
+        streaming = {
+            intent: {field: values[intent].summary() for field, values in histograms.items()}
+            for intent in outcomes
+            if histograms["total_time"][intent].count
         }
 
     return {
-        "total_requests": len(results),
-        "per_intent": {intent: count for intent, count in intent_count.items()},
+        "total_requests": len(table),
+        "per_intent": {
+            intent: sum(counts.values()) - counts["unexpected"]
+            for intent, counts in outcomes.items()
+            if sum(counts.values()) > counts["unexpected"]
+        },
         "successful_requests": sum(
-            1
-            for _, response, _ in results
-            if isinstance(response, dict)
-            and not response.get("message", "").startswith("Une erreur")
+            sum(counts.values())
+            - counts["server_error"]
+            - counts["client_failure"]
+            - counts["unexpected"]
+            for counts in outcomes.values()
         ),
-        "latency": intent_latencies,
+        # Failed and timed-out requests are in the latency figures with their elapsed time
+        "censored": table.censored_counts("intent"),
+        "latency": {
+            intent: histogram.summary()
+            for intent, histogram in table.latency_histograms("intent").items()
+        },
+        "outcomes": outcomes,
+        "streaming": streaming,
+        "phases": table.phase_summaries("intent"),
     }
 
 
@@ -167,6 +199,8 @@ def write_summary(
         "total_time": round(total_time, 2),
         "requests_per_second": round(stats["total_requests"] / total_time, 2),
         "per_intent": stats["per_intent"],
+        "outcomes": stats["outcomes"],
+        "censored": stats["censored"],
         "latency": {},
         "metrics": {},
     }
@@ -174,14 +208,28 @@ def write_summary(
     # Add latency statistics for each intent
     for intent, latency_stats in stats["latency"].items():
         summary["latency"][intent] = {
-            "average": round(latency_stats["average"], 2),
-            "median": round(latency_stats["median"], 2),
-            "min": round(latency_stats["min"], 2),
-            "max": round(latency_stats["max"], 2),
-            "p95": round(latency_stats["p95"], 2),
-            "p99": round(latency_stats["p99"], 2),
+            key: round(value, 2) for key, value in latency_stats.items()
+        }
+
+    if "corrected_latency" in stats:
+        summary["corrected_latency"] = {
+            key: round(value, 2) for key, value in stats["corrected_latency"].items()
+        }
+
+    # Add streaming statistics for each intent
+    if stats.get("streaming"):
+        summary["streaming"] = {
+            intent: {
+                name: {key: round(value, 3) for key, value in values.items()}
+                for name, values in streaming_stats.items()
+            }
+            for intent, streaming_stats in stats["streaming"].items()
         }
 
+    # Add per-phase timings for each intent, already rounded in milliseconds
+    if stats.get("phases"):
+        summary["phases"] = stats["phases"]
+
     # Add metrics
     for metric in metrics:
         metric_name, metric_average, metric_scores, failed_responses = (
@@ -239,11 +287,26 @@ def get_metrics() -> List[Metric]:
         except KeyError:
             return 0.0
 
+    # Batch versions of the metrics above, evaluated with NumPy over the result columns
+    def classification_accuracy_batch(inputs: List[dict], outputs: List[dict]):
+        expected = np.array([input.get("Intent") for input in inputs], dtype=object)
+        inferred = np.array([output.get("intent") for output in outputs], dtype=object)
+        return ((expected == inferred) & (expected != None)).astype(float)
+
+    def length_check_batch(inputs: List[dict], outputs: List[dict]):
+        lengths = np.fromiter(
+            (len(output.get("message", "")) for output in outputs),
+            dtype=int,
+            count=len(outputs),
+        )
+        return (lengths <= 1000).astype(float)
+
     return [
         Metric(
             "classification_accuracy",
             classification_accuracy,
             failure_condition=lambda _, __, score: score == 0.0,
+            vectorized=classification_accuracy_batch,
         ),
         # Metric(
         #     "ref_recall_count",
@@ -254,6 +317,7 @@ def get_metrics() -> List[Metric]:
             "length_check",
             length_check,
             failure_condition=lambda _, __, score: score == 0.0,
+            vectorized=length_check_batch,
         ),
     ]
 
@@ -261,36 +325,115 @@ def get_metrics() -> List[Metric]:
 async def main():
     try:
         args = parse_arguments()
-        prompts = read_prompts("./datasets", max_samples=args.max_samples)
+        prompts = load_prompts(
+            "./datasets",
+            max_samples=args.max_samples,
+            include_hidden=args.include_hidden,
+        )
 
-        tester = WebSocketTester(args.websocket_url, args.origin, get_metrics())
+        script_name = "quality_test"
+        suffix = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        output_filename, output_summary = generate_output_filenames(
+            args.output_folder, script_name, suffix
+        )
+
+        sink = None
+        if args.sink != "memory":
+            # Results are appended to a JSONL file as they complete instead of being kept in memory
+            output_filename = output_filename.replace(".json", f".{args.sink}")
+            sink = ResultSink(output_filename)
+
+        store_path = args.replay or args.record
+        store = ResponseStore(store_path) if store_path else None
+        if args.replay:
+            print(f"Replaying {len(store)} recorded responses from {args.replay}")
+
+        tester = WebSocketTester(
+            args.websocket_url,
+            args.origin,
+            get_metrics(),
+            persistent=args.persistent,
+            stream=args.stream,
+            sink=sink,
+            store=store,
+            replay=args.replay is not None,
+        )
 
         print(
             f"Starting quality test with {len(prompts)} prompts and up to {args.connections} concurrent connections"
         )
         start_time = time.time()
-        results = await tester.run(
-            prompts=prompts,
-            connections=args.connections,
-            queue_size=-1,
-            think_time=0.5,
-        )
+        try:
+            results = await tester.run(
+                prompts=prompts,
+                connections=args.connections,
+                queue_size=-1,
+                # Replayed responses are served locally, there is no endpoint to spare
+                think_time=0 if args.replay else 0.5,
+            )
+        finally:
+            if sink:
+                sink.close()
+            if store:
+                store.close()
         end_time = time.time()
 
         total_time = end_time - start_time
-        stats = calculate_statistics(results)
-
-        script_name = "quality_test"
-        suffix = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-        output_filename, output_summary = generate_output_filenames(
-            args.output_folder, script_name, suffix
-        )
+        if sink:
+            table = ResultTable.from_results(iter_results(output_filename))
+            evaluate_metrics(tester.metrics, iter_results(output_filename))
+            print(f"{sink.count} results streamed to {output_filename}")
+        else:
+            table = ResultTable.from_results(results)
+            evaluate_metrics(tester.metrics, results)
+            write_results(output_filename, results)
+        stats = calculate_statistics(table)
+        # Percentiles corrected for the requests the virtual users could not send while stalled
+        stats["corrected_latency"] = tester.corrected_histogram.summary()
+
+        if args.parquet:
+            parquet_filename = os.path.join(
+                args.output_folder, f"{script_name}-{suffix}-results.parquet"
+            )
+            table.to_parquet(parquet_filename)
+            print(f"Results table exported to {parquet_filename}")
 
-        write_results(output_filename, results)
         summary = write_summary(output_summary, stats, total_time, tester.metrics)
+        if args.history and args.replay:
+            # A replay measures no server, it must not become the latest run to compare against
+            print("Replayed run not recorded in the run history")
+        elif args.history:
+            accuracy = next(
+                (m for m in tester.metrics if m.name == "classification_accuracy"), None
+            )
+            history = RunHistory(args.history)
+            run_id = history.ingest(
+                "quality_test",
+                args.websocket_url,
+                {
+                    "connections": args.connections,
+                    "max_samples": args.max_samples,
+                    "persistent": args.persistent,
+                    "stream": args.stream,
+                    "include_hidden": args.include_hidden,
+                },
+                summary,
+                tester.histogram,
+                throughput=summary["requests_per_second"],
+                accuracy_scores=accuracy.scores if accuracy else None,
+            )
+            history.close()
+            print(f"Run recorded as #{run_id} in {args.history}")
         analytics = Analytics(args.output_folder, args.output_folder, suffix=suffix)
-        analytics.plot_failed_responses_summary(summary)
-        analytics.plot_intent_distribution(stats)
+        # With a sink, the summary and statistics were aggregated from the streamed file
+        charts = [("failed_responses_summary", summary), ("intent_distribution", stats)]
+        if args.html_report:
+            report = analytics.write_html_report(
+                "Quality test", charts, {"Summary": summary}
+            )
+            print(f"HTML report written to {report}")
+        else:
+            analytics.render(charts)
 
         files = glob.glob(f"{args.output_folder}/*{suffix}*")
 
@@ -0,0 +1,145 @@
+﻿import asyncio
+import argparse
+import datetime
+import json
+import logging
+import os
+from typing import Dict, Any
+
+from core import WebSocketTester
+from results_table import summarize_step, tabulate_step
+from traces import group_sessions, read_trace
+
+
+def parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Replays a production request trace against a WebSocket chatbot"
+    )
+    parser.add_argument("--ws", help="WebSocket URL", required=True)
+    parser.add_argument(
+        "--origin", help="Origin for WebSocket connection", required=True
+    )
+    parser.add_argument(
+        "--trace",
+        required=True,
+        help="JSONL request log with one timestamp, session and question per line",
+    )
+    parser.add_argument(
+        "--speedup",
+        type=float,
+        nargs="+",
+        default=[1.0],
+        help="Replay speed-up factors, each replayed as one step (e.g. 2 5 10)",
+    )
+    parser.add_argument(
+        "--max-concurrency",
+        type=int,
+        default=0,
+        help="Maximum number of requests in flight (0 for no limit)",
+    )
+    parser.add_argument(
+        "--persistent",
+        action="store_true",
+        help="Keep one WebSocket connection per trace session instead of one per message",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Read streamed multi-frame responses and report time-to-first-frame",
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=120, help="Timeout of each request (seconds)"
+    )
+    parser.add_argument(
+        "--warmup",
+        type=float,
+        default=0,
+        help="Seconds at the start of each replay whose requests are excluded from the statistics",
+    )
+    parser.add_argument(
+        "--cooldown",
+        type=float,
+        default=60,
+        help="Seconds waited between two speed-up factors",
+    )
+    parser.add_argument(
+        "--output-folder",
+        default="./output",
+        help="Folder to save the results file",
+    )
+    args = parser.parse_args()
+    if any(speedup <= 0 for speedup in args.speedup):
+        parser.error("argument --speedup: factors must be positive")
+    return args
+
+
+async def replay_trace(args: argparse.Namespace, trace) -> Dict[str, Any]:
+    tester = WebSocketTester(
+        args.ws, args.origin, persistent=args.persistent, stream=args.stream
+    )
+    steps = []
+    for index, speedup in enumerate(args.speedup):
+        tester.reset_histograms()
+        counters_before = tester.get_counters()
+        results = await tester.run_trace(
+            trace,
+            speedup=speedup,
+            max_concurrency=args.max_concurrency,
+            timeout=args.timeout,
+            warmup=args.warmup,
+        )
+        counters = tester.get_counters()
+        step_table = tabulate_step(results, speedup)
+        step_result = {
+            "speedup": speedup,
+            **summarize_step(step_table, len(results)),
+            **tester.throughput,
+            **{key: counters[key] - counters_before[key] for key in counters},
+        }
+        steps.append(step_result)
+
+        print(f"Results at {speedup}x:")
+        print(f"  Average Latency: {step_result['avg_latency']:.2f} seconds")
+        print(f"  P95 Latency: {step_result['p95_latency']:.2f} seconds")
+        print(f"  Error Rate: {step_result['total_error_rate']:.2%}")
+
+        if index < len(args.speedup) - 1:
+            await asyncio.sleep(args.cooldown)
+    return steps
+
+
+async def main():
+    args = parse_arguments()
+
+    trace = read_trace(args.trace)
+    if not trace:
+        raise ValueError("No valid requests found. Please check your trace file.")
+    sessions = len(group_sessions(trace))
+    print(f"Read {len(trace)} requests in {sessions} sessions from {args.trace}")
+
+    res_dict = {
+        "endpoint": args.ws,
+        "origin": args.origin,
+        "trace": args.trace,
+        "trace_requests": len(trace),
+        "trace_sessions": sessions,
+        "trace_duration": round(trace[-1]["offset"], 2),
+        "max_concurrency": args.max_concurrency,
+        "persistent": args.persistent,
+        "stream": args.stream,
+        "warmup": args.warmup,
+        "cooldown": args.cooldown,
+    }
+    res_dict["results"] = await replay_trace(args, trace)
+
+    date_str = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    os.makedirs(args.output_folder, exist_ok=True)
+    result_file = os.path.join(args.output_folder, f"trace_replay_results_{date_str}.json")
+    with open(result_file, "w") as f:
+        json.dump(res_dict, f, indent=2)
+    print(f"Results saved to {result_file}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.ERROR)
+    asyncio.run(main())
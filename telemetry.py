@@ -0,0 +1,251 @@
+﻿import asyncio
+import time
+from collections import Counter, deque
+from typing import Dict, Any, Callable, List, Tuple
+
+from tqdm import tqdm
+
+from core import OUTCOMES, classify_response
+from histogram import LatencyHistogram
+
+
+class LiveMetrics:
+    """
+    Rolling-window view of a running test, published once per interval on the console and
+    as Prometheus text on a local HTTP endpoint.
+    Attributes:
+        window (float): The length in seconds of the rolling window.
+        interval (float): The number of seconds between two console reports.
+        events (deque): The (timestamp, latency, outcome) of the requests completed within the window.
+        totals (Counter): The number of requests completed since the start, by outcome.
+        step: The label of the current step (connection count or target rate).
+    """
+
+    def __init__(self, window: float = 10.0, interval: float = 1.0):
+        self.window = window
+        self.interval = interval
+        self.events = deque()
+        self.totals = Counter()
+        self.step = None
+        self._started = time.monotonic()
+        self._tasks = []
+        self._server = None
+
+    def record(self, result: Tuple[Dict, dict, float]):
+        _, response, latency = result
+        outcome = classify_response(response)
+        self.events.append((time.monotonic(), latency, outcome))
+        self.totals[outcome] += 1
+
+    def _prune(self, now: float):
+        while self.events and self.events[0][0] < now - self.window:
+            self.events.popleft()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Returns the throughput, latency percentiles and outcome counts over the rolling window.
+        """
+        now = time.monotonic()
+        self._prune(now)
+        histogram = LatencyHistogram()
+        outcomes = Counter()
+        for _, latency, outcome in self.events:
+            outcomes[outcome] += 1
+            if latency > 0:
+                histogram.record(latency)
+        # Until a full window has elapsed, the rate is computed over the elapsed time
+        elapsed = min(self.window, max(now - self._started, self.interval))
+        return {
+            "step": self.step,
+            "throughput": len(self.events) / elapsed,
+            "p50": histogram.percentile(50),
+            "p95": histogram.percentile(95),
+            "p99": histogram.percentile(99),
+            "window": {outcome: outcomes[outcome] for outcome in OUTCOMES},
+            "totals": {outcome: self.totals[outcome] for outcome in OUTCOMES},
+        }
+
+    def format_line(self, snapshot: Dict[str, Any]) -> str:
+        window = snapshot["window"]
+        return (
+            f"[live] step={snapshot['step']} {snapshot['throughput']:.2f} req/s "
+            f"p50={snapshot['p50']:.2f}s p95={snapshot['p95']:.2f}s p99={snapshot['p99']:.2f}s "
+            f"throttled={window['throttled']} errors={window['server_error'] + window['client_failure'] + window['unexpected']} "
+            f"(last {self.window:.0f}s)"
+        )
+
+    def prometheus_text(self) -> str:
+        snapshot = self.snapshot()
+        lines = [
+            "# HELP loadtest_requests_total Requests completed since the start of the test.",
+            "# TYPE loadtest_requests_total counter",
+        ]
+        for outcome, count in snapshot["totals"].items():
+            lines.append(f'loadtest_requests_total{{outcome="{outcome}"}} {count}')
+        lines += [
+            "# HELP loadtest_window_requests Requests completed within the rolling window.",
+            "# TYPE loadtest_window_requests gauge",
+        ]
+        for outcome, count in snapshot["window"].items():
+            lines.append(f'loadtest_window_requests{{outcome="{outcome}"}} {count}')
+        lines += [
+            "# HELP loadtest_throughput_rps Requests completed per second over the rolling window.",
+            "# TYPE loadtest_throughput_rps gauge",
+            f"loadtest_throughput_rps {snapshot['throughput']}",
+            "# HELP loadtest_latency_seconds Latency percentiles over the rolling window.",
+            "# TYPE loadtest_latency_seconds gauge",
+        ]
+        for name, quantile in [("p50", "0.5"), ("p95", "0.95"), ("p99", "0.99")]:
+            lines.append(
+                f'loadtest_latency_seconds{{quantile="{quantile}"}} {snapshot[name]}'
+            )
+        if isinstance(snapshot["step"], (int, float)):
+            lines += [
+                "# HELP loadtest_step Connection count or target rate of the current step.",
+                "# TYPE loadtest_step gauge",
+                f"loadtest_step {snapshot['step']}",
+            ]
+        return "\n".join(lines) + "\n"
+
+    async def _report(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            # tqdm.write keeps the progress bar intact
+            tqdm.write(self.format_line(self.snapshot()))
+
+    async def _handle_scrape(self, reader, writer):
+        try:
+            # Read and ignore the request, every path returns the metrics
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            body = self.prometheus_text().encode()
+            writer.write(
+                b"HTTP/1.1 200 OK\r\n"
+                b"Content-Type: text/plain; version=0.0.4\r\n"
+                + f"Content-Length: {len(body)}\r\n".encode()
+                + b"Connection: close\r\n\r\n"
+                + body
+            )
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def start(self, port: int = None, host: str = "127.0.0.1"):
+        """
+        Starts the console reports and, if a port is given, the Prometheus scrape endpoint.
+        """
+        self._started = time.monotonic()
+        self._tasks.append(asyncio.create_task(self._report()))
+        if port:
+            self._server = await asyncio.start_server(self._handle_scrape, host, port)
+            print(f"Live metrics available at http://{host}:{port}/metrics")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+
+class TelemetryExporter:
+    """
+    Sends telemetry events (scores, trace links) from a background task, so that slow or
+    synchronous telemetry calls never block the event loop driving the WebSocket traffic.
+    Events are queued by submit(), and a worker drains the queue in groups of up to
+    `batch_size` events. Each group is handed to a thread in one hop, where the events are
+    still sent one by one with `send`; grouping saves thread hops, not requests. The queue
+    is bounded: when the telemetry backend falls behind, submit() waits for room instead of
+    letting memory grow without limit.
+    Attributes:
+        send (Callable[[Any], None]): The synchronous function sending one event.
+        batch_size (int): The maximum number of events handed to the thread in one hop.
+        max_queue (int): The maximum number of queued events before submit() waits.
+        exported (int): The number of events sent successfully.
+        failed (int): The number of events whose sending raised an exception.
+        batches (int): The number of batches sent.
+        max_depth (int): The largest queue depth seen.
+        blocked_time (float): The total time submit() waited for room in the queue, in seconds.
+    """
+
+    def __init__(
+        self,
+        send: Callable[[Any], None],
+        batch_size: int = 50,
+        max_queue: int = 1000,
+    ):
+        self.send = send
+        self.batch_size = batch_size
+        self.max_queue = max_queue
+        self.exported = 0
+        self.failed = 0
+        self.batches = 0
+        self.max_depth = 0
+        self.blocked_time = 0.0
+        self._queue: asyncio.Queue = None
+        self._worker: asyncio.Task = None
+
+    async def __aenter__(self) -> "TelemetryExporter":
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def start(self):
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._worker = asyncio.create_task(self._drain())
+
+    async def submit(self, event: Any):
+        if self._queue.full():
+            start_time = time.perf_counter()
+            await self._queue.put(event)
+            self.blocked_time += time.perf_counter() - start_time
+        else:
+            self._queue.put_nowait(event)
+        self.max_depth = max(self.max_depth, self._queue.qsize())
+
+    def _send_batch(self, batch: List[Any]) -> int:
+        failed = 0
+        for event in batch:
+            try:
+                self.send(event)
+            except Exception as e:
+                failed += 1
+                print(f"Error: telemetry export failed: {str(e)}")
+        return failed
+
+    async def _drain(self):
+        closing = False
+        while not closing:
+            batch = [await self._queue.get()]
+            # Events queued while the previous batch was being sent form the next batch
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            if batch[-1] is None:
+                closing = True
+                batch.pop()
+            if batch:
+                failed = await asyncio.to_thread(self._send_batch, batch)
+                self.failed += failed
+                self.exported += len(batch) - failed
+                self.batches += 1
+
+    async def close(self):
+        """
+        Sends every queued event, then stops the worker.
+        """
+        if self._worker is None:
+            return
+        await self._queue.put(None)
+        await self._worker
+        self._worker = None
+
+    def summary(self) -> str:
+        return (
+            f"{self.exported} telemetry events exported in {self.batches} batches, "
+            f"{self.failed} failed, max queue depth {self.max_depth}, "
+            f"{self.blocked_time:.2f}s waiting for the queue"
+        )
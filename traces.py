@@ -0,0 +1,69 @@
+﻿import datetime
+import json
+from typing import Dict, List, Optional, Union
+
+
+def parse_timestamp(value: Union[str, float, int]) -> float:
+    """
+    Converts a trace timestamp, either epoch seconds or an ISO-8601 string, to epoch seconds.
+    """
+    if isinstance(value, (int, float)):
+        return float(value)
+    timestamp = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=datetime.timezone.utc)
+    return timestamp.timestamp()
+
+
+def read_trace(path: str) -> List[Dict]:
+    """
+    Reads a production request log, one JSON object per line with a timestamp, a session and a question
+    (and optionally the expected intent).
+
+    Args:
+        path (str): The path of the JSONL trace.
+
+    Returns:
+        List[Dict]: The requests sorted by timestamp, each with its offset in seconds from the first
+        request, its session (None for a request logged without one) and the prompt to send.
+    """
+    requests = []
+    with open(path, "r", encoding="utf8") as file:
+        for line in file:
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+                session: Optional[str] = entry.get("session")
+                prompt = {"Question": entry["question"]}
+                if "intent" in entry:
+                    prompt["Intent"] = entry["intent"]
+                requests.append(
+                    {
+                        "timestamp": parse_timestamp(entry["timestamp"]),
+                        "session": str(session) if session not in (None, "") else None,
+                        "prompt": prompt,
+                    }
+                )
+            except (json.JSONDecodeError, KeyError, ValueError, AttributeError):
+                print(f"Warning: Skipping invalid line in {path}")
+
+    requests.sort(key=lambda request: request["timestamp"])
+    if requests:
+        first = requests[0]["timestamp"]
+        for request in requests:
+            request["offset"] = request.pop("timestamp") - first
+    return requests
+
+
+def group_sessions(requests: List[Dict]) -> Dict[Union[str, int], List[Dict]]:
+    """
+    Groups the requests of a trace by session, keeping their order within each session.
+    A request without a session is a session of its own, keyed by its index in the trace,
+    so a plain request log is replayed at its original arrival times rather than serially.
+    """
+    sessions: Dict[Union[str, int], List[Dict]] = {}
+    for index, request in enumerate(requests):
+        key = request["session"] if request["session"] is not None else index
+        sessions.setdefault(key, []).append(request)
+    return sessions
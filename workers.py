@@ -0,0 +1,250 @@
+﻿import asyncio
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Any, Tuple
+
+from core import WebSocketTester
+from histogram import LatencyHistogram
+
+# Per-process state, set once by the pool initializer so prompts are not pickled at every step.
+# A PromptDataset only pickles its cache path, so workers share the memory-mapped prompts.
+_worker_tester: WebSocketTester = None
+_worker_prompts: List[Dict] = []
+
+
+def _init_worker(websocket_url: str, origin: str, prompts: List[Dict], options: Dict):
+    global _worker_tester, _worker_prompts
+    _worker_tester = WebSocketTester(
+        websocket_url, origin, [], show_progress=False, **options
+    )
+    _worker_prompts = prompts
+
+
+def _wait_until(start_at: float):
+    delay = start_at - time.time()
+    if delay > 0:
+        time.sleep(delay)
+
+
+def _collect(counters_before: Dict[str, int]) -> Dict[str, Any]:
+    counters = _worker_tester.get_counters()
+    return {
+        "histogram": _worker_tester.histogram.to_dict(),
+        "corrected_histogram": _worker_tester.corrected_histogram.to_dict(),
+        "intent_histograms": {
+            intent: histogram.to_dict()
+            for intent, histogram in _worker_tester.intent_histograms.items()
+        },
+        "counters": {
+            name: count - counters_before[name] for name, count in counters.items()
+        },
+        "throughput": _worker_tester.throughput,
+    }
+
+
+def _run_shard(
+    connections: int,
+    queue_size: int,
+    think_time: float,
+    warmup: float,
+    duration: float,
+    expected_interval: float,
+    spawn_rate: float,
+    start_jitter: float,
+    start_at: float,
+) -> Tuple[List, Dict[str, Any]]:
+    _worker_tester.reset_histograms()
+    counters_before = _worker_tester.get_counters()
+    _wait_until(start_at)
+    results = asyncio.run(
+        _worker_tester.run(
+            _worker_prompts,
+            connections,
+            queue_size,
+            think_time,
+            warmup,
+            duration,
+            expected_interval,
+            spawn_rate,
+            start_jitter,
+        )
+    )
+    collected = _collect(counters_before)
+    collected["ramp_up"] = _worker_tester.ramp_up
+    return results, collected
+
+
+def _run_open_loop_shard(
+    rate: float,
+    duration: float,
+    profile: str,
+    start_rate: float,
+    warmup: float,
+    start_at: float,
+) -> Tuple[List, Dict[str, Any]]:
+    _worker_tester.reset_histograms()
+    counters_before = _worker_tester.get_counters()
+    _wait_until(start_at)
+    results = asyncio.run(
+        _worker_tester.run_open_loop(
+            _worker_prompts, rate, duration, profile, start_rate, warmup=warmup
+        )
+    )
+    return results, _collect(counters_before)
+
+
+class WorkerPool:
+    """
+    Shards the load of a step across several processes, each running its own WebSocketTester.
+    The pool exposes the same run, histogram and counter interface as WebSocketTester, so the
+    dynamic load test can use either. All shards wait for a common start time before sending,
+    and their results, histograms and counters are merged once every shard has completed.
+    Attributes:
+        workers (int): The number of worker processes.
+        start_delay (float): Seconds granted to every worker to be ready before a step starts.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        websocket_url: str,
+        origin: str,
+        prompts: List[Dict],
+        start_delay: float = 2.0,
+        **options,
+    ):
+        self.workers = workers
+        self.start_delay = start_delay
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(websocket_url, origin, prompts, options),
+        )
+        self.handshake_count = 0
+        self.message_count = 0
+        self.reconnect_count = 0
+        self.throughput: Dict[str, float] = {}
+        self.ramp_up = 0.0
+        # Requests complete in the worker processes, live metrics are not collected
+        self.live = None
+        self.reset_histograms()
+
+    def reset_histograms(self):
+        self.histogram = LatencyHistogram()
+        self.corrected_histogram = LatencyHistogram()
+        self.intent_histograms: Dict[str, LatencyHistogram] = {}
+
+    def get_counters(self) -> Dict[str, int]:
+        return {
+            "handshakes": self.handshake_count,
+            "messages": self.message_count,
+            "reconnects": self.reconnect_count,
+        }
+
+    def _shard(self, total: int) -> List[int]:
+        return [
+            total // self.workers + (1 if i < total % self.workers else 0)
+            for i in range(self.workers)
+        ]
+
+    def _merge(self, shard_outputs: List[Tuple[List, Dict[str, Any]]]) -> List:
+        results = []
+        # The step's ramp-up is that of the slowest shard
+        self.ramp_up = max(
+            (collected.get("ramp_up", 0.0) for _, collected in shard_outputs), default=0.0
+        )
+        for shard_results, collected in shard_outputs:
+            results.extend(shard_results)
+            self.histogram.merge(LatencyHistogram.from_dict(collected["histogram"]))
+            self.corrected_histogram.merge(
+                LatencyHistogram.from_dict(collected["corrected_histogram"])
+            )
+            for intent, data in collected["intent_histograms"].items():
+                if intent not in self.intent_histograms:
+                    self.intent_histograms[intent] = LatencyHistogram()
+                self.intent_histograms[intent].merge(LatencyHistogram.from_dict(data))
+            counters = collected["counters"]
+            self.handshake_count += counters["handshakes"]
+            self.message_count += counters["messages"]
+            self.reconnect_count += counters["reconnects"]
+        return results
+
+    async def _submit(self, function, jobs: List[Tuple]) -> List[Tuple[List, Dict]]:
+        start_at = time.time() + self.start_delay
+        futures = [
+            asyncio.wrap_future(self.executor.submit(function, *job, start_at))
+            for job in jobs
+        ]
+        return await asyncio.gather(*futures)
+
+    async def run(
+        self,
+        prompts: List[Dict],
+        connections: int = 1,
+        queue_size: int = 1,
+        think_time: float = 0,
+        warmup: float = 0,
+        duration: float = None,
+        expected_interval: float = None,
+        spawn_rate: float = None,
+        start_jitter: float = 0,
+    ):
+        # Prompts were sent to the workers once, at pool creation. Each shard spawns its
+        # share of the connections at its share of the rate, so they all ramp up together
+        jobs = [
+            (
+                shard,
+                queue_size,
+                think_time,
+                warmup,
+                duration,
+                expected_interval,
+                spawn_rate * shard / connections if spawn_rate else None,
+                start_jitter,
+            )
+            for shard in self._shard(connections)
+            if shard > 0
+        ]
+        print(
+            f"Starting tests with {connections} connections sharded across "
+            f"{len(jobs)} worker processes"
+        )
+        return self._merge(await self._submit(_run_shard, jobs))
+
+    async def run_open_loop(
+        self,
+        prompts: List[Dict],
+        rate: float,
+        duration: float,
+        profile: str = "constant",
+        start_rate: float = None,
+        warmup: float = 0,
+    ):
+        jobs = [
+            (
+                rate / self.workers,
+                duration,
+                profile,
+                (start_rate or 0) / self.workers,
+                warmup,
+            )
+            for _ in range(self.workers)
+        ]
+        print(
+            f"Starting open-loop test at {rate} requests/s sharded across "
+            f"{self.workers} worker processes"
+        )
+        shard_outputs = await self._submit(_run_open_loop_shard, jobs)
+        throughputs = [collected["throughput"] for _, collected in shard_outputs]
+        self.throughput = {
+            "target_rps": rate,
+            "scheduled_rps": round(sum(t["scheduled_rps"] for t in throughputs), 2),
+            "offered_rps": round(sum(t["offered_rps"] for t in throughputs), 2),
+            "achieved_rps": round(sum(t["achieved_rps"] for t in throughputs), 2),
+            "max_schedule_lag": max(t["max_schedule_lag"] for t in throughputs),
+            "total_time": max(t["total_time"] for t in throughputs),
+        }
+        return self._merge(shard_outputs)
+
+    def close(self):
+        self.executor.shutdown()